@@ -0,0 +1,161 @@
+"""Adaptive difficulty: per-user skill ratings and question selection.
+
+Each user carries a compact `skill` map on their document, one Elo-style
+entry per area:
+
+    {"overall": [1512.4, 37], "genre:rock": [1466.0, 9], "edu:moderate": [1580.2, 6]}
+
+i.e. [rating, answers seen]. Questions get a difficulty on the same scale
+(educational questions from their calibrated `rating` or hand-set `level`,
+track questions from option count and track popularity). The chance of a
+correct answer is the logistic Elo expectation lifted by the guessing
+floor of a multiple-choice question (1 / options), which makes it a
+3-parameter IRT model with a fixed discrimination.
+
+- `update()` is O(1) per answer: two entries move by K * (outcome - expected),
+  with K shrinking as an entry accumulates answers.
+- `choose_difficulty()` picks the option count whose expected success is
+  closest to ADAPTIVE_TARGET_SUCCESS.
+- `QuestionIndex` buckets the question bank by rating, so picking questions
+  near the target costs O(buckets + questions requested) whatever the size
+  of the bank.
+"""
+import math
+import os
+import random
+from typing import Dict, List, Optional
+
+BASE_RATING = 1500.0
+# hand-assigned educational levels before calibration
+LEVEL_RATINGS = {"easy": 1300.0, "moderate": 1500.0, "difficult": 1700.0}
+# track questions: more options is harder
+OPTION_RATINGS = {3: 1350.0, 4: 1500.0, 5: 1650.0}
+# rating points per unit of Spotify popularity below 50 (obscure = harder)
+POPULARITY_WEIGHT = 4.0
+TARGET_SUCCESS = float(os.environ.get("ADAPTIVE_TARGET_SUCCESS", "0.7"))
+K_MAX = 64.0
+K_MIN = 12.0
+BUCKET_WIDTH = 50.0
+
+
+def expected(rating: float, difficulty: float, options: int) -> float:
+    """Probability that a player of `rating` answers correctly."""
+    guess = 1.0 / options if options else 0.0
+    return guess + (1 - guess) / (1 + 10 ** ((difficulty - rating) / 400))
+
+
+def target_difficulty(rating: float, options: int, target: float = TARGET_SUCCESS) -> float:
+    """The question difficulty at which `expected()` equals `target`."""
+    guess = 1.0 / options if options else 0.0
+    p = min(max((target - guess) / (1 - guess), 0.01), 0.99)
+    return rating + 400 * math.log10(1 / p - 1)
+
+
+def k_factor(n: int) -> float:
+    return max(K_MIN, K_MAX / (1 + n / 10))
+
+
+def rating_of(skill: Optional[dict], key: str) -> List[float]:
+    entry = (skill or {}).get(key)
+    return list(entry) if entry else [BASE_RATING, 0]
+
+
+def skill_keys(question: dict) -> List[str]:
+    if "track" in question:
+        return ["overall", f"genre:{question['track'].get('genre', 'unknown')}"]
+    return ["overall", f"edu:{question.get('level', 'easy')}"]
+
+
+def track_rating(track: dict, options: int) -> float:
+    base = OPTION_RATINGS.get(options, BASE_RATING)
+    return base + (50 - (track.get("popularity") or 50)) * POPULARITY_WEIGHT
+
+
+def question_rating(question: dict) -> float:
+    """Difficulty of a question-bank entry: calibrated if available."""
+    if question.get("rating") is not None:
+        return question["rating"]
+    return LEVEL_RATINGS.get(question.get("level"), BASE_RATING)
+
+
+def update(skill: Optional[dict], question: dict, is_correct: bool, used_hint: bool) -> Dict[str, list]:
+    """New skill entries after one answer, as a `$set` on the user document."""
+    difficulty = question.get("rating", BASE_RATING)
+    options = len(question.get("options") or []) or 4
+    # a hinted correct answer is half a win
+    outcome = (0.5 if used_hint else 1.0) if is_correct else 0.0
+    changes = {}
+    for key in skill_keys(question):
+        rating, n = rating_of(skill, key)
+        rating += k_factor(n) * (outcome - expected(rating, difficulty, options))
+        changes[f"skill.{key}"] = [round(rating, 1), n + 1]
+    return changes
+
+
+def choose_difficulty(skill: Optional[dict], settings_table: dict) -> str:
+    """Name of the settings entry whose expected success is nearest the target."""
+    rating = rating_of(skill, "overall")[0]
+    return min(
+        settings_table,
+        key=lambda name: abs(expected(rating, OPTION_RATINGS.get(settings_table[name]["options"], BASE_RATING),
+                                      settings_table[name]["options"]) - TARGET_SUCCESS),
+    )
+
+
+def pick_tracks(tracks: list, skill: Optional[dict], k: int, options: int, rng=random) -> list:
+    """k tracks whose expected success is near the target, with some variety.
+
+    `tracks` is one fetch's worth (tens of tracks), so sorting it is cheap.
+    """
+    def distance(track):
+        rating = rating_of(skill, f"genre:{track.get('genre')}")[0]
+        return abs(expected(rating, track_rating(track, options), options) - TARGET_SUCCESS)
+
+    ranked = sorted(tracks, key=distance)
+    # sample from the closest 2k rather than always taking the same top k
+    return rng.sample(ranked[:2 * k], min(k, len(ranked)))
+
+
+class QuestionIndex:
+    """Question-bank entries bucketed by rating, per level and overall.
+
+    Rebuilt automatically when a different bank list is passed in (e.g.
+    after calibration reloads it). The indexed list is kept referenced and
+    compared by identity: an `id()` alone could be reused by a new list
+    once the old one is freed.
+    """
+
+    def __init__(self):
+        self._bank: Optional[list] = None
+        self.buckets: Dict[str, Dict[int, list]] = {}
+
+    def _ensure(self, bank: list):
+        if self._bank is bank:
+            return
+        buckets: Dict[str, Dict[int, list]] = {}
+        for q in bank:
+            b = int(question_rating(q) // BUCKET_WIDTH)
+            for level in ("all", q.get("level")):
+                buckets.setdefault(level, {}).setdefault(b, []).append(q)
+        self.buckets = buckets
+        self._bank = bank
+
+    def sample(self, bank: list, target: float, k: int, level: Optional[str] = None, rng=random) -> list:
+        """Up to k questions with ratings nearest `target`."""
+        self._ensure(bank)
+        buckets = self.buckets.get(level or "all", {})
+        if not buckets:
+            return []
+        centre = int(target // BUCKET_WIDTH)
+        lo, hi = min(buckets), max(buckets)
+        picked: list = []
+        # walk outwards from the target bucket: centre, +1, -1, +2, -2, ...
+        for offset in range(0, max(hi - centre, centre - lo) + 1):
+            for b in ((centre,) if offset == 0 else (centre + offset, centre - offset)):
+                bucket = buckets.get(b)
+                if bucket:
+                    need = k - len(picked)
+                    picked.extend(rng.sample(bucket, min(need, len(bucket))))
+                    if len(picked) >= k:
+                        return picked
+        return picked
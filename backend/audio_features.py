@@ -0,0 +1,208 @@
+"""Precomputed preview metadata: waveform, loudness gain and hook offset.
+
+A background job (AUDIO_ANALYSIS_INTERVAL_MINUTES) takes catalog tracks
+that have a preview but no analysis yet, downloads each preview once
+(through the preview proxy's disk cache when it is enabled) and stores
+
+    "audio": {"waveform": [0-100 x WAVEFORM_POINTS], "gain_db": -3.2,
+              "hook_ms": 11400, "duration_ms": 30000, "version": 1}
+
+on the `track_catalog` document. Quiz questions built from catalog tracks
+carry it in `track.audio`, so the client can draw the waveform, set the
+volume and start playback at the hook without decoding the clip first.
+
+Analysis (NumPy, on a 22.05 kHz mono decode):
+
+- waveform: peak amplitude per bin, scaled to the clip's peak
+- gain_db: brings the clip's RMS level to AUDIO_TARGET_DBFS, limited so the
+  peak stays below -1 dBFS (an RMS approximation, not a full LUFS meter)
+- hook_ms: start of the HOOK_SECONDS window with the highest combined
+  loudness and spectral flux (onset density), found with a cumulative sum
+
+MP3 decoding needs the `miniaudio` package; WAV is decoded with the
+standard library. Tracks whose preview is empty or can't be decoded and
+analysed get `audio.error` and are not retried until ANALYSIS_VERSION
+changes. A failed download (rate limit, provider or network error) leaves
+`audio` alone and sets `audio_retry_at`, AUDIO_RETRY_MINUTES after the
+first failure and doubling with each further one (at most a day).
+
+    python audio_features.py --limit 500
+"""
+import argparse
+import asyncio
+import io
+import logging
+import os
+import wave
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_VERSION = 1
+SAMPLE_RATE = 22050
+WAVEFORM_POINTS = int(os.environ.get("WAVEFORM_POINTS", "64"))
+HOOK_SECONDS = float(os.environ.get("HOOK_SECONDS", "10"))
+AUDIO_TARGET_DBFS = float(os.environ.get("AUDIO_TARGET_DBFS", "-16"))
+AUDIO_BATCH_SIZE = int(os.environ.get("AUDIO_BATCH_SIZE", "200"))
+AUDIO_CONCURRENCY = int(os.environ.get("AUDIO_CONCURRENCY", "4"))
+AUDIO_RETRY_MINUTES = float(os.environ.get("AUDIO_RETRY_MINUTES", "30"))
+MAX_RETRY_MINUTES = 24 * 60
+FRAME = 1024
+HOP = 512
+PEAK_CEILING_DBFS = -1.0
+
+
+def decode(data: bytes):
+    """Mono float32 samples in [-1, 1] at SAMPLE_RATE."""
+    import numpy as np
+
+    if data[:4] == b"RIFF":
+        with wave.open(io.BytesIO(data)) as w:
+            if w.getsampwidth() != 2:
+                raise ValueError(f"Unsupported WAV sample width {w.getsampwidth()}")
+            channels, rate = w.getnchannels(), w.getframerate()
+            samples = np.frombuffer(w.readframes(w.getnframes()), dtype="<i2").astype(np.float32) / 32768
+        if channels > 1:
+            samples = samples.reshape(-1, channels).mean(axis=1)
+        if rate != SAMPLE_RATE and len(samples):
+            # linear resampling is plenty for level and onset analysis
+            positions = np.arange(0, len(samples), rate / SAMPLE_RATE)
+            samples = np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+        return samples
+    try:
+        import miniaudio
+    except ImportError:
+        raise RuntimeError("Decoding MP3 previews needs the miniaudio package")
+    decoded = miniaudio.decode(data, output_format=miniaudio.SampleFormat.SIGNED16, nchannels=1, sample_rate=SAMPLE_RATE)
+    return np.asarray(decoded.samples, dtype=np.float32) / 32768
+
+
+def analyze(samples, sample_rate: int = SAMPLE_RATE, points: int = WAVEFORM_POINTS, hook_seconds: float = HOOK_SECONDS) -> dict:
+    import numpy as np
+
+    n = len(samples)
+    if n < FRAME:
+        raise ValueError("Clip too short to analyse")
+    duration_ms = round(n / sample_rate * 1000)
+
+    # waveform: peak per bin
+    peak = float(np.max(np.abs(samples))) or 1e-9
+    usable = n - n % points
+    bins = np.abs(samples[:usable]).reshape(points, -1).max(axis=1)
+    waveform = np.round(bins / peak * 100).astype(int).tolist()
+
+    # loudness gain, capped by the peak headroom
+    rms = float(np.sqrt(np.mean(np.square(samples, dtype=np.float64)))) or 1e-9
+    gain_db = AUDIO_TARGET_DBFS - 20 * np.log10(rms)
+    gain_db = min(gain_db, PEAK_CEILING_DBFS - 20 * np.log10(peak))
+
+    # hook: frame loudness + spectral flux, best window by cumulative sum
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FRAME)[::HOP]
+    window = np.hanning(FRAME).astype(np.float32)
+    spectrum = np.abs(np.fft.rfft(frames * window, axis=1))
+    energy = 10 * np.log10(np.mean(np.square(frames), axis=1) + 1e-10)
+    flux = np.concatenate(([0.0], np.maximum(np.diff(spectrum, axis=0), 0).sum(axis=1)))
+
+    def z(x):
+        return (x - x.mean()) / (x.std() or 1.0)
+
+    score = z(energy) + z(flux)
+    span = max(1, min(len(score), int(hook_seconds * sample_rate / HOP)))
+    sums = np.concatenate(([0.0], np.cumsum(score)))
+    window_scores = sums[span:] - sums[:-span]
+    hook_frame = int(np.argmax(window_scores))
+    return {
+        "waveform": waveform,
+        "gain_db": round(float(gain_db), 1),
+        "hook_ms": round(hook_frame * HOP / sample_rate * 1000),
+        "duration_ms": duration_ms,
+        "version": ANALYSIS_VERSION,
+    }
+
+
+def analyze_bytes(data: bytes) -> dict:
+    return analyze(decode(data))
+
+
+async def analyze_pending(db, load_audio: Callable[[dict], Awaitable[Optional[bytes]]],
+                          limit: int = AUDIO_BATCH_SIZE, concurrency: int = AUDIO_CONCURRENCY, catalog=None,
+                          retry_minutes: float = AUDIO_RETRY_MINUTES) -> dict:
+    """Analyse up to `limit` catalog tracks that have a preview but no (current) analysis."""
+    report = {"analysed": 0, "failed": 0, "deferred": 0}
+    now = datetime.now(timezone.utc)
+    query = {"has_preview": True, "$and": [
+        {"$or": [{"audio": {"$exists": False}}, {"audio.version": {"$lt": ANALYSIS_VERSION}}]},
+        {"$or": [{"audio_retry_at": {"$exists": False}}, {"audio_retry_at": {"$lte": now.isoformat()}}]},
+    ]}
+    tracks = await db.track_catalog.find(
+        query, {"_id": 1, "id": 1, "name": 1, "artists": 1, "audio_attempts": 1}).limit(limit).to_list(limit)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(track: dict):
+        async with semaphore:
+            try:
+                data = await load_audio(track)
+            except Exception as e:
+                # transient (rate limit, provider, network): try again later
+                attempts = track.get("audio_attempts", 0) + 1
+                delay = min(retry_minutes * 2 ** (attempts - 1), MAX_RETRY_MINUTES)
+                logger.warning(f"Preview download failed for {track['_id']}, retrying in {delay:g} min: {e}")
+                await db.track_catalog.update_one({"_id": track["_id"]}, {"$set": {
+                    "audio_attempts": attempts, "audio_retry_at": (now + timedelta(minutes=delay)).isoformat()}})
+                report["deferred"] += 1
+                return
+            try:
+                if not data:
+                    raise ValueError("No preview audio")
+                features = await asyncio.to_thread(analyze_bytes, data)
+                report["analysed"] += 1
+            except Exception as e:
+                logger.warning(f"Audio analysis failed for {track['_id']}: {e}")
+                features = {"error": str(e) or type(e).__name__, "version": ANALYSIS_VERSION,
+                            "failed_at": datetime.now(timezone.utc).isoformat()}
+                report["failed"] += 1
+        await db.track_catalog.update_one({"_id": track["_id"]}, {
+            "$set": {"audio": features}, "$unset": {"audio_attempts": "", "audio_retry_at": ""}})
+        if catalog is not None:
+            catalog.annotate(track["_id"], audio=features)
+
+    await asyncio.gather(*(run(t) for t in tracks))
+    return report
+
+
+async def run_periodically(db, load_audio, interval_minutes: float, get_catalog: Callable):
+    """Background loop used by the server when AUDIO_ANALYSIS_INTERVAL_MINUTES is set."""
+    while True:
+        await asyncio.sleep(interval_minutes * 60)
+        try:
+            report = await analyze_pending(db, load_audio, catalog=get_catalog())
+            if any(report.values()):
+                logger.info(f"Preview audio analysis: {report}")
+        except Exception as e:
+            logger.error(f"Preview audio analysis failed: {e}")
+
+
+async def main():
+    from dotenv import load_dotenv
+
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Precompute waveform, gain and hook offset for catalog previews.")
+    parser.add_argument("--limit", type=int, default=AUDIO_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=AUDIO_CONCURRENCY)
+    args = parser.parse_args()
+
+    # downloads go through the server's preview lookup (and proxy cache, if enabled)
+    import catalog
+    import server
+
+    await server.deps.warm()
+    server.deps.use_track_catalog(await catalog.Catalog.load(server.deps.db))
+    report = await analyze_pending(server.deps.db, server.load_preview_audio, args.limit, args.concurrency)
+    print(f"Analysed {report['analysed']} previews, {report['failed']} failed, {report['deferred']} to retry")
+    await server.deps.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
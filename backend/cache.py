@@ -0,0 +1,385 @@
+"""Cache tier shared by every worker process.
+
+With `uvicorn --workers N` (or gunicorn, see gunicorn.conf.py) each worker
+is a separate process, so a plain dict cache would be duplicated N times
+and each worker would fetch its own Spotify client-credentials token. The
+backends here share state across workers:
+
+- `MemoryCache`  in-process LRU; correct only with a single worker
+- `RedisCache`   any Redis-compatible server (CACHE_URL=redis://...)
+- `MongoCache`   the app's own MongoDB (`cache` collection, TTL index)
+
+For the shared backends `TieredCache` keeps a small per-worker near cache
+in front (CACHE_LOCAL_TTL_SECONDS). Writes, deletes and counter bumps are
+broadcast on an invalidation channel (Redis pub/sub, or a polled
+`cache_invalidations` collection for Mongo) so other workers drop their
+local copy instead of serving it until it expires.
+
+Values must be JSON/BSON-compatible; `None` means "not cached". The memory
+backend hands back the stored object itself, so callers must not mutate it.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory").lower()
+CACHE_URL = os.environ.get("CACHE_URL", "redis://localhost:6379/0")
+CACHE_PREFIX = os.environ.get("CACHE_PREFIX", "musicquiz:")
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "10000"))
+# near-cache lifetime in front of redis/mongo; 0 disables it
+CACHE_LOCAL_TTL_SECONDS = float(os.environ.get("CACHE_LOCAL_TTL_SECONDS", "5"))
+# how often MongoCache workers poll for invalidations
+CACHE_POLL_SECONDS = float(os.environ.get("CACHE_POLL_SECONDS", "1"))
+# blocking calls from worker threads (spotipy token handler) give up after this
+SYNC_TIMEOUT_SECONDS = 2.0
+
+
+def worker_id() -> str:
+    # computed per call: with gunicorn --preload the module is imported
+    # before workers fork
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Cache:
+    """Async key/value cache with per-key TTLs and integer counters."""
+
+    name = "base"
+
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Any:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    async def delete(self, *keys: str):
+        raise NotImplementedError
+
+    async def incr(self, key: str) -> int:
+        """Atomically increment a counter (created at 0) and return it."""
+        raise NotImplementedError
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+
+    async def stop(self):
+        pass
+
+    def _count(self, value):
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "hits": self.hits, "misses": self.misses}
+
+    # Blocking access for code running in worker threads (spotipy's token
+    # handler). Not usable from the event loop thread itself.
+    def get_sync(self, key: str) -> Any:
+        if not self._can_block():
+            return None
+        future = asyncio.run_coroutine_threadsafe(self.get(key), self.loop)
+        try:
+            return future.result(SYNC_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.warning(f"Cache get for {key} failed: {e}")
+            return None
+
+    def set_sync(self, key: str, value: Any, ttl: Optional[float] = None):
+        if not self._can_block():
+            return
+        future = asyncio.run_coroutine_threadsafe(self.set(key, value, ttl), self.loop)
+        try:
+            future.result(SYNC_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.warning(f"Cache set for {key} failed: {e}")
+
+    def _can_block(self) -> bool:
+        if self.loop is None or not self.loop.is_running():
+            return False
+        try:
+            return asyncio.get_running_loop() is not self.loop
+        except RuntimeError:
+            return True
+
+
+class MemoryCache(Cache):
+    name = "memory"
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        super().__init__()
+        self.max_entries = max_entries
+        # key -> (expires_at or None, value), oldest first
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_sync(self, key: str) -> Any:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return self._count(None)
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self.entries[key]
+                return self._count(None)
+            self.entries.move_to_end(key)
+            return self._count(value)
+
+    def set_sync(self, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete_sync(self, keys: Iterable[str]):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    async def get(self, key):
+        return self.get_sync(key)
+
+    async def set(self, key, value, ttl=None):
+        self.set_sync(key, value, ttl)
+
+    async def delete(self, *keys):
+        self.delete_sync(keys)
+
+    async def incr(self, key):
+        with self.lock:
+            expires_at, value = self.entries.get(key, (None, 0))
+            value = int(value) + 1
+            self.entries[key] = (expires_at, value)
+            return value
+
+
+class RedisCache(Cache):
+    name = "redis"
+
+    def __init__(self, url: str = CACHE_URL, prefix: str = CACHE_PREFIX):
+        super().__init__()
+        # optional dependency, only needed for CACHE_BACKEND=redis
+        import redis.asyncio as aioredis
+
+        self.redis = aioredis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.channel = f"{prefix}invalidate"
+
+    async def get(self, key):
+        raw = await self.redis.get(self.prefix + key)
+        return self._count(json.loads(raw) if raw is not None else None)
+
+    async def set(self, key, value, ttl=None):
+        await self.redis.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000) if ttl else None)
+
+    async def delete(self, *keys):
+        if keys:
+            await self.redis.delete(*(self.prefix + k for k in keys))
+
+    async def incr(self, key):
+        return await self.redis.incr(self.prefix + key)
+
+    async def publish_invalidation(self, keys: list):
+        await self.redis.publish(self.channel, json.dumps({"worker": worker_id(), "keys": keys}))
+
+    async def listen_invalidations(self, callback):
+        pubsub = self.redis.pubsub()
+        await pubsub.subscribe(self.channel)
+        try:
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                data = json.loads(message["data"])
+                if data["worker"] != worker_id():
+                    callback(data["keys"])
+        finally:
+            await pubsub.close()
+
+    async def stop(self):
+        await self.redis.close()
+
+
+class MongoCache(Cache):
+    name = "mongo"
+
+    def __init__(self, db, collection: str = "cache"):
+        super().__init__()
+        self.collection = db[collection]
+        self.invalidations = db[f"{collection}_invalidations"]
+
+    async def start(self):
+        await super().start()
+        # Mongo's TTL monitor runs about once a minute; reads also check `expires`
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+        await self.invalidations.create_index("at", expireAfterSeconds=300)
+
+    async def get(self, key):
+        doc = await self.collection.find_one({"_id": key})
+        if doc is None or (doc.get("expires") is not None and doc["expires"] <= time.time()):
+            return self._count(None)
+        return self._count(doc["value"])
+
+    async def set(self, key, value, ttl=None):
+        update = {"value": value, "expires": None, "expires_at": None}
+        if ttl:
+            update["expires"] = time.time() + ttl
+            update["expires_at"] = datetime.now(timezone.utc) + timedelta(seconds=ttl)
+        await self.collection.update_one({"_id": key}, {"$set": update}, upsert=True)
+
+    async def delete(self, *keys):
+        if keys:
+            await self.collection.delete_many({"_id": {"$in": list(keys)}})
+
+    async def incr(self, key):
+        from pymongo import ReturnDocument
+
+        doc = await self.collection.find_one_and_update(
+            {"_id": key}, {"$inc": {"value": 1}}, upsert=True, return_document=ReturnDocument.AFTER)
+        return doc["value"]
+
+    async def publish_invalidation(self, keys: list):
+        await self.invalidations.insert_one({"worker": worker_id(), "keys": keys, "at": datetime.now(timezone.utc)})
+
+    async def listen_invalidations(self, callback):
+        # re-read a small overlap each poll since clocks across workers and
+        # ObjectId ordering within a second aren't strict; `seen` skips
+        # documents already handled inside that window
+        overlap = timedelta(seconds=2)
+        since = datetime.now(timezone.utc)
+        seen = {}
+        while True:
+            await asyncio.sleep(CACHE_POLL_SECONDS)
+            poll_start = datetime.now(timezone.utc)
+            try:
+                async for doc in self.invalidations.find({"at": {"$gte": since - overlap}, "worker": {"$ne": worker_id()}}):
+                    if doc["_id"] not in seen:
+                        seen[doc["_id"]] = poll_start
+                        callback(doc["keys"])
+                since = poll_start
+                seen = {k: t for k, t in seen.items() if t >= since - overlap}
+            except Exception as e:
+                logger.warning(f"Cache invalidation poll failed: {e}")
+
+
+class TieredCache(Cache):
+    """Per-worker near cache in front of a shared backend."""
+
+    def __init__(self, shared: Cache, local_ttl: float = CACHE_LOCAL_TTL_SECONDS, max_entries: int = CACHE_MAX_ENTRIES):
+        super().__init__()
+        self.shared = shared
+        self.local = MemoryCache(max_entries)
+        self.local_ttl = local_ttl
+        self.name = f"{shared.name}+local"
+        self._listener: Optional[asyncio.Task] = None
+
+    async def get(self, key):
+        value = self.local.get_sync(key)
+        if value is not None:
+            return self._count(value)
+        value = await self.shared.get(key)
+        if value is not None:
+            self.local.set_sync(key, value, self.local_ttl)
+        return self._count(value)
+
+    async def set(self, key, value, ttl=None):
+        await self.shared.set(key, value, ttl)
+        self.local.set_sync(key, value, min(ttl, self.local_ttl) if ttl else self.local_ttl)
+        await self._broadcast([key])
+
+    async def delete(self, *keys):
+        await self.shared.delete(*keys)
+        self.local.delete_sync(keys)
+        await self._broadcast(list(keys))
+
+    async def incr(self, key):
+        value = await self.shared.incr(key)
+        self.local.set_sync(key, value, self.local_ttl)
+        await self._broadcast([key])
+        return value
+
+    async def _broadcast(self, keys: list):
+        try:
+            await self.shared.publish_invalidation(keys)
+        except Exception as e:
+            # other workers fall back to local_ttl expiry
+            logger.warning(f"Cache invalidation broadcast failed: {e}")
+
+    async def _listen(self):
+        while True:
+            try:
+                await self.shared.listen_invalidations(self.local.delete_sync)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cache invalidation listener stopped: {e}; reconnecting")
+                # anything missed while disconnected is bounded by local_ttl
+                await asyncio.sleep(1)
+
+    async def start(self):
+        await super().start()
+        await self.shared.start()
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+        await self.shared.stop()
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["shared_hits"] = self.shared.hits
+        stats["shared_misses"] = self.shared.misses
+        return stats
+
+
+def create_cache(db=None, backend: Optional[str] = None) -> Cache:
+    backend = (backend or CACHE_BACKEND).lower()
+    if backend == "redis":
+        shared = RedisCache()
+    elif backend == "mongo" and db is not None:
+        shared = MongoCache(db)
+    else:
+        if backend != "memory":
+            logger.warning(f"Unknown CACHE_BACKEND '{backend}', using in-process memory cache")
+        return MemoryCache()
+    return TieredCache(shared) if CACHE_LOCAL_TTL_SECONDS > 0 else shared
+
+
+def spotify_token_handler(cache: Cache, key: str = "spotify:client_token"):
+    """spotipy CacheHandler that keeps the client-credentials token in `cache`.
+
+    Every worker then reuses one token instead of each fetching its own
+    (and writing it to a `.cache` file in the working directory).
+    """
+    from spotipy.cache_handler import CacheHandler
+
+    class SharedTokenHandler(CacheHandler):
+        def get_cached_token(self):
+            return cache.get_sync(key)
+
+        def save_token_to_cache(self, token_info):
+            ttl = max(token_info.get("expires_at", 0) - time.time(), 1)
+            cache.set_sync(key, token_info, ttl)
+
+    return SharedTokenHandler()
@@ -0,0 +1,237 @@
+"""Per-question difficulty calibration from answer logs.
+
+Streams the `answers` arrays of completed educational sessions and keeps
+running totals per question id in `question_stats`: attempts, correct
+answers, hint usage and answer time. Each run only reads sessions completed
+after the stored checkpoint (`completed_at`, then `id`), so its cost is
+proportional to new answers, not to the whole history. Compacted sessions
+keep `answers`, so calibration may run before or after lifecycle.py.
+
+Sessions completed in the last CALIBRATION_SETTLE_SECONDS are left for the
+next run. `completed_at` comes from the clock of whichever worker completed
+the session (an answer, or a timer on another worker), so a session can be
+written with a `completed_at` slightly behind sessions already stored; the
+lag keeps the checkpoint from passing it before it lands.
+
+A batch is claimed by moving the checkpoint with a compare-and-set before
+its totals are added. Concurrent runs (several workers, or a cron job next
+to the server) therefore never count a session twice; a crash between
+claim and write loses that batch rather than double counting it.
+
+The calibrated difficulty is the rating (adaptive.py scale) at which an
+average (1500) player gets the observed success rate, smoothed toward the
+hand-assigned level while a question has few attempts. `apply()` overlays
+it on the question bank as `rating`, `calibrated_level`, `accuracy`,
+`hint_rate` and `avg_answer_ms`; the hand-set `level` (which drives
+scoring) is left alone.
+
+    python calibration.py                 # process new answers, print the biggest shifts
+    python calibration.py --export calibrated_questions.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import Optional
+
+from pymongo import UpdateOne
+
+import adaptive
+
+logger = logging.getLogger(__name__)
+
+EDUCATIONAL_MODES = ("educational", "educationalquiz", "education")
+BATCH_SIZE = 1000
+STATE_ID = "question_calibration"
+# attempts before a calibrated rating replaces the hand-set level
+CALIBRATION_MIN_ATTEMPTS = int(os.environ.get("CALIBRATION_MIN_ATTEMPTS", "10"))
+# only sessions completed at least this long ago are consumed
+CALIBRATION_SETTLE_SECONDS = float(os.environ.get("CALIBRATION_SETTLE_SECONDS", "300"))
+# pseudo-attempts at the level's expected success rate (Bayesian smoothing)
+PRIOR_ATTEMPTS = 5
+LEVEL_BOUNDS = ((1400, "easy"), (1600, "moderate"))
+
+
+async def ensure_indexes(db):
+    await db.quiz_sessions.create_index([("completed", 1), ("completed_at", 1), ("id", 1)])
+
+
+async def get_checkpoint(db) -> dict:
+    state = await db.calibration_state.find_one({"_id": STATE_ID})
+    return {"completed_at": state["completed_at"], "id": state["id"]} if state else {"completed_at": "", "id": ""}
+
+
+async def claim(db, old: dict, new: dict) -> bool:
+    """Move the checkpoint from `old` to `new` unless another run got there first."""
+    if not old["completed_at"]:
+        try:
+            await db.calibration_state.insert_one({"_id": STATE_ID, **new, "updated_at": datetime.now(timezone.utc).isoformat()})
+            return True
+        except Exception:
+            return False
+    result = await db.calibration_state.update_one(
+        {"_id": STATE_ID, "completed_at": old["completed_at"], "id": old["id"]},
+        {"$set": {**new, "updated_at": datetime.now(timezone.utc).isoformat()}},
+    )
+    return result.modified_count == 1
+
+
+def accumulate(totals: dict, answers: list):
+    for a in answers:
+        qid = a.get("question_id")
+        if qid is None:
+            continue
+        t = totals.setdefault(qid, {"attempts": 0, "correct": 0, "hinted_correct": 0, "hints": 0, "time_ms": 0, "timed": 0})
+        t["attempts"] += 1
+        if a.get("is_correct"):
+            t["correct"] += 1
+            if a.get("used_hint"):
+                t["hinted_correct"] += 1
+        if a.get("used_hint"):
+            t["hints"] += 1
+        if a.get("elapsed_ms") is not None:
+            t["time_ms"] += a["elapsed_ms"]
+            t["timed"] += 1
+
+
+async def calibrate(db, batch_size: int = BATCH_SIZE, max_batches: Optional[int] = None,
+                    settle_seconds: float = CALIBRATION_SETTLE_SECONDS) -> dict:
+    """Fold answers from sessions completed since the checkpoint (and before the settle lag) into `question_stats`."""
+    report = {"sessions": 0, "answers": 0, "questions": set(), "batches": 0, "conflicts": 0}
+    settled = (datetime.now(timezone.utc) - timedelta(seconds=settle_seconds)).isoformat()
+    while max_batches is None or report["batches"] < max_batches:
+        checkpoint = await get_checkpoint(db)
+        query = {
+            "completed": True,
+            "mode": {"$in": list(EDUCATIONAL_MODES)},
+            "$and": [
+                {"completed_at": {"$lt": settled}},
+                {"$or": [
+                    {"completed_at": {"$gt": checkpoint["completed_at"]}},
+                    {"completed_at": checkpoint["completed_at"], "id": {"$gt": checkpoint["id"]}},
+                ]},
+            ],
+        }
+        batch = await db.quiz_sessions.find(
+            query, {"_id": 0, "id": 1, "completed_at": 1, "answers.question_id": 1, "answers.is_correct": 1,
+                    "answers.used_hint": 1, "answers.elapsed_ms": 1}
+        ).sort([("completed_at", 1), ("id", 1)]).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+        last = batch[-1]
+        if not await claim(db, checkpoint, {"completed_at": last["completed_at"], "id": last["id"]}):
+            # another run processed this range; start again from its checkpoint
+            report["conflicts"] += 1
+            if report["conflicts"] > 3:
+                break
+            continue
+
+        totals: dict = {}
+        for session in batch:
+            accumulate(totals, session.get("answers", []))
+            report["answers"] += len(session.get("answers", []))
+        if totals:
+            await db.question_stats.bulk_write(
+                [UpdateOne({"_id": qid}, {"$inc": t}, upsert=True) for qid, t in totals.items()], ordered=False
+            )
+        report["sessions"] += len(batch)
+        report["questions"].update(totals)
+        report["batches"] += 1
+        if len(batch) < batch_size:
+            break
+    report["questions"] = len(report["questions"])
+    return report
+
+
+async def load_stats(db) -> dict:
+    return {doc["_id"]: doc async for doc in db.question_stats.find({})}
+
+
+def calibrated_rating(stats: dict, question: dict) -> float:
+    """Difficulty rating implied by the observed success rate."""
+    options = len(question.get("choices") or question.get("options") or []) or 4
+    prior_rating = adaptive.LEVEL_RATINGS.get(question.get("level"), adaptive.BASE_RATING)
+    prior_p = adaptive.expected(adaptive.BASE_RATING, prior_rating, options)
+    # hinted correct answers count as half, as in adaptive.update()
+    wins = stats["correct"] - 0.5 * stats.get("hinted_correct", 0)
+    p = (wins + PRIOR_ATTEMPTS * prior_p) / (stats["attempts"] + PRIOR_ATTEMPTS)
+    return round(adaptive.target_difficulty(adaptive.BASE_RATING, options, p), 1)
+
+
+def level_for(rating: float) -> str:
+    for bound, level in LEVEL_BOUNDS:
+        if rating < bound:
+            return level
+    return "difficult"
+
+
+def apply(bank: list, stats: dict, min_attempts: int = CALIBRATION_MIN_ATTEMPTS) -> list:
+    """A copy of the question bank with calibration fields filled in."""
+    calibrated = []
+    for q in bank:
+        s = stats.get(q.get("id"))
+        if s and s["attempts"] >= min_attempts:
+            rating = calibrated_rating(s, q)
+            q = dict(q, rating=rating, calibrated_level=level_for(rating),
+                     accuracy=round(s["correct"] / s["attempts"], 3),
+                     hint_rate=round(s["hints"] / s["attempts"], 3),
+                     avg_answer_ms=round(s["time_ms"] / s["timed"]) if s.get("timed") else None,
+                     attempts=s["attempts"])
+        calibrated.append(q)
+    return calibrated
+
+
+async def run_periodically(db, interval_minutes: float, on_update):
+    """Background loop used by the server when CALIBRATION_INTERVAL_MINUTES is set."""
+    while True:
+        await asyncio.sleep(interval_minutes * 60)
+        try:
+            report = await calibrate(db)
+            if report["sessions"]:
+                logger.info(f"Question calibration: {report}")
+            await on_update(await load_stats(db))
+        except Exception as e:
+            logger.error(f"Question calibration failed: {e}")
+
+
+async def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    import quiz_data
+
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Calibrate question difficulty from answer logs.")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--settle-seconds", type=float, default=CALIBRATION_SETTLE_SECONDS,
+                        help="skip sessions completed more recently than this")
+    parser.add_argument("--min-attempts", type=int, default=CALIBRATION_MIN_ATTEMPTS)
+    parser.add_argument("--top", type=int, default=15, help="show the questions furthest from their hand-set level")
+    parser.add_argument("--export", help="write the calibrated question bank to this JSON file")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL") or "mongodb://localhost:27017")
+    db = client[os.environ.get('DB_NAME', 'musicquiz')]
+    await ensure_indexes(db)
+    report = await calibrate(db, args.batch_size, settle_seconds=args.settle_seconds)
+    stats = await load_stats(db)
+    client.close()
+
+    print(f"Processed {report['sessions']} sessions, {report['answers']} answers, {report['questions']} questions")
+    bank = apply(quiz_data.questions, stats, args.min_attempts)
+    changed = [q for q in bank if "rating" in q]
+    changed.sort(key=lambda q: abs(q["rating"] - adaptive.LEVEL_RATINGS.get(q.get("level"), adaptive.BASE_RATING)), reverse=True)
+    print(f"{len(changed)} of {len(bank)} questions have at least {args.min_attempts} attempts")
+    for q in changed[:args.top]:
+        print(f"  #{q['id']:<4} {q.get('level', '?'):>9} -> {q['calibrated_level']:<9} rating {q['rating']:>7} "
+              f"accuracy {q['accuracy']:.0%} hints {q['hint_rate']:.0%} attempts {q['attempts']}")
+    if args.export:
+        Path(args.export).write_text(json.dumps(bank, indent=2))
+        print(f"Wrote calibrated bank to {args.export}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,229 @@
+"""Offline track catalog.
+
+Track quizzes normally search Spotify (and Deezer for previews) while the
+player waits. The catalog crawls the same genre, artist and mood queries
+ahead of time, through the server's own fetch pipeline
+(`fetch_spotify_tracks`, so tracks are normalized and preview-enriched
+exactly as live ones), and stores them in `track_catalog`:
+
+    {"_id": track id, "name", "artist", "artists", "album", "album_art",
+     "spotify_url", "popularity", "has_preview", "genres": [...],
+     "moods": [...], "seed_artists": [...], "first_seen", "crawled_at"}
+
+Labels come from the query that found a track and accumulate with
+`$addToSet`, so a track found by "rock anthems" and "workout energy" is
+both rock and energetic. Mongo indexes cover genres, moods, seed artists
+and popularity.
+
+At runtime the server keeps an in-memory `Catalog` (id -> track plus one
+dict per label), loaded at startup and updated in place by the server's
+own crawls, so sampling a quiz's tracks costs no network round trips.
+Draws are weighted through one weight tree (sampling.WeightTree) per label
+and popularity bias: O(log n) per track drawn. `bias` > 0 favours popular
+tracks (easy), < 0 obscure ones (hard), and tracks without a preview are
+down-weighted. A tree is built on a label's first draw at that bias, and an
+upsert then adds or re-weights the track in each tree of its labels in
+O(log n), so crawls running next to quizzes never force a rebuild. Deezer
+preview URLs are signed and expire, so only `has_preview` is relied on; the
+server re-resolves the preview URLs of the handful of tracks it actually
+picks.
+
+Crawl on a schedule (CATALOG_CRAWL_INTERVAL_MINUTES) or by hand:
+
+    python catalog.py                    # crawl every query once
+    python catalog.py --stats            # counts per genre / mood / artist
+"""
+import argparse
+import asyncio
+import logging
+import math
+import os
+import random
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+import sampling
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "track_catalog"
+# Spotify's maximum page size for search
+CATALOG_TRACKS_PER_QUERY = int(os.environ.get("CATALOG_TRACKS_PER_QUERY", "50"))
+CATALOG_CRAWL_CONCURRENCY = int(os.environ.get("CATALOG_CRAWL_CONCURRENCY", "2"))
+LABEL_FIELDS = ("genres", "moods", "seed_artists")
+TRACK_FIELDS = ("id", "name", "artist", "artists", "album", "album_art", "spotify_url", "popularity")
+# weight of a track without a Deezer preview relative to one with
+CATALOG_NO_PREVIEW_WEIGHT = float(os.environ.get("CATALOG_NO_PREVIEW_WEIGHT", "0.25"))
+# popularity points per e-fold of weight at bias 1
+POPULARITY_SCALE = 25.0
+
+# (query, labels) pairs, e.g. ("rock anthems", {"genres": ["rock"]})
+CrawlPlan = List[Tuple[str, Dict[str, List[str]]]]
+
+
+async def ensure_indexes(db):
+    coll = db[COLLECTION]
+    await coll.create_index([("genres", 1), ("popularity", -1)])
+    await coll.create_index([("moods", 1), ("popularity", -1)])
+    await coll.create_index("seed_artists")
+    await coll.create_index([("popularity", -1)])
+
+
+async def crawl(db, fetch: Callable[[list, int], Awaitable[list]], plan: CrawlPlan,
+                limit_per_query: int = CATALOG_TRACKS_PER_QUERY,
+                concurrency: int = CATALOG_CRAWL_CONCURRENCY, catalog: Optional["Catalog"] = None) -> dict:
+    """Run every query in `plan` through `fetch` and upsert the results.
+
+    When `catalog` is given, the same upserts are applied to it as they land.
+    """
+    report = {"queries": 0, "failed": 0, "tracks": 0, "new": 0}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(query: str, labels: dict):
+        async with semaphore:
+            try:
+                tracks = await fetch([query], limit_per_query)
+            except Exception as e:
+                logger.warning(f"Catalog crawl failed for '{query}': {e}")
+                report["failed"] += 1
+                return
+        now = datetime.now(timezone.utc).isoformat()
+        ops = []
+        for t in tracks:
+            fields = {**{f: t.get(f) for f in TRACK_FIELDS}, "has_preview": bool(t.get("preview_url"))}
+            update = {"$set": {**fields, "crawled_at": now}, "$setOnInsert": {"first_seen": now}}
+            add = {field: {"$each": values} for field, values in labels.items() if values}
+            if add:
+                update["$addToSet"] = add
+            ops.append(UpdateOne({"_id": t["id"]}, update, upsert=True))
+            if catalog is not None:
+                catalog.upsert(fields, labels)
+        if ops:
+            result = await db[COLLECTION].bulk_write(ops, ordered=False)
+            report["new"] += result.upserted_count
+        report["queries"] += 1
+        report["tracks"] += len(ops)
+
+    await asyncio.gather(*(run(query, labels) for query, labels in plan))
+    return report
+
+
+async def run_periodically(db, fetch, plan: CrawlPlan, interval_minutes: float, get_catalog: Callable[[], "Catalog"]):
+    """Background loop used by the server when CATALOG_CRAWL_INTERVAL_MINUTES is set."""
+    while True:
+        await asyncio.sleep(interval_minutes * 60)
+        try:
+            report = await crawl(db, fetch, plan, catalog=get_catalog())
+            logger.info(f"Track catalog crawl: {report}")
+        except Exception as e:
+            logger.error(f"Track catalog crawl failed: {e}")
+
+
+def track_weight(track: dict, bias: float = 0.0) -> float:
+    popularity = track.get("popularity")
+    weight = math.exp(bias * ((50 if popularity is None else popularity) - 50) / POPULARITY_SCALE)
+    return weight if track.get("has_preview") else weight * CATALOG_NO_PREVIEW_WEIGHT
+
+
+class Catalog:
+    """In-memory snapshot of `track_catalog` with weighted per-label sampling."""
+
+    def __init__(self, tracks: Optional[list] = None):
+        self.tracks: Dict[str, dict] = {}
+        self.by_label: Dict[str, Dict[str, Dict[str, dict]]] = {field: {} for field in LABEL_FIELDS}
+        # (field, label) -> {bias: WeightTree}, built on first draw and updated by upserts
+        self._tables: Dict[Tuple[str, str], Dict[float, sampling.WeightTree]] = {}
+        for t in tracks or ():
+            self.upsert(t)
+
+    def upsert(self, track: dict, labels: Optional[Dict[str, List[str]]] = None):
+        """Add or update a track, merging its labels with the ones it already has."""
+        current = self.tracks.get(track["id"], {})
+        merged = {**current, **track}
+        for field in LABEL_FIELDS:
+            values = list(current.get(field) or ())
+            for label in list(track.get(field) or ()) + list((labels or {}).get(field) or ()):
+                if label not in values:
+                    values.append(label)
+            merged[field] = values
+            for label in values:
+                self.by_label[field].setdefault(label, {})[track["id"]] = merged
+                for bias, table in self._tables.get((field, label), {}).items():
+                    table.set(track["id"], merged, track_weight(merged, bias))
+        self.tracks[track["id"]] = merged
+
+    def annotate(self, track_id: str, **fields):
+        """Set fields that don't affect sampling weights (e.g. `audio`) without rebuilding tables."""
+        track = self.tracks.get(track_id)
+        if track is not None:
+            track.update(fields)
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def count(self, field: str, label: str) -> int:
+        return len(self.by_label[field].get(label, ()))
+
+    def _table(self, field: str, label: str, bias: float) -> sampling.WeightTree:
+        tables = self._tables.setdefault((field, label), {})
+        table = tables.get(bias)
+        if table is None:
+            pool = self.by_label[field].get(label, {})
+            table = tables[bias] = sampling.WeightTree(
+                (track_id, t, track_weight(t, bias)) for track_id, t in pool.items())
+        return table
+
+    def sample(self, field: str, label: str, k: int, bias: float = 0.0, rng=random) -> List[dict]:
+        """Up to k distinct weighted tracks with `label`, as fresh dicts the caller may modify."""
+        if not self.count(field, label):
+            return []
+        return [self._copy(t) for t in self._table(field, label, bias).draw_distinct(k, rng)]
+
+    @staticmethod
+    def _copy(track: dict) -> dict:
+        copy = {**{f: track.get(f) for f in TRACK_FIELDS}, "preview_url": None, "has_preview": track.get("has_preview", False)}
+        audio = track.get("audio")
+        if audio and "error" not in audio:
+            copy["audio"] = {k: v for k, v in audio.items() if k != "version"}
+        return copy
+
+    @classmethod
+    async def load(cls, db) -> "Catalog":
+        projection = {"_id": 0, "first_seen": 0, "crawled_at": 0, "audio_attempts": 0, "audio_retry_at": 0}
+        return cls([doc async for doc in db[COLLECTION].find({}, projection)])
+
+
+async def main():
+    from dotenv import load_dotenv
+
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Crawl the quiz queries into the offline track catalog.")
+    parser.add_argument("--limit", type=int, default=CATALOG_TRACKS_PER_QUERY, help="tracks per query")
+    parser.add_argument("--concurrency", type=int, default=CATALOG_CRAWL_CONCURRENCY)
+    parser.add_argument("--stats", action="store_true", help="print catalog counts and exit")
+    args = parser.parse_args()
+
+    # the crawl reuses the server's providers, caches and normalization
+    import server
+
+    await server.deps.warm()
+    db = server.deps.db
+    await ensure_indexes(db)
+    if not args.stats:
+        report = await crawl(db, server.fetch_spotify_tracks, server.catalog_plan(), args.limit, args.concurrency)
+        print(f"Crawled {report['queries']} queries ({report['failed']} failed): "
+              f"{report['tracks']} tracks, {report['new']} new")
+    catalog = await Catalog.load(db)
+    with_preview = sum(1 for t in catalog.tracks.values() if t.get("has_preview"))
+    print(f"{len(catalog)} tracks in catalog, {with_preview} with previews")
+    for field in LABEL_FIELDS:
+        counts = ", ".join(f"{label} {len(tracks)}" for label, tracks in sorted(catalog.by_label[field].items()))
+        print(f"  {field}: {counts or '-'}")
+    await server.deps.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
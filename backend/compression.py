@@ -0,0 +1,103 @@
+"""Response compression (brotli or gzip) above a size threshold.
+
+Pure ASGI middleware. Only single-message bodies with a compressible
+content type are compressed; streamed and file responses (previews,
+profile downloads) pass through untouched. Brotli is used when the
+client accepts it, otherwise gzip. The `brotli` package is listed in
+requirements.txt; an install without it silently serves gzip only.
+"""
+import gzip
+import os
+
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "6"))
+# brotli quality 4-5 is close to gzip's speed with a better ratio
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "4"))
+COMPRESSIBLE_TYPES = (b"application/json", b"text/")
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+
+def choose_encoding(accept_encoding: str):
+    accepted = {part.split(";")[0].strip() for part in accept_encoding.lower().split(",")}
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = None
+        for k, v in scope["headers"]:
+            if k == b"accept-encoding":
+                encoding = choose_encoding(v.decode("latin-1"))
+                break
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_wrapper(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                # hold the headers until we know the body size
+                start_message = message
+                return
+            if start_message is None:
+                await send(message)
+                return
+            start, start_message = start_message, None
+            headers = list(start.get("headers", []))
+            body = message.get("body", b"")
+            if (
+                message.get("more_body", False)
+                or len(body) < self.minimum_size
+                or not self.compressible(headers)
+            ):
+                await send(start)
+                await send(message)
+                return
+            compressed = compress(body, encoding)
+            headers = [(k, v) for k, v in headers if k.lower() != b"content-length"]
+            headers += [
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(compressed)).encode()),
+                (b"vary", b"Accept-Encoding"),
+            ]
+            await send(dict(start, headers=headers))
+            await send(dict(message, body=compressed))
+
+        await self.app(scope, receive, send_wrapper)
+        if start_message is not None:
+            # response ended without a body message
+            await send(start_message)
+
+    @staticmethod
+    def compressible(headers) -> bool:
+        content_type = b""
+        for k, v in headers:
+            key = k.lower()
+            if key == b"content-encoding":
+                return False
+            if key == b"content-type":
+                content_type = v
+        return content_type.startswith(COMPRESSIBLE_TYPES)
@@ -0,0 +1,222 @@
+"""Lazily initialized dependencies for the API server.
+
+Importing `server.py` no longer builds the Mongo client, the Spotify OAuth
+and client-credentials clients, the provider objects (including the
+google.generativeai import) or loads the question bank. Each is created on
+first use, and `warm()` runs in the FastAPI lifespan handler so the first
+request doesn't pay for it. `warm()` also records readiness for
+/api/health/ready.
+"""
+import asyncio
+import importlib
+import logging
+import time
+from typing import Optional
+
+import database
+
+logger = logging.getLogger(__name__)
+
+
+class Container:
+    def __init__(self, config: dict, mongo_listeners: Optional[list] = None):
+        self.config = config
+        self.mongo_listeners = mongo_listeners or []
+        self._mongo_client = None
+        self._db = None
+        self._class_dbs: dict = {}
+        self._sp_oauth = None
+        self._sp_client = None
+        self._music_provider = None
+        self._preview_provider = None
+        self._llm_provider = None
+        self._question_bank = None
+        self._track_catalog = None
+        self._cache = None
+        self.warmed = False
+        self.warm_ms: Optional[float] = None
+        self.checks: dict = {}
+
+    # --- MongoDB ---
+    @property
+    def mongo_client(self):
+        if self._mongo_client is None:
+            from motor.motor_asyncio import AsyncIOMotorClient
+
+            mongo_url = self.config["mongo_url"]
+            # pool size, timeouts and TLS options (database.py)
+            self._mongo_client = AsyncIOMotorClient(
+                mongo_url, event_listeners=self.mongo_listeners, **database.client_options(mongo_url)
+            )
+        return self._mongo_client
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = self.mongo_client[self.config["db_name"]]
+        return self._db
+
+    def db_for(self, op_class: str):
+        """The database with the read preference / write concern of an operation class."""
+        handle = self._class_dbs.get(op_class)
+        if handle is None:
+            options = database.class_options(op_class)
+            try:
+                handle = self.db.with_options(**options) if options else self.db
+            except NotImplementedError:
+                handle = self.db
+            if type(handle) is not type(self.db):
+                # mongomock (benchmarks) rejects some options and returns
+                # a synchronous database for others
+                handle = self.db
+            self._class_dbs[op_class] = handle
+        return handle
+
+    def use_mongo_client(self, client):
+        """Swap in another client (e.g. mongomock for benchmarks)."""
+        self._mongo_client = client
+        self._db = client[self.config["db_name"]]
+        self._class_dbs = {}
+
+    # --- Spotify ---
+    @property
+    def sp_oauth(self):
+        if self._sp_oauth is None:
+            from spotipy.oauth2 import SpotifyOAuth
+
+            logger.info(f"Spotify redirect URI = {self.config['spotify_redirect_uri']}")
+            self._sp_oauth = SpotifyOAuth(
+                client_id=self.config["spotify_client_id"],
+                client_secret=self.config["spotify_client_secret"],
+                redirect_uri=self.config["spotify_redirect_uri"],
+                scope=self.config["spotify_scopes"],
+                show_dialog=True,  # Forces the login window to appear even if authorized previously
+                cache_path=None    # Prevent caching of tokens on disk
+            )
+        return self._sp_oauth
+
+    @property
+    def sp_client(self):
+        """Spotify client credentials for general API access."""
+        if self._sp_client is None:
+            import spotipy
+            from spotipy.oauth2 import SpotifyClientCredentials
+
+            import cache
+
+            credentials = SpotifyClientCredentials(
+                client_id=self.config["spotify_client_id"],
+                client_secret=self.config["spotify_client_secret"],
+                # one token shared by all workers via the cache tier
+                cache_handler=cache.spotify_token_handler(self.cache)
+            )
+            if self.config.get("spotify_accounts_url"):
+                credentials.OAUTH_TOKEN_URL = self.config["spotify_accounts_url"]
+            self._sp_client = spotipy.Spotify(auth_manager=credentials)
+            if self.config.get("spotify_api_url"):
+                self._sp_client.prefix = self.config["spotify_api_url"]
+        return self._sp_client
+
+    def user_client(self, access_token: str):
+        """Spotify client acting as a logged-in user."""
+        import spotipy
+        return spotipy.Spotify(auth=access_token)
+
+    # --- Providers ---
+    @property
+    def music_provider(self):
+        if self._music_provider is None:
+            import providers
+            self._music_provider = providers.build_music_provider(lambda: self.sp_client)
+        return self._music_provider
+
+    @property
+    def preview_provider(self):
+        if self._preview_provider is None:
+            import providers
+            self._preview_provider = providers.build_preview_provider(self.config["deezer_api_url"])
+        return self._preview_provider
+
+    @property
+    def llm_provider(self):
+        if self._llm_provider is None:
+            import providers
+            self._llm_provider = providers.build_llm_provider(self.config["llm_api_key"], self.config.get("gemini_api_endpoint"))
+        return self._llm_provider
+
+    # --- Shared cache ---
+    @property
+    def cache(self):
+        if self._cache is None:
+            import cache
+
+            db = self.db if cache.CACHE_BACKEND == "mongo" else None
+            self._cache = cache.create_cache(db)
+        return self._cache
+
+    # --- Question bank ---
+    @property
+    def question_bank(self) -> list:
+        if self._question_bank is None:
+            self._question_bank = importlib.import_module("quiz_data").questions
+        return self._question_bank
+
+    def use_question_bank(self, bank: list):
+        """Swap in a new bank (e.g. with calibrated difficulty)."""
+        self._question_bank = bank
+
+    # --- Track catalog ---
+    @property
+    def track_catalog(self):
+        """In-memory snapshot of the crawled catalog (catalog.py); empty until loaded."""
+        if self._track_catalog is None:
+            self._track_catalog = importlib.import_module("catalog").Catalog()
+        return self._track_catalog
+
+    def use_track_catalog(self, track_catalog):
+        self._track_catalog = track_catalog
+
+    # --- Lifecycle ---
+    async def warm(self, ping_timeout: float = 5.0):
+        """Build every dependency and check MongoDB; never raises."""
+        start = time.perf_counter()
+        for name in ("question_bank", "music_provider", "preview_provider", "llm_provider", "sp_oauth"):
+            try:
+                # provider construction can import large SDKs; keep the loop responsive
+                await asyncio.to_thread(getattr, self, name)
+                self.checks[name] = "ok"
+            except Exception as e:
+                self.checks[name] = f"error: {e}"
+                logger.error(f"Failed to initialize {name}: {e}")
+        await self.check_mongo(ping_timeout)
+        try:
+            await self.cache.start()
+            self.checks["cache"] = "ok"
+        except Exception as e:
+            self.checks["cache"] = f"error: {e}"
+            logger.error(f"Failed to start {self.cache.name} cache: {e}")
+        self.warmed = True
+        self.warm_ms = round((time.perf_counter() - start) * 1000, 1)
+        logger.info(f"Dependencies warmed in {self.warm_ms}ms: {self.checks}")
+
+    async def check_mongo(self, timeout: float = 2.0) -> bool:
+        try:
+            await asyncio.wait_for(self.db.command("ping"), timeout=timeout)
+            self.checks["mongo"] = "ok"
+            return True
+        except Exception as e:
+            self.checks["mongo"] = f"error: {str(e) or type(e).__name__}"
+            return False
+
+    @property
+    def ready(self) -> bool:
+        return self.warmed and all(v == "ok" for v in self.checks.values())
+
+    async def close(self):
+        if any(p is not None for p in (self._music_provider, self._preview_provider, self._llm_provider)):
+            import providers
+            await providers.close_cassettes()
+        if self._cache is not None:
+            await self._cache.stop()
+        if self._mongo_client is not None:
+            self._mongo_client.close()
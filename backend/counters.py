@@ -0,0 +1,388 @@
+"""Write-behind batching for per-user stats.
+
+Each answer used to send several writes to the same `users` document.
+`record_answer_stats` now hands everything it changes to `StatCounters`:
+
+- additive deltas (total_questions, total_correct, total_score,
+  genre_accuracy.<genre>.total/correct, total_games), summed per user;
+- read-modify-write fields (streak, best_streak, skill.<key>) as `$set`
+  values, the last one per field winning. They are computed from a per-worker
+  copy of the user's current values (`load_state`), which is read from
+  MongoDB once and then kept for STAT_COUNTERS_STATE_SECONDS with this
+  worker's own changes applied.
+
+A background task writes one coalesced `bulk_write`, one update per user,
+every STAT_COUNTERS_FLUSH_MS or as soon as STAT_COUNTERS_BATCH_SIZE
+answers are waiting, and then calls `on_flush` with the users it wrote
+(the server bumps their response cache versions and the leaderboard's).
+An answer therefore costs no MongoDB round trip once the user's state is
+loaded.
+
+The state copy is per worker. If one user's answers are spread over several
+workers within STAT_COUNTERS_STATE_SECONDS, a worker can compute a streak
+from a stale value, so streaks and skill ratings are best effort there.
+Counters stay exact.
+
+Durability comes from an append-only journal under STAT_COUNTERS_DIR:
+
+    {pid}-{token}.lock            held (flock) by the live worker
+    {pid}-{token}.000001.journal  one JSON line per recorded answer
+
+Every answer is appended before `record` returns. Appends, segment
+rotation and fsyncs run on one dedicated thread, so they never block the
+event loop and happen in the order they were submitted. A flush closes the
+current segment and writes exactly that segment's changes as batch
+`{pid}-{token}-{seq}`. It deletes the segment only after the write
+succeeds. Each user update is guarded by that batch id (the last
+COUNTER_BATCH_HISTORY ids are kept in `users.counter_batches`). So
+replaying a segment whose write already landed changes nothing.
+
+On startup a worker replays the segments of any journal whose lock it can
+take. Such a journal belongs to a worker that died, and no two workers
+replay the same one. Each line is flushed to the OS as it is written, so
+a crashed process loses nothing. STAT_COUNTERS_FSYNC=always also fsyncs
+every line, which protects against power loss at the cost of one fsync
+per answer.
+
+Reads call `pending_for(user_id)` / `merge(doc, deltas, sets)` to add the
+changes a worker hasn't written yet. Other workers' unwritten changes become
+visible within one flush interval. STAT_COUNTERS=direct writes each answer
+immediately instead.
+"""
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from pymongo import UpdateOne
+
+import cache
+
+logger = logging.getLogger(__name__)
+
+STAT_COUNTERS = os.environ.get("STAT_COUNTERS", "write-behind").lower()
+STAT_COUNTERS_DIR = Path(os.environ.get("STAT_COUNTERS_DIR", Path(__file__).parent / "counters"))
+STAT_COUNTERS_FLUSH_MS = float(os.environ.get("STAT_COUNTERS_FLUSH_MS", "500"))
+STAT_COUNTERS_BATCH_SIZE = int(os.environ.get("STAT_COUNTERS_BATCH_SIZE", "1000"))
+STAT_COUNTERS_FSYNC = os.environ.get("STAT_COUNTERS_FSYNC", "flush").lower()
+STAT_COUNTERS_STATE_SECONDS = float(os.environ.get("STAT_COUNTERS_STATE_SECONDS", "300"))
+STAT_COUNTERS_STATE_SIZE = int(os.environ.get("STAT_COUNTERS_STATE_SIZE", "50000"))
+# batch ids remembered per user for idempotent journal replay
+COUNTER_BATCH_HISTORY = 32
+
+Deltas = Dict[str, int]
+Sets = Dict[str, object]
+
+
+def answer_deltas(question: dict, is_correct: bool, points: int, is_last: bool) -> Deltas:
+    """The counter increments for one answer."""
+    deltas = {"total_questions": 1}
+    if is_correct:
+        deltas["total_correct"] = 1
+        deltas["total_score"] = points
+    # track-based questions also count towards genre accuracy
+    if "track" in question:
+        genre_key = f"genre_accuracy.{question['track'].get('genre', 'unknown')}"
+        deltas[f"{genre_key}.total"] = 1
+        if is_correct:
+            deltas[f"{genre_key}.correct"] = 1
+    if is_last:
+        deltas["total_games"] = 1
+    return deltas
+
+
+def add_deltas(target: Deltas, deltas: Deltas):
+    for key, value in deltas.items():
+        target[key] = target.get(key, 0) + value
+
+
+def _parent(doc: dict, key: str, copy: bool) -> Tuple[dict, str]:
+    """The dict holding dotted `key` in `doc`, created (or copied) along the way."""
+    *parents, leaf = key.split(".")
+    target = doc
+    for part in parents:
+        child = target.get(part)
+        if not isinstance(child, dict):
+            child = {}
+        elif copy:
+            child = dict(child)
+        target[part] = child
+        target = child
+    return target, leaf
+
+
+def merge(doc: dict, deltas: Optional[Deltas], sets: Optional[Sets] = None) -> dict:
+    """A copy of a user document with unwritten deltas and sets applied (dotted keys nest)."""
+    if not deltas and not sets:
+        return doc
+    doc = dict(doc)
+    for key, value in (deltas or {}).items():
+        target, leaf = _parent(doc, key, copy=True)
+        target[leaf] = (target.get(leaf) or 0) + value
+    for key, value in (sets or {}).items():
+        target, leaf = _parent(doc, key, copy=True)
+        target[leaf] = value
+    return doc
+
+
+async def apply(db, batch: Dict[str, Deltas], batch_id: Optional[str] = None, sets: Optional[Dict[str, Sets]] = None):
+    """One unordered bulk_write with a `$inc`/`$set` per user; guarded by `batch_id` if given."""
+    sets = sets or {}
+    ops = []
+    for user_id in {**batch, **sets}:
+        query = {"id": user_id}
+        update = {}
+        if batch.get(user_id):
+            update["$inc"] = batch[user_id]
+        if sets.get(user_id):
+            update["$set"] = sets[user_id]
+        if batch_id:
+            query["counter_batches"] = {"$ne": batch_id}
+            update["$push"] = {"counter_batches": {"$each": [batch_id], "$slice": -COUNTER_BATCH_HISTORY}}
+        ops.append(UpdateOne(query, update))
+    if ops:
+        await db.users.bulk_write(ops, ordered=False)
+
+
+def read_segment(path: Path) -> Tuple[Dict[str, Deltas], Dict[str, Sets]]:
+    """A journal segment's deltas and sets per user."""
+    batch: Dict[str, Deltas] = {}
+    sets: Dict[str, Sets] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a line torn by a crash was never acknowledged
+                continue
+            if record.get("d"):
+                add_deltas(batch.setdefault(record["u"], {}), record["d"])
+            if record.get("s"):
+                sets.setdefault(record["u"], {}).update(record["s"])
+    return batch, sets
+
+
+class StatCounters:
+    def __init__(self, get_db: Callable, directory: Path = STAT_COUNTERS_DIR, flush_ms: float = STAT_COUNTERS_FLUSH_MS,
+                 batch_size: int = STAT_COUNTERS_BATCH_SIZE, fsync: bool = STAT_COUNTERS_FSYNC == "always",
+                 state_seconds: float = STAT_COUNTERS_STATE_SECONDS,
+                 on_flush: Optional[Callable[[list], Awaitable[None]]] = None):
+        self.get_db = get_db
+        self.directory = directory
+        self.flush_ms = flush_ms
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.state_seconds = state_seconds
+        self.on_flush = on_flush
+        self.worker = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.pending: Dict[str, Deltas] = {}
+        self.pending_sets: Dict[str, Sets] = {}
+        # user id -> read-modify-write fields with this worker's changes applied
+        self.state = cache.MemoryCache(max_entries=STAT_COUNTERS_STATE_SIZE)
+        self.recorded = 0
+        self.flushed = 0
+        self.seq = 0
+        self._journal = None
+        self._lock_fd: Optional[int] = None
+        # (batch id, segment, deltas, sets) being written, or kept after a failed write
+        self._inflight: Optional[Tuple[str, Path, Dict[str, Deltas], Dict[str, Sets]]] = None
+        # journal I/O, in submission order; see the module docstring
+        self._io: Optional[ThreadPoolExecutor] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task = None
+
+    def _segment(self, worker: str, seq: int) -> Path:
+        return self.directory / f"{worker}.{seq:06d}.journal"
+
+    def _open_segment(self, path: Path):
+        self._journal = open(path, "a", encoding="utf-8")
+
+    def _append(self, line: str):
+        self._journal.write(line)
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def _rotate(self, path: Path):
+        """Close the current segment (its records are the batch being flushed) and start `path`."""
+        self._journal.close()
+        self._open_segment(path)
+
+    def _close_segment(self):
+        self._journal.close()
+        os.remove(self._journal.name)
+
+    def _submit(self, fn, *args) -> asyncio.Future:
+        # run_in_executor submits right away, so the order of calls is the order on disk
+        return asyncio.get_running_loop().run_in_executor(self._io, fn, *args)
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock_fd = os.open(self.directory / f"{self.worker}.lock", os.O_RDWR | os.O_CREAT)
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        self.seq += 1
+        self._open_segment(self._segment(self.worker, self.seq))
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stat-journal")
+        await self.replay_orphans()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+        while self.pending or self.pending_sets or self._inflight is not None:
+            await self.flush()
+        # everything is written: the last (empty) segment and the lock can go
+        await self._submit(self._close_segment)
+        self._io.shutdown()
+        os.remove(self.directory / f"{self.worker}.lock")
+        os.close(self._lock_fd)
+
+    async def replay_orphans(self):
+        """Apply the journals of workers that exited without flushing."""
+        replayed = 0
+        for lock in self.directory.glob("*.lock"):
+            worker = lock.stem
+            if worker == self.worker:
+                continue
+            try:
+                fd = os.open(lock, os.O_RDWR)
+            except FileNotFoundError:
+                # another worker just replayed it
+                continue
+            try:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # a live worker's journal
+                    continue
+                segments = sorted(self.directory.glob(f"{worker}.*.journal"))
+                for path in segments:
+                    batch, sets = await asyncio.to_thread(read_segment, path)
+                    await apply(self.get_db(), batch, f"{worker}-{int(path.name.split('.')[1])}", sets)
+                    replayed += len(batch.keys() | sets.keys())
+                    path.unlink(missing_ok=True)
+                lock.unlink(missing_ok=True)
+            finally:
+                os.close(fd)
+        if replayed:
+            logger.info(f"Replayed {replayed} journaled user counter updates")
+
+    async def load_state(self, user_id: str, load: Callable[[], Awaitable[dict]]) -> dict:
+        """The user's read-modify-write fields, as this worker last left them.
+
+        `load` reads them from MongoDB when they aren't held here. Callers
+        compute new values from the result and pass them to `record` without
+        awaiting in between, so concurrent answers in this worker chain.
+        """
+        state = self.state.get_sync(user_id)
+        if state is None:
+            loaded = merge(await load(), None, self.pending_sets_for(user_id))
+            # a concurrent answer may have loaded (and changed) it meanwhile
+            state = self.state.get_sync(user_id)
+            if state is None:
+                state = loaded
+                self.state.set_sync(user_id, state, self.state_seconds)
+        return state
+
+    async def record(self, user_id: str, deltas: Deltas, sets: Optional[Sets] = None):
+        if sets:
+            state = self.state.get_sync(user_id)
+            if state is not None:
+                for key, value in sets.items():
+                    target, leaf = _parent(state, key, copy=False)
+                    target[leaf] = value
+        if self._task is None:
+            # not started (scripts, benchmarks without the lifespan): write through
+            await apply(self.get_db(), {user_id: deltas}, sets={user_id: sets} if sets else None)
+            if self.on_flush is not None:
+                await self.on_flush([user_id])
+            return
+        record = {"u": user_id, "d": deltas}
+        if sets:
+            record["s"] = sets
+        # submit the append and buffer the change in the same step, so a
+        # flush (which rotates the segment through the same thread) always
+        # finds a record in the segment of the batch that holds it
+        written = self._submit(self._append, json.dumps(record) + "\n")
+        add_deltas(self.pending.setdefault(user_id, {}), deltas)
+        if sets:
+            self.pending_sets.setdefault(user_id, {}).update(sets)
+        self.recorded += 1
+        if self.recorded >= self.batch_size:
+            self._wakeup.set()
+        await written
+
+    def pending_for(self, user_id: str) -> Deltas:
+        """Deltas for this user not yet written by this worker."""
+        deltas: Deltas = {}
+        # an in-flight batch may land a moment before it is cleared here
+        if self._inflight is not None and user_id in self._inflight[2]:
+            add_deltas(deltas, self._inflight[2][user_id])
+        if user_id in self.pending:
+            add_deltas(deltas, self.pending[user_id])
+        return deltas
+
+    def pending_sets_for(self, user_id: str) -> Sets:
+        """Sets for this user not yet written by this worker, newest last."""
+        sets: Sets = {}
+        if self._inflight is not None:
+            sets.update(self._inflight[3].get(user_id, {}))
+        sets.update(self.pending_sets.get(user_id, {}))
+        return sets
+
+    def pending_users(self) -> list:
+        users = set(self.pending)
+        if self._inflight is not None:
+            users.update(self._inflight[2])
+        return list(users)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_ms / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"User counter flush failed: {e}")
+
+    async def flush(self):
+        """Write the oldest unwritten batch; a failed batch is retried as-is before newer changes."""
+        if self._inflight is None:
+            if not self.pending and not self.pending_sets:
+                return
+            batch, sets = self.pending, self.pending_sets
+            self.pending, self.pending_sets, self.recorded = {}, {}, 0
+            batch_id, path = f"{self.worker}-{self.seq}", self._segment(self.worker, self.seq)
+            self.seq += 1
+            self._inflight = (batch_id, path, batch, sets)
+            # submitted before any later append, so the segment holds exactly this batch
+            await self._submit(self._rotate, self._segment(self.worker, self.seq))
+        batch_id, path, batch, sets = self._inflight
+        await apply(self.get_db(), batch, batch_id, sets)
+        self._inflight = None
+        self.flushed += 1
+        os.remove(path)
+        if self.on_flush is not None:
+            try:
+                await self.on_flush(list(batch.keys() | sets.keys()))
+            except Exception as e:
+                logger.warning(f"User counter flush callback failed: {e}")
+
+
+def create_counters(get_db: Callable, on_flush: Optional[Callable[[list], Awaitable[None]]] = None) -> Optional[StatCounters]:
+    if STAT_COUNTERS == "direct":
+        return None
+    return StatCounters(get_db, on_flush=on_flush)
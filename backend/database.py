@@ -0,0 +1,112 @@
+"""MongoDB client settings and per-operation-class database handles.
+
+Pool and timeout settings come from the environment and default to the
+driver's own defaults:
+
+    MONGO_MAX_POOL_SIZE=100  MONGO_MIN_POOL_SIZE=0  MONGO_MAX_IDLE_MS
+    MONGO_WAIT_QUEUE_TIMEOUT_MS   how long a request may wait for a pooled connection
+    MONGO_CONNECT_TIMEOUT_MS  MONGO_SOCKET_TIMEOUT_MS  MONGO_SERVER_SELECTION_TIMEOUT_MS
+    MONGO_TLS_ALLOW_INVALID_CERTS=false   (previously always on for mongodb+srv URLs)
+
+Operations are grouped into classes, each with its own read preference and
+write concern, so durability and routing are chosen once here rather than
+per call site:
+
+- `default`    everything else (sessions, answers, stats updates)
+- `critical`   account writes: w=majority, journaled
+- `reporting`  read-only endpoints (leaderboard, user stats, session
+               history); with MONGO_READ_REPLICAS=on they read from
+               secondaries that lag the primary by at most
+               MONGO_MAX_STALENESS_SECONDS (90 is the driver's minimum)
+- `telemetry`  high-volume, loss-tolerant writes (answer events); w=1
+
+Override with MONGO_READ_PREFERENCE_<CLASS> (primary, primaryPreferred,
+secondary, secondaryPreferred, nearest) and MONGO_WRITE_CONCERN_<CLASS>
+(a number or "majority", optionally ":j" for journaled).
+
+Auth lookups and everything on the answer path use `default`, so they
+always read from the primary. Replica reads only apply to replica-set
+URLs; against a standalone server every class reads the primary.
+
+Pool saturation is visible through `metrics.MongoPoolListener`: checkout
+wait times, connections in use and open, and checkout failures.
+"""
+import os
+from typing import Optional
+
+from pymongo import WriteConcern
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primarypreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondarypreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+MONGO_READ_REPLICAS = os.environ.get("MONGO_READ_REPLICAS", "off").lower() in ("1", "on", "true")
+MONGO_MAX_STALENESS_SECONDS = int(os.environ.get("MONGO_MAX_STALENESS_SECONDS", "90"))
+
+# class -> (read preference, write concern) defaults; None keeps the client's
+OPERATION_CLASSES = {
+    "default": (None, None),
+    "critical": (None, "majority:j"),
+    "reporting": ("secondaryPreferred" if MONGO_READ_REPLICAS else None, None),
+    "telemetry": (None, "1"),
+}
+
+
+def _int_env(name: str) -> Optional[int]:
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+def client_options(mongo_url: str) -> dict:
+    """Keyword arguments for AsyncIOMotorClient."""
+    options = {
+        "maxPoolSize": _int_env("MONGO_MAX_POOL_SIZE"),
+        "minPoolSize": _int_env("MONGO_MIN_POOL_SIZE"),
+        "maxIdleTimeMS": _int_env("MONGO_MAX_IDLE_MS"),
+        "waitQueueTimeoutMS": _int_env("MONGO_WAIT_QUEUE_TIMEOUT_MS"),
+        "connectTimeoutMS": _int_env("MONGO_CONNECT_TIMEOUT_MS"),
+        "socketTimeoutMS": _int_env("MONGO_SOCKET_TIMEOUT_MS"),
+        "serverSelectionTimeoutMS": _int_env("MONGO_SERVER_SELECTION_TIMEOUT_MS"),
+    }
+    options = {k: v for k, v in options.items() if v is not None}
+    if "mongodb+srv" in mongo_url:
+        # Cloud (MongoDB Atlas / Render)
+        options["tls"] = True
+        if os.environ.get("MONGO_TLS_ALLOW_INVALID_CERTS", "false").lower() in ("1", "true", "yes"):
+            options["tlsAllowInvalidCertificates"] = True
+    return options
+
+
+def max_pool_size() -> int:
+    return _int_env("MONGO_MAX_POOL_SIZE") or 100
+
+
+def parse_read_preference(name: str):
+    mode = READ_PREFERENCES[name.lower()]
+    if mode is Primary:
+        return Primary()
+    # -1 means no bound
+    return mode(max_staleness=MONGO_MAX_STALENESS_SECONDS if MONGO_MAX_STALENESS_SECONDS > 0 else -1)
+
+
+def parse_write_concern(spec: str) -> WriteConcern:
+    w, _, flags = spec.partition(":")
+    return WriteConcern(w=int(w) if w.isdigit() else w, j=True if "j" in flags else None)
+
+
+def class_options(op_class: str) -> dict:
+    """`with_options` arguments for an operation class."""
+    read_default, write_default = OPERATION_CLASSES[op_class]
+    read = os.environ.get(f"MONGO_READ_PREFERENCE_{op_class.upper()}", read_default)
+    write = os.environ.get(f"MONGO_WRITE_CONCERN_{op_class.upper()}", write_default)
+    options = {}
+    if read:
+        options["read_preference"] = parse_read_preference(read)
+    if write:
+        options["write_concern"] = parse_write_concern(write)
+    return options
@@ -0,0 +1,180 @@
+"""Wrong-answer (distractor) selection for track questions.
+
+Option pools are built once and grown incrementally as tracks are seen,
+instead of being rebuilt per question:
+
+- genres: the quiz genre list plus a symmetric "related genres" graph
+- artists: one global pool plus one pool per genre, keyed by each
+  artist's primary name (seeded from the artist-quiz list, then learned
+  from genre-labelled tracks)
+
+Each `Pool` is a list with a dict index, so adding is O(1) and drawing is
+a random index with rejection of the correct answer. Drawing k options is
+O(k) regardless of how many artists are known.
+
+`similarity` (0..1, from DIFFICULTY_SETTINGS) is the share of distractors
+drawn from related genres / same-genre artists. Hard questions get
+plausible near misses; easy ones mostly get unrelated options.
+"""
+import random
+from typing import Callable, Dict, Iterable, List, Optional
+
+# genres that sound alike or share audiences; made symmetric on load
+GENRE_NEIGHBOURS = {
+    "pop": ["indie", "r&b", "dance", "latin", "electronic"],
+    "rock": ["metal", "indie", "punk", "blues", "folk"],
+    "hip hop": ["r&b", "soul", "funk", "electronic", "reggae"],
+    "electronic": ["dance", "ambient", "pop", "lofi"],
+    "jazz": ["blues", "soul", "funk", "classical", "piano"],
+    "classical": ["piano", "ambient", "folk"],
+    "r&b": ["soul", "hip hop", "funk"],
+    "country": ["folk", "blues", "rock", "acoustic"],
+    "latin": ["reggae", "dance", "funk"],
+    "indie": ["folk", "acoustic", "punk"],
+    "metal": ["punk"],
+    "blues": ["soul", "rock"],
+    "folk": ["acoustic"],
+    "reggae": ["soul"],
+    "soul": ["funk"],
+    "dance": ["disco", "funk"],
+    "funk": ["disco"],
+    "ambient": ["lofi", "piano"],
+    "lofi": ["jazz"],
+}
+
+# a pool this small is scanned instead of sampled by rejection
+LINEAR_SCAN_BELOW = 32
+
+
+class Pool:
+    """Append-only set of options supporting O(1) add and O(1) random draw."""
+
+    __slots__ = ("items", "index")
+
+    def __init__(self, items: Iterable[str] = ()):
+        self.items: List[str] = []
+        self.index: Dict[str, int] = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item: str):
+        if item not in self.index:
+            self.index[item] = len(self.items)
+            self.items.append(item)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self.index
+
+    def draw(self, k: int, reject: Callable[[str], bool], rng) -> List[str]:
+        """Up to k distinct items for which `reject` is false."""
+        if k <= 0 or not self.items:
+            return []
+        if len(self.items) < LINEAR_SCAN_BELOW:
+            candidates = [x for x in self.items if not reject(x)]
+            return rng.sample(candidates, min(k, len(candidates)))
+        picked: List[str] = []
+        chosen = set()
+        # bounded retries keep this O(k) even when most draws collide
+        for _ in range(4 * k + 8):
+            item = self.items[rng.randrange(len(self.items))]
+            if item in chosen or reject(item):
+                continue
+            chosen.add(item)
+            picked.append(item)
+            if len(picked) == k:
+                break
+        return picked
+
+
+class DistractorEngine:
+    def __init__(self, genres: Iterable[str], seed_artists: Optional[Dict[str, str]] = None,
+                 max_artists: int = 100000, rng=None):
+        self.rng = rng or random.Random()
+        self.genres = Pool(g.lower() for g in genres)
+        self.neighbours: Dict[str, Pool] = {}
+        for genre, related in GENRE_NEIGHBOURS.items():
+            for other in related:
+                self.neighbours.setdefault(genre, Pool()).add(other)
+                self.neighbours.setdefault(other, Pool()).add(genre)
+
+        self.max_artists = max_artists
+        self.artists = Pool()
+        self.artists_by_genre: Dict[str, Pool] = {}
+        # primary artist name -> genre label
+        self.artist_genre: Dict[str, str] = {}
+        for name, genre in (seed_artists or {}).items():
+            self.add_artist(name, name, genre)
+
+    # --- Building the pools ---
+    def add_artist(self, option: str, primary: str, genre: Optional[str] = None):
+        if option not in self.artists and len(self.artists) >= self.max_artists:
+            return
+        self.artists.add(option)
+        if genre and genre != "mixed":
+            genre = genre.lower()
+            self.artist_genre.setdefault(primary, genre)
+            self.artists_by_genre.setdefault(genre, Pool()).add(option)
+
+    def observe(self, tracks: Iterable[dict], genre_labels: bool = True):
+        """Register the artists of fetched tracks.
+
+        `genre_labels` is False when track genres are guesses (mood quizzes),
+        so they don't teach the engine wrong artist genres.
+        """
+        for track in tracks:
+            primary = track["artists"][0] if track.get("artists") else track["artist"]
+            self.add_artist(track["artist"], primary, track.get("genre") if genre_labels else None)
+
+    # --- Sampling ---
+    def _mix(self, k: int, similarity: float, near: List[Pool], far: Pool, reject: Callable[[str], bool]) -> List[str]:
+        picked: List[str] = []
+        taken = set()
+
+        def rejected(x):
+            return x in taken or reject(x)
+
+        def take(pool, n):
+            for x in pool.draw(n, rejected, self.rng):
+                taken.add(x)
+                picked.append(x)
+
+        n_near = round(k * similarity)
+        for pool in near:
+            if len(picked) >= n_near:
+                break
+            take(pool, n_near - len(picked))
+        take(far, k - len(picked))
+        # top up from the near pools if the far pool ran short
+        for pool in near:
+            if len(picked) >= k:
+                break
+            take(pool, k - len(picked))
+        return picked
+
+    def genre_options(self, correct: str, k: int, similarity: float = 0.5) -> List[str]:
+        """k wrong genres for a question whose answer is `correct`."""
+        correct = correct.lower()
+        near = [self.neighbours[correct]] if correct in self.neighbours else []
+        return self._mix(k, similarity, near, self.genres, lambda g: g.lower() == correct)
+
+    def artist_options(self, track: dict, k: int, similarity: float = 0.5) -> List[str]:
+        """k wrong artists for `track`, preferring artists of the same genre."""
+        correct = track["artist"]
+        primary = track["artists"][0] if track.get("artists") else correct
+        genre = self.artist_genre.get(primary) or (track.get("genre") or "").lower()
+        near = []
+        if genre in self.artists_by_genre:
+            near.append(self.artists_by_genre[genre])
+        for related in self.neighbours.get(genre, Pool()).items:
+            if related in self.artists_by_genre:
+                near.append(self.artists_by_genre[related])
+            if len(near) >= 3:
+                break
+        correct_lower = correct.lower()
+        primary_lower = primary.lower()
+        # also reject collaborations featuring the correct artist
+        return self._mix(k, similarity, near, self.artists,
+                         lambda a: a.lower() == correct_lower or primary_lower in a.lower())
@@ -0,0 +1,325 @@
+"""Flat answer events for analytics.
+
+`answer_question` emits one small event per answer (user, session,
+question/track id, mode, correctness, hint, latency) so analysis never has
+to load whole `quiz_sessions` documents. `emit()` only appends to an
+in-memory buffer; a background task writes batches every
+ANSWER_EVENTS_FLUSH_MS, or as soon as ANSWER_EVENTS_BATCH_SIZE events are
+waiting. Sinks (ANSWER_EVENTS):
+
+- `collection`  insert_many into the append-only `answer_events` collection
+- `ndjson`      hourly files per worker under ANSWER_EVENTS_DIR, rotated by size too
+- `parquet`     one Parquet file per batch under ANSWER_EVENTS_DIR (needs pyarrow)
+- `none`
+
+The buffer is bounded (ANSWER_EVENTS_MAX_BUFFER); if the sink falls behind,
+the oldest events are dropped and counted rather than slowing answers down.
+
+Export a time range from either store:
+
+    python events.py --since 2026-01-01 --until 2026-02-01 --out answers.ndjson
+    python events.py --source ndjson --since 2026-01-01 --format csv --out answers.csv
+"""
+import argparse
+import asyncio
+import csv
+import heapq
+import json
+import logging
+import os
+import sys
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ANSWER_EVENTS = os.environ.get("ANSWER_EVENTS", "collection").lower()
+ANSWER_EVENTS_DIR = Path(os.environ.get("ANSWER_EVENTS_DIR", Path(__file__).parent / "events"))
+ANSWER_EVENTS_FLUSH_MS = float(os.environ.get("ANSWER_EVENTS_FLUSH_MS", "1000"))
+ANSWER_EVENTS_BATCH_SIZE = int(os.environ.get("ANSWER_EVENTS_BATCH_SIZE", "500"))
+ANSWER_EVENTS_MAX_BUFFER = int(os.environ.get("ANSWER_EVENTS_MAX_BUFFER", "50000"))
+ANSWER_EVENTS_ROTATE_MB = float(os.environ.get("ANSWER_EVENTS_ROTATE_MB", "64"))
+COLLECTION = "answer_events"
+
+FIELDS = (
+    "ts", "user_id", "session_id", "question_index", "question_id", "track_id", "mode",
+    "difficulty", "genre", "level", "is_correct", "used_hint", "points", "latency_ms",
+)
+
+
+def answer_event(user_id: str, session: dict, question: dict, answer: dict) -> dict:
+    """Flatten one answer record into an event."""
+    track = question.get("track") or {}
+    return {
+        "ts": answer["timestamp"],
+        "user_id": user_id,
+        "session_id": session["id"],
+        "question_index": answer["question_index"],
+        "question_id": question.get("question_id"),
+        "track_id": track.get("id"),
+        "mode": session.get("mode"),
+        "difficulty": session.get("difficulty"),
+        "genre": track.get("genre"),
+        "level": question.get("level"),
+        "is_correct": answer["is_correct"],
+        "used_hint": answer["used_hint"],
+        "points": answer["points"],
+        "latency_ms": answer.get("elapsed_ms"),
+    }
+
+
+class EventSink:
+    def __init__(self, flush_ms: float = ANSWER_EVENTS_FLUSH_MS, batch_size: int = ANSWER_EVENTS_BATCH_SIZE,
+                 max_buffer: int = ANSWER_EVENTS_MAX_BUFFER):
+        self.flush_ms = flush_ms
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self.buffer: List[dict] = []
+        self.written = 0
+        self.dropped = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task = None
+        self._stopping = False
+
+    def emit(self, event: dict):
+        self.buffer.append(event)
+        if len(self.buffer) > self.max_buffer:
+            overflow = len(self.buffer) - self.max_buffer
+            del self.buffer[:overflow]
+            self.dropped += overflow
+        if len(self.buffer) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            # let the loop finish the batch it may be writing, then exit
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        # drain everything still buffered
+        while self.buffer:
+            await self.flush()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_ms / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Answer event export failed: {e}")
+
+    async def flush(self):
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer[:self.batch_size], self.buffer[self.batch_size:]
+        try:
+            await self.write(batch)
+        except Exception:
+            # put the batch back (oldest first) so the next flush retries it.
+            # Not on cancellation: a write handed to a thread or the driver
+            # may still land, and retrying it would duplicate the events.
+            self.buffer[:0] = batch
+            raise
+        self.written += len(batch)
+
+    async def write(self, events: List[dict]):
+        pass
+
+
+class CollectionSink(EventSink):
+    def __init__(self, get_db: Callable, **kwargs):
+        super().__init__(**kwargs)
+        self.get_db = get_db
+
+    async def write(self, events: List[dict]):
+        docs = [dict(e, ts=datetime.fromisoformat(e["ts"])) for e in events]
+        await self.get_db()[COLLECTION].insert_many(docs, ordered=False)
+
+
+class NDJSONSink(EventSink):
+    def __init__(self, directory: Path = ANSWER_EVENTS_DIR, rotate_mb: float = ANSWER_EVENTS_ROTATE_MB, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory
+        self.rotate_bytes = int(rotate_mb * 1024 * 1024)
+        # each worker appends to (and rotates) only its own files
+        self.worker = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    async def write(self, events: List[dict]):
+        lines = [json.dumps(e) + "\n" for e in events]
+        await asyncio.to_thread(self._append, lines)
+
+    def _path(self) -> Path:
+        hour = f"{datetime.now(timezone.utc):%Y%m%d-%H}"
+        part = 0
+        while True:
+            path = self.directory / f"answers-{hour}-{self.worker}-{part:03d}.ndjson"
+            if not path.exists() or path.stat().st_size < self.rotate_bytes:
+                return path
+            part += 1
+
+    def _append(self, lines: list):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self._path(), "a", encoding="utf-8") as f:
+            f.writelines(lines)
+
+
+class ParquetSink(EventSink):
+    def __init__(self, directory: Path = ANSWER_EVENTS_DIR, **kwargs):
+        super().__init__(**kwargs)
+        # optional dependency, only needed for ANSWER_EVENTS=parquet
+        import pyarrow  # noqa: F401
+        self.directory = directory
+        self.seq = 0
+
+    async def write(self, events: List[dict]):
+        self.seq += 1
+        await asyncio.to_thread(self._write, events, self.seq)
+
+    def _write(self, events: List[dict], seq: int):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        table = pa.Table.from_pylist([{f: e.get(f) for f in FIELDS} for e in events])
+        pq.write_table(table, self.directory / f"answers-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}-{os.getpid()}-{seq:05d}.parquet")
+
+
+def create_sink(get_db: Callable) -> Optional[EventSink]:
+    if ANSWER_EVENTS == "collection":
+        return CollectionSink(get_db)
+    if ANSWER_EVENTS == "ndjson":
+        return NDJSONSink()
+    if ANSWER_EVENTS == "parquet":
+        return ParquetSink()
+    if ANSWER_EVENTS != "none":
+        logger.warning(f"Unknown ANSWER_EVENTS sink '{ANSWER_EVENTS}', answer events disabled")
+    return None
+
+
+async def ensure_indexes(db):
+    await db[COLLECTION].create_index("ts")
+
+
+# --- Export ---
+def parse_time(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    ts = datetime.fromisoformat(value)
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+async def iter_collection(db, since: Optional[datetime], until: Optional[datetime]):
+    query = {}
+    if since or until:
+        query["ts"] = {}
+        if since:
+            query["ts"]["$gte"] = since
+        if until:
+            query["ts"]["$lt"] = until
+    async for doc in db[COLLECTION].find(query, {"_id": 0}).sort("ts", 1).batch_size(5000):
+        ts = doc["ts"]
+        doc["ts"] = (ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)).isoformat()
+        yield doc
+
+
+def _read_ndjson(path: Path) -> Iterator[dict]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def iter_ndjson(directory: Path, since: Optional[datetime], until: Optional[datetime]) -> Iterator[dict]:
+    hours = {}
+    for path in sorted(directory.glob("answers-*.ndjson")):
+        # file names carry the hour they were started in; skip whole files outside the range
+        hour = datetime.strptime(path.name[8:19], "%Y%m%d-%H").replace(tzinfo=timezone.utc)
+        if until and hour >= until:
+            continue
+        if since and (hour.timestamp() + 3600) <= since.timestamp():
+            continue
+        hours.setdefault(hour, []).append(path)
+    for hour in sorted(hours):
+        # each worker's files are in time order; interleave the workers'
+        for event in heapq.merge(*(_read_ndjson(p) for p in hours[hour]), key=lambda e: e["ts"]):
+            ts = datetime.fromisoformat(event["ts"])
+            if (since and ts < since) or (until and ts >= until):
+                continue
+            yield event
+
+
+class ExportWriter:
+    def __init__(self, out, fmt: str):
+        self.fmt = fmt
+        self.count = 0
+        self.rows = []
+        if fmt == "parquet":
+            self.path = out
+        else:
+            self.f = open(out, "w", encoding="utf-8", newline="") if out != "-" else sys.stdout
+            self.csv = csv.DictWriter(self.f, fieldnames=FIELDS, extrasaction="ignore") if fmt == "csv" else None
+            if self.csv:
+                self.csv.writeheader()
+
+    def write(self, event: dict):
+        self.count += 1
+        if self.fmt == "parquet":
+            self.rows.append({f: event.get(f) for f in FIELDS})
+        elif self.csv:
+            self.csv.writerow(event)
+        else:
+            self.f.write(json.dumps(event) + "\n")
+
+    def close(self):
+        if self.fmt == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            pq.write_table(pa.Table.from_pylist(self.rows), self.path)
+        elif self.f is not sys.stdout:
+            self.f.close()
+
+
+async def main():
+    from dotenv import load_dotenv
+
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Export answer events for a time range.")
+    parser.add_argument("--source", choices=("collection", "ndjson"), default="collection")
+    parser.add_argument("--dir", default=str(ANSWER_EVENTS_DIR), help="NDJSON directory for --source ndjson")
+    parser.add_argument("--since", help="ISO date/time, inclusive (UTC if no offset)")
+    parser.add_argument("--until", help="ISO date/time, exclusive")
+    parser.add_argument("--format", choices=("ndjson", "csv", "parquet"), default="ndjson")
+    parser.add_argument("--out", default="-", help="output file, '-' for stdout")
+    args = parser.parse_args()
+
+    since, until = parse_time(args.since), parse_time(args.until)
+    writer = ExportWriter(args.out, args.format)
+    if args.source == "collection":
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        client = AsyncIOMotorClient(os.environ.get("MONGO_URL") or "mongodb://localhost:27017")
+        db = client[os.environ.get('DB_NAME', 'musicquiz')]
+        async for event in iter_collection(db, since, until):
+            writer.write(event)
+        client.close()
+    else:
+        for event in iter_ndjson(Path(args.dir), since, until):
+            writer.write(event)
+    writer.close()
+    print(f"Exported {writer.count} answer events", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
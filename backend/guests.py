@@ -0,0 +1,202 @@
+"""Guest accounts: atomic lookup-or-create by name, and cleanup.
+
+Guests log in with a display name only. The name is normalized (NFKC,
+case-folded, whitespace collapsed) into `guest_key`, which has a unique
+partial index over guest users, and a login is a single
+`find_one_and_update(..., upsert=True)` on it. Concurrent logins with the
+same name, in any worker, therefore end up on one account instead of
+creating duplicates, and the lookup is an index hit rather than a scan of
+every user.
+
+Each worker also keeps a bounded name -> user id cache (GUEST_CACHE_SIZE).
+A returning guest is then a lookup by `id`; `last_login` is rewritten
+(through the upsert) only once the entry is older than GUEST_TOUCH_MINUTES.
+
+Cleanup deletes guests idle for more than GUEST_IDLE_DAYS that never
+finished a game, in batches. Guests with games stay, so the leaderboard
+keeps them. Run it on a schedule (GUEST_CLEANUP_INTERVAL_MINUTES) or by hand:
+
+    python guests.py --idle-days 30 --dry-run
+
+Guests created before `guest_key` existed are keyed by `backfill_keys`.
+When several of them share a name, the oldest gets it and the others stay
+reachable through their tokens until cleanup.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import re
+import unicodedata
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import cache
+
+logger = logging.getLogger(__name__)
+
+GUEST_CACHE_SIZE = int(os.environ.get("GUEST_CACHE_SIZE", "100000"))
+GUEST_TOUCH_MINUTES = float(os.environ.get("GUEST_TOUCH_MINUTES", "60"))
+GUEST_IDLE_DAYS = float(os.environ.get("GUEST_IDLE_DAYS", "30"))
+BATCH_SIZE = 500
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_name(name: str) -> str:
+    return WHITESPACE.sub(" ", unicodedata.normalize("NFKC", name)).strip().casefold()
+
+
+async def ensure_indexes(db):
+    await db.users.create_index("id")
+    await db.users.create_index(
+        "guest_key", unique=True, partialFilterExpression={"guest": True, "guest_key": {"$exists": True}})
+    await db.users.create_index("last_login", partialFilterExpression={"guest": True})
+
+
+def new_guest(name: str, now: str) -> dict:
+    return {
+        "id": f"guest-{uuid.uuid4().hex[:8]}",
+        "display_name": name,
+        "email": "",
+        "avatar": None,
+        "favorite_genres": [],
+        "total_score": 0,
+        "total_games": 0,
+        "total_correct": 0,
+        "total_questions": 0,
+        "genre_accuracy": {},
+        "difficulty_level": "medium",
+        "streak": 0,
+        "best_streak": 0,
+        "guest": True,
+        "created_at": now,
+    }
+
+
+class GuestDirectory:
+    def __init__(self, get_db, projection: dict, cache_size: int = GUEST_CACHE_SIZE,
+                 touch_minutes: float = GUEST_TOUCH_MINUTES):
+        self.get_db = get_db
+        self.projection = projection
+        self.touch_seconds = touch_minutes * 60
+        # guest_key -> user id; an entry expires when last_login is due a refresh
+        self.ids = cache.MemoryCache(max_entries=cache_size)
+
+    async def login(self, name: str) -> dict:
+        """The guest user for `name`, created on first use."""
+        key = normalize_name(name)
+        user_id = self.ids.get_sync(key)
+        if user_id is not None:
+            user = await self.get_db().users.find_one({"id": user_id}, self.projection)
+            if user is not None:
+                return user
+            # removed by cleanup (possibly in another worker)
+            self.ids.delete_sync([key])
+        now = datetime.now(timezone.utc).isoformat()
+        update = {"$set": {"last_login": now}, "$setOnInsert": new_guest(name, now)}
+        try:
+            user = await self._upsert(key, update)
+        except DuplicateKeyError:
+            # another login inserted the same key first; now it matches
+            user = await self._upsert(key, update)
+        self.ids.set_sync(key, user["id"], self.touch_seconds)
+        return user
+
+    async def _upsert(self, key: str, update: dict) -> dict:
+        return await self.get_db().users.find_one_and_update(
+            {"guest": True, "guest_key": key}, update,
+            projection=self.projection, upsert=True, return_document=ReturnDocument.AFTER)
+
+    def forget(self, user_ids: set):
+        with self.ids.lock:
+            for key in [k for k, (_, uid) in self.ids.entries.items() if uid in user_ids]:
+                del self.ids.entries[key]
+
+
+async def backfill_keys(db) -> int:
+    """Set `guest_key` on guests created before it existed, oldest first."""
+    keyed = 0
+    cursor = db.users.find({"guest": True, "guest_key": {"$exists": False}},
+                           {"_id": 1, "display_name": 1}).sort("created_at", 1)
+    try:
+        async for doc in cursor:
+            try:
+                await db.users.update_one({"_id": doc["_id"]},
+                                          {"$set": {"guest_key": normalize_name(doc.get("display_name") or "Guest")}})
+                keyed += 1
+            except DuplicateKeyError:
+                # an older guest already has this name
+                pass
+    except Exception as e:
+        # runs unattended at server start; the next start picks up the rest
+        logger.error(f"Guest key backfill stopped after {keyed}: {e}")
+    if keyed:
+        logger.info(f"Keyed {keyed} existing guest accounts")
+    return keyed
+
+
+async def cleanup(db, idle_days: float = GUEST_IDLE_DAYS, dry_run: bool = False, directory: Optional[GuestDirectory] = None) -> dict:
+    """Delete guests idle for `idle_days` that never finished a game."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=idle_days)).isoformat()
+    query = {"guest": True, "last_login": {"$lt": cutoff}, "total_games": {"$in": [0, None]}}
+    if dry_run:
+        return {"dry_run": True, "stale": await db.users.count_documents(query)}
+    deleted = 0
+    while True:
+        ids = [d["id"] for d in await db.users.find(query, {"_id": 0, "id": 1}).limit(BATCH_SIZE).to_list(BATCH_SIZE)]
+        if not ids:
+            break
+        # re-check idleness so a guest who logged in meanwhile is kept
+        result = await db.users.delete_many({**query, "id": {"$in": ids}})
+        deleted += result.deleted_count
+        if directory is not None:
+            directory.forget(set(ids))
+        if len(ids) < BATCH_SIZE:
+            break
+    report = {"dry_run": False, "deleted": deleted}
+    if deleted:
+        logger.info(f"Guest cleanup: {report}")
+    return report
+
+
+async def run_periodically(db, interval_minutes: float, directory: Optional[GuestDirectory] = None):
+    """Background loop used by the server when GUEST_CLEANUP_INTERVAL_MINUTES is set."""
+    while True:
+        await asyncio.sleep(interval_minutes * 60)
+        try:
+            await cleanup(db, directory=directory)
+        except Exception as e:
+            logger.error(f"Guest cleanup failed: {e}")
+
+
+async def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Delete idle guest accounts that never finished a game.")
+    parser.add_argument("--idle-days", type=float, default=GUEST_IDLE_DAYS)
+    parser.add_argument("--backfill", action="store_true", help="also key guests created before guest_key existed")
+    parser.add_argument("--dry-run", action="store_true", help="only count stale guests")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL") or "mongodb://localhost:27017")
+    db = client[os.environ.get('DB_NAME', 'musicquiz')]
+    await ensure_indexes(db)
+    if args.backfill:
+        print(f"Keyed {await backfill_keys(db)} guests")
+    report = await cleanup(db, args.idle_days, args.dry_run)
+    client.close()
+    if report["dry_run"]:
+        print(f"{report['stale']} guests idle for over {args.idle_days:g} days with no finished games")
+    else:
+        print(f"Deleted {report['deleted']} stale guests")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
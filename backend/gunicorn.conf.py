@@ -0,0 +1,31 @@
+"""Multi-worker deployment: gunicorn managing uvicorn workers.
+
+    gunicorn -c gunicorn.conf.py server:app
+
+Each worker is a separate process with its own event loop, so set
+CACHE_BACKEND=redis (or mongo) to share provider results and the Spotify
+token across workers; see cache.py. Multiplayer rooms live in a single
+worker's memory, so with more than one worker ROOMS=off is required. The
+worker count is WEB_CONCURRENCY, or without it one worker per core when
+ROOMS=off and a single worker otherwise.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+rooms = os.environ.get("ROOMS", "on").lower() not in ("0", "off", "false")
+# WEB_CONCURRENCY is also the default of `uvicorn --workers` and what most
+# PaaS hosts set; server.py reads it too
+workers = int(os.environ.get("WEB_CONCURRENCY") or (1 if rooms else multiprocessing.cpu_count()))
+if workers > 1 and rooms:
+    # gunicorn can't route /api/rooms/{code}/* to the worker holding the room
+    raise RuntimeError(f"Multiplayer rooms can't be shared by {workers} workers; "
+                       "set WEB_CONCURRENCY=1 or ROOMS=off")
+worker_class = "uvicorn.workers.UvicornWorker"
+# quiz start waits on Spotify/Deezer/LLM calls; don't kill slow but healthy workers
+timeout = int(os.environ.get("WORKER_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+# recycle workers periodically to bound memory growth
+max_requests = int(os.environ.get("WORKER_MAX_REQUESTS", "10000"))
+max_requests_jitter = max_requests // 10
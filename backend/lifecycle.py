@@ -0,0 +1,228 @@
+"""Lifecycle policy for quiz_sessions.
+
+- Abandoned sessions (never completed, older than the abandon TTL) are
+  removed and archived.
+- Completed sessions older than the compaction age are archived, then
+  compacted in place down to their summary fields plus `answers`, which is
+  all the stats and leaderboard endpoints read.
+
+Raw documents go either to the `quiz_sessions_archive` collection or to an
+NDJSON file (gzip-compressed when the path ends in `.gz`). After each batch,
+`on_change` gets the ids of the users whose sessions changed, which the
+server uses to invalidate their cached session and stats responses.
+
+Run periodically from the server (SESSION_REAPER_INTERVAL_MINUTES) or by hand:
+
+    python lifecycle.py --abandon-hours 24 --compact-hours 24 --archive ndjson --archive-path sessions.ndjson.gz
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+SESSION_ABANDON_HOURS = float(os.environ.get("SESSION_ABANDON_HOURS", "24"))
+SESSION_COMPACT_HOURS = float(os.environ.get("SESSION_COMPACT_HOURS", "24"))
+SESSION_ARCHIVE = os.environ.get("SESSION_ARCHIVE", "collection")  # collection / ndjson / none
+SESSION_ARCHIVE_PATH = os.environ.get("SESSION_ARCHIVE_PATH", "quiz_sessions_archive.ndjson.gz")
+ARCHIVE_COLLECTION = "quiz_sessions_archive"
+BATCH_SIZE = 500
+
+OnChange = Optional[Callable[[set], Awaitable[None]]]
+
+# fields kept on a compacted session; everything else (mainly the full
+# question payloads) moves to the archive
+SUMMARY_FIELDS = (
+    "id", "user_id", "mode", "mood", "difficulty", "edu_level", "score", "total_questions",
+    "current_index", "started_at", "completed", "completed_at", "time_limit", "scoring",
+    "timed_out", "answers",
+)
+
+
+class Archiver:
+    """Writes raw session documents to the archive collection or an NDJSON file."""
+
+    def __init__(self, db, target: str = SESSION_ARCHIVE, path: str = SESSION_ARCHIVE_PATH):
+        self.db = db
+        self.target = target
+        self.path = Path(path)
+        self.archived = 0
+
+    async def write(self, docs: list, reason: str):
+        if not docs or self.target == "none":
+            return
+        archived_at = datetime.now(timezone.utc)
+        if self.target == "ndjson":
+            lines = []
+            for doc in docs:
+                record = {k: v for k, v in doc.items() if k != "_id"}
+                record["archive_reason"] = reason
+                record["archived_at"] = archived_at.isoformat()
+                lines.append(json.dumps(record, default=str) + "\n")
+            # file writes happen off the event loop when run inside the server
+            await asyncio.to_thread(self._append_lines, lines)
+        else:
+            records = []
+            for doc in docs:
+                record = {k: v for k, v in doc.items() if k != "_id"}
+                record["archive_reason"] = reason
+                record["archived_at"] = archived_at
+                records.append(record)
+            await self.db[ARCHIVE_COLLECTION].insert_many(records, ordered=False)
+        self.archived += len(docs)
+
+    def _append_lines(self, lines: list):
+        opener = gzip.open if self.path.suffix == ".gz" else open
+        with opener(self.path, "at", encoding="utf-8") as f:
+            f.writelines(lines)
+
+
+async def collection_size(db, name: str = "quiz_sessions") -> dict:
+    """Document count and data/storage size in bytes for a collection."""
+    try:
+        stats = await db.command("collStats", name)
+        return {"count": stats.get("count", 0), "size": stats.get("size", 0), "storage_size": stats.get("storageSize", 0)}
+    except Exception:
+        # mongomock and restricted users don't support collStats
+        count = await db[name].count_documents({})
+        return {"count": count, "size": None, "storage_size": None}
+
+
+async def reap_abandoned_sessions(db, archiver: Archiver, abandon_hours: float = SESSION_ABANDON_HOURS, dry_run: bool = False,
+                                  on_change: OnChange = None) -> int:
+    """Archive and delete sessions that were never completed."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(hours=abandon_hours)).isoformat()
+    query = {"completed": False, "started_at": {"$lt": cutoff}}
+    if dry_run:
+        return await db.quiz_sessions.count_documents(query)
+
+    reaped = 0
+    while True:
+        batch = await db.quiz_sessions.find(query, {"_id": 0, "id": 1}).limit(BATCH_SIZE).to_list(BATCH_SIZE)
+        if not batch:
+            break
+        # one atomic delete per session, so a session completed since the
+        # find stays live and is not archived as abandoned
+        removed = await asyncio.gather(*(
+            db.quiz_sessions.find_one_and_delete({"id": d["id"], "completed": False}) for d in batch))
+        removed = [d for d in removed if d is not None]
+        await archiver.write(removed, "abandoned")
+        reaped += len(removed)
+        if on_change is not None and removed:
+            await on_change({d["user_id"] for d in removed if d.get("user_id")})
+        if len(batch) < BATCH_SIZE:
+            break
+    return reaped
+
+
+async def compact_completed_sessions(db, archiver: Archiver, compact_hours: float = SESSION_COMPACT_HOURS, dry_run: bool = False,
+                                     on_change: OnChange = None) -> int:
+    """Archive completed sessions, then strip them down to SUMMARY_FIELDS."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(hours=compact_hours)).isoformat()
+    query = {"completed": True, "compacted": {"$ne": True}, "started_at": {"$lt": cutoff}}
+    if dry_run:
+        return await db.quiz_sessions.count_documents(query)
+
+    compacted = 0
+    while True:
+        batch = await db.quiz_sessions.find(query).limit(BATCH_SIZE).to_list(BATCH_SIZE)
+        if not batch:
+            break
+        await archiver.write(batch, "compacted")
+        ops = []
+        for doc in batch:
+            drop = {k: "" for k in doc if k not in SUMMARY_FIELDS and k != "_id"}
+            update = {"$set": {"compacted": True}}
+            if drop:
+                update["$unset"] = drop
+            ops.append(UpdateOne({"_id": doc["_id"]}, update))
+        result = await db.quiz_sessions.bulk_write(ops, ordered=False)
+        compacted += result.modified_count
+        if on_change is not None and result.modified_count:
+            await on_change({d["user_id"] for d in batch if d.get("user_id")})
+        if len(batch) < BATCH_SIZE:
+            break
+    return compacted
+
+
+async def run_lifecycle(db, abandon_hours: float = SESSION_ABANDON_HOURS, compact_hours: float = SESSION_COMPACT_HOURS,
+                        archive: str = SESSION_ARCHIVE, archive_path: str = SESSION_ARCHIVE_PATH, dry_run: bool = False,
+                        on_change: OnChange = None) -> dict:
+    """Run both policies and report collection size before and after."""
+    before = await collection_size(db)
+    archiver = Archiver(db, archive, archive_path)
+    reaped = await reap_abandoned_sessions(db, archiver, abandon_hours, dry_run, on_change)
+    compacted = await compact_completed_sessions(db, archiver, compact_hours, dry_run, on_change)
+    after = await collection_size(db)
+    report = {
+        "dry_run": dry_run,
+        "abandoned_reaped": reaped,
+        "completed_compacted": compacted,
+        "archived": archiver.archived,
+        "archive": archive if archive != "ndjson" else f"ndjson:{archive_path}",
+        "before": before,
+        "after": after,
+    }
+    logger.info(f"Session lifecycle: {report}")
+    return report
+
+
+async def ensure_indexes(db):
+    await db.quiz_sessions.create_index([("completed", 1), ("started_at", 1)])
+
+
+async def run_periodically(db, interval_minutes: float, on_change: OnChange = None):
+    """Background loop used by the server when SESSION_REAPER_INTERVAL_MINUTES is set."""
+    while True:
+        await asyncio.sleep(interval_minutes * 60)
+        try:
+            await run_lifecycle(db, on_change=on_change)
+        except Exception as e:
+            logger.error(f"Session lifecycle run failed: {e}")
+
+
+def format_size(n) -> str:
+    if n is None:
+        return "n/a"
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+async def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Reap abandoned and compact completed quiz sessions.")
+    parser.add_argument("--abandon-hours", type=float, default=SESSION_ABANDON_HOURS)
+    parser.add_argument("--compact-hours", type=float, default=SESSION_COMPACT_HOURS)
+    parser.add_argument("--archive", choices=("collection", "ndjson", "none"), default=SESSION_ARCHIVE)
+    parser.add_argument("--archive-path", default=SESSION_ARCHIVE_PATH)
+    parser.add_argument("--dry-run", action="store_true", help="only count what would change")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL") or "mongodb://localhost:27017")
+    db = client[os.environ.get('DB_NAME', 'musicquiz')]
+    await ensure_indexes(db)
+    report = await run_lifecycle(db, args.abandon_hours, args.compact_hours, args.archive, args.archive_path, args.dry_run)
+    client.close()
+
+    before, after = report["before"], report["after"]
+    print(f"quiz_sessions before: {before['count']} docs, {format_size(before['size'])} data, {format_size(before['storage_size'])} storage")
+    print(f"quiz_sessions after:  {after['count']} docs, {format_size(after['size'])} data, {format_size(after['storage_size'])} storage")
+    print(f"Reaped {report['abandoned_reaped']} abandoned, compacted {report['completed_compacted']} completed, archived {report['archived']} to {report['archive']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,356 @@
+"""Low-overhead instrumentation exposed in Prometheus text format.
+
+Histograms use fixed bucket bounds and one pre-allocated counts list per
+label set, created on first use and reused afterwards; an observation is
+a bisect plus two additions under an uncontended lock (Mongo events arrive
+from motor's executor threads). Label values come from code (route names,
+stages, providers), never from user input, so cardinality stays bounded.
+
+What is recorded:
+
+- `http_request_duration_seconds`     per route/method/status (ASGI middleware)
+- `quiz_start_stage_duration_seconds` per stage inside `start_quiz`
+- `mongo_command_duration_seconds`    per route/command/outcome (pymongo listener)
+- `provider_request_duration_seconds` per provider/operation/outcome
+- `preview_proxy_requests_total`      per outcome (hit/miss/unavailable)
+- `preview_proxy_bytes_total`         per source (cache/upstream)
+- `mongo_pool_checkout_seconds`       wait for a pooled connection, per server
+- `mongo_pool_connections_in_use` / `mongo_pool_connections_open`  per server
+- `mongo_pool_checkout_failures_total` per server/reason (e.g. timeout)
+"""
+import contextvars
+import threading
+import time
+from bisect import bisect_right
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # one slot per bucket plus +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect_right(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str], buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.bounds = tuple(buckets)
+        self.children: Dict[tuple, HistogramChild] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values) -> HistogramChild:
+        child = self.children.get(values)
+        if child is None:
+            with self._lock:
+                child = self.children.setdefault(values, HistogramChild(self.bounds))
+        return child
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for values, child in list(self.children.items()):
+            with child.lock:
+                counts = list(child.counts)
+                total_sum = child.sum
+            labels = ",".join(f'{k}="{v}"' for k, v in zip(self.labelnames, values))
+            prefix = labels + "," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.bounds, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total_sum}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *values, amount: float = 1):
+        with self._lock:
+            self.values[values] = self.values.get(values, 0) + amount
+
+    def get(self, *values) -> float:
+        return self.values.get(values, 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for values, value in list(self.values.items()):
+            labels = ",".join(f'{k}="{v}"' for k, v in zip(self.labelnames, values))
+            lines.append(f"{self.name}{{{labels}}} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *values, amount: float = 1):
+        with self._lock:
+            self.values[values] = self.values.get(values, 0) + amount
+
+    def dec(self, *values, amount: float = 1):
+        self.inc(*values, amount=-amount)
+
+    def get(self, *values) -> float:
+        return self.values.get(values, 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for values, value in list(self.values.items()):
+            labels = ",".join(f'{k}="{v}"' for k, v in zip(self.labelnames, values))
+            lines.append(f"{self.name}{{{labels}}} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str], buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str]) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str]) -> Gauge:
+        metric = Gauge(name, documentation, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_LATENCY = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route.", ("route", "method", "status"))
+QUIZ_START_STAGES = registry.histogram(
+    "quiz_start_stage_duration_seconds", "Time spent in each stage of /api/quiz/start.", ("stage",))
+MONGO_LATENCY = registry.histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency by route.", ("route", "command", "outcome"))
+PROVIDER_LATENCY = registry.histogram(
+    "provider_request_duration_seconds", "Outbound provider call latency.", ("provider", "operation", "outcome"))
+PREVIEW_REQUESTS = registry.counter(
+    "preview_proxy_requests_total", "Preview proxy requests by outcome.", ("outcome",))
+PREVIEW_BYTES = registry.counter(
+    "preview_proxy_bytes_total", "Preview audio bytes served, from the disk cache or fetched upstream.", ("source",))
+POOL_CHECKOUT = registry.histogram(
+    "mongo_pool_checkout_seconds", "Time spent waiting for a pooled MongoDB connection.", ("server",))
+POOL_IN_USE = registry.gauge(
+    "mongo_pool_connections_in_use", "MongoDB connections checked out of the pool.", ("server",))
+POOL_OPEN = registry.gauge(
+    "mongo_pool_connections_open", "MongoDB connections open in the pool.", ("server",))
+POOL_CHECKOUT_FAILURES = registry.counter(
+    "mongo_pool_checkout_failures_total", "Failed MongoDB connection checkouts by reason.", ("server", "reason"))
+
+# the ASGI scope of the request being served; routing fills in "endpoint"
+_current_scope: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("metrics_scope", default=None)
+# per-request stage accumulator used by `stage`
+_stages: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("metrics_stages", default=None)
+
+
+def current_route() -> str:
+    scope = _current_scope.get()
+    if scope is None:
+        return "background"
+    return current_route_for(scope)
+
+
+def current_route_for(scope: dict) -> str:
+    endpoint = scope.get("endpoint")
+    return endpoint.__name__ if endpoint is not None else "unmatched"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording request latency per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        token = _current_scope.set(scope)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current_scope.reset(token)
+            HTTP_LATENCY.labels(current_route_for(scope), scope["method"], status_holder[0]).observe(elapsed)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Records every MongoDB command against the route that issued it."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_LATENCY.labels(current_route(), event.command_name, "ok").observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        MONGO_LATENCY.labels(current_route(), event.command_name, "error").observe(event.duration_micros / 1e6)
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """Pool saturation: checkout waits, connections in use and open, failed checkouts."""
+
+    def __init__(self):
+        # checkout started/finished events for one operation arrive on the same thread
+        self._local = threading.local()
+
+    @staticmethod
+    def _server(event) -> str:
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def _waited(self, event):
+        start = getattr(self._local, "start", None)
+        if start is not None:
+            self._local.start = None
+            POOL_CHECKOUT.labels(self._server(event)).observe(time.perf_counter() - start)
+
+    def connection_check_out_started(self, event):
+        self._local.start = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        self._waited(event)
+        POOL_IN_USE.inc(self._server(event))
+
+    def connection_check_out_failed(self, event):
+        self._waited(event)
+        POOL_CHECKOUT_FAILURES.inc(self._server(event), event.reason)
+
+    def connection_checked_in(self, event):
+        POOL_IN_USE.dec(self._server(event))
+
+    def connection_created(self, event):
+        POOL_OPEN.inc(self._server(event))
+
+    def connection_closed(self, event):
+        POOL_OPEN.dec(self._server(event))
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def stats(self) -> dict:
+        """Per-server pool usage for the readiness endpoint."""
+        servers = {}
+        for (server,), open_count in list(POOL_OPEN.values.items()):
+            child = POOL_CHECKOUT.children.get((server,))
+            waits = sum(child.counts) if child else 0
+            servers[server] = {
+                "open": int(open_count),
+                "in_use": int(POOL_IN_USE.get(server)),
+                "checkouts": waits,
+                "avg_checkout_ms": round(child.sum / waits * 1000, 2) if waits else 0.0,
+                "checkout_failures": int(sum(v for (s, _), v in list(POOL_CHECKOUT_FAILURES.values.items()) if s == server)),
+            }
+        return servers
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as one stage of the current `track_stages` request.
+
+    Outside `track_stages` (catalog crawls, room creation, scripts) nothing
+    is recorded, so the histogram only describes `/api/quiz/start`.
+    """
+    acc = _stages.get()
+    if acc is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        acc[name] = acc.get(name, 0.0) + time.perf_counter() - start
+
+
+@contextmanager
+def track_stages():
+    """Collect stage timings for one request and record each stage once."""
+    token = _stages.set({})
+    try:
+        yield
+    finally:
+        acc = _stages.get()
+        _stages.reset(token)
+        for name, elapsed in acc.items():
+            QUIZ_START_STAGES.labels(name).observe(elapsed)
+
+
+@asynccontextmanager
+async def provider_call(provider: str, operation: str):
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        PROVIDER_LATENCY.labels(provider, operation, outcome).observe(time.perf_counter() - start)
+
+
+def render() -> str:
+    return registry.render()
@@ -0,0 +1,379 @@
+"""Multiplayer quiz rooms.
+
+A room holds one question set (built by the same pipeline as single-player
+sessions) that every player answers at the same time. Room state, per-room
+question timers and the broadcast fan-out all live in this process:
+
+- `PubSub` is the broadcast abstraction. `InMemoryPubSub` fans messages out
+  to local subscribers; a broker-backed implementation (Redis pub/sub, NATS,
+  ...) can implement the same three methods, but rooms would also need
+  shared state and timers to span workers.
+- Because of that, rooms need a single worker. With several workers the
+  server refuses to start unless ROOMS=off, which turns the room
+  endpoints off (503); see `check_workers`.
+- Question timers use `loop.call_later`, so an idle room costs one timer
+  handle in the event loop's heap rather than a sleeping task.
+- Messages are serialized once per publish and the same string is handed to
+  every subscriber, so fan-out cost does not grow with payload size.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+MAX_ROOMS = int(os.environ.get("MAX_ROOMS", "500"))
+MAX_PLAYERS_PER_ROOM = int(os.environ.get("MAX_PLAYERS_PER_ROOM", "16"))
+# how long a finished (or never started) room stays around for late readers
+ROOM_TTL_SECONDS = float(os.environ.get("ROOM_TTL_SECONDS", "600"))
+ROOMS_ENABLED = os.environ.get("ROOMS", "on").lower() not in ("0", "off", "false")
+# per-subscriber queue bound; slow websocket readers drop the oldest message
+SUBSCRIBER_QUEUE_SIZE = 64
+
+
+class RoomError(Exception):
+    """Raised for invalid room operations; carries an HTTP-style status code."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+# --- Pub/Sub ---
+class Subscription:
+    """A single subscriber's view of a channel."""
+
+    def __init__(self, pubsub: "PubSub", channel: str):
+        self.pubsub = pubsub
+        self.channel = channel
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def put(self, message: str):
+        if self.queue.full():
+            # drop the oldest message instead of blocking the publisher
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+    async def get(self) -> str:
+        return await self.queue.get()
+
+    def close(self):
+        self.pubsub.unsubscribe(self)
+
+
+class PubSub:
+    """Broadcast interface used by rooms. Messages are JSON strings."""
+
+    async def publish(self, channel: str, message: str) -> None:
+        raise NotImplementedError
+
+    def subscribe(self, channel: str) -> Subscription:
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        raise NotImplementedError
+
+
+class InMemoryPubSub(PubSub):
+    """Process-local pub/sub; fan-out is a loop of non-blocking queue puts."""
+
+    def __init__(self):
+        self.channels: Dict[str, Set[Subscription]] = {}
+
+    async def publish(self, channel: str, message: str) -> None:
+        for sub in self.channels.get(channel, ()):
+            sub.put(message)
+
+    def subscribe(self, channel: str) -> Subscription:
+        sub = Subscription(self, channel)
+        self.channels.setdefault(channel, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subs = self.channels.get(subscription.channel)
+        if subs is None:
+            return
+        subs.discard(subscription)
+        if not subs:
+            del self.channels[subscription.channel]
+
+
+def create_pubsub(backend: Optional[str] = None) -> PubSub:
+    backend = (backend or os.environ.get("ROOM_PUBSUB", "memory")).lower()
+    if backend != "memory":
+        raise ValueError(f"Unknown ROOM_PUBSUB backend '{backend}'; only 'memory' is available")
+    return InMemoryPubSub()
+
+
+def check_workers(workers: int, enabled: bool = ROOMS_ENABLED):
+    """Refuse to run rooms across several workers: a room, its timers and its
+    subscribers must all be in one process, and requests aren't routed by room."""
+    if enabled and workers > 1:
+        raise RuntimeError(f"Multiplayer rooms can't be shared by {workers} workers; "
+                           "run a single worker or set ROOMS=off")
+
+
+# --- Rooms ---
+class Room:
+    __slots__ = (
+        "code", "host_id", "mode", "difficulty", "edu_level", "questions", "safe_questions",
+        "time_per_question", "players", "state", "current_index", "deadline",
+        "timer", "lock", "created_at",
+    )
+
+    def __init__(self, code: str, host_id: str, mode: str, difficulty: str, edu_level: str,
+                 questions: list, safe_questions: list, time_per_question: float):
+        self.code = code
+        self.host_id = host_id
+        self.mode = mode
+        self.difficulty = difficulty
+        self.edu_level = edu_level
+        self.questions = questions
+        self.safe_questions = safe_questions
+        self.time_per_question = time_per_question
+        # user_id -> {"display_name", "score", "correct", "answers": {index: answer record}}
+        self.players: Dict[str, dict] = {}
+        self.state = "lobby"  # lobby -> question -> finished
+        self.current_index = -1
+        self.deadline: Optional[float] = None  # monotonic
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.lock = asyncio.Lock()
+        self.created_at = time.monotonic()
+
+    @property
+    def channel(self) -> str:
+        return f"room:{self.code}"
+
+    def scoreboard(self) -> List[dict]:
+        board = [
+            {"user_id": uid, "display_name": p["display_name"], "score": p["score"], "correct": p["correct"]}
+            for uid, p in self.players.items()
+        ]
+        board.sort(key=lambda e: e["score"], reverse=True)
+        return board
+
+    def snapshot(self) -> dict:
+        """Public room state, safe to send to any player."""
+        data = {
+            "code": self.code,
+            "host_id": self.host_id,
+            "mode": self.mode,
+            "difficulty": self.difficulty,
+            "state": self.state,
+            "total_questions": len(self.questions),
+            "time_per_question": self.time_per_question,
+            "current_index": self.current_index,
+            "scoreboard": self.scoreboard(),
+        }
+        if self.state == "question":
+            data["question"] = self.safe_questions[self.current_index]
+            data["time_remaining"] = max(0.0, round(self.deadline - time.monotonic(), 2))
+        return data
+
+
+class RoomManager:
+    """Owns every room in this worker and drives their question timers.
+
+    `score_fn(room, question, is_correct, used_hint)` computes points and
+    `on_answer(user_id, question, is_correct, points, is_last)` lets the
+    server persist per-user stats, so scoring stays identical to
+    single-player sessions.
+    """
+
+    def __init__(self, pubsub: PubSub,
+                 score_fn: Callable[["Room", dict, bool, bool], int],
+                 on_answer: Optional[Callable[[str, dict, bool, int, bool], Awaitable[None]]] = None,
+                 enabled: bool = ROOMS_ENABLED):
+        self.pubsub = pubsub
+        self.score_fn = score_fn
+        self.on_answer = on_answer
+        self.enabled = enabled
+        self.rooms: Dict[str, Room] = {}
+
+    def get(self, code: str) -> Room:
+        if not self.enabled:
+            raise RoomError(503, "Multiplayer rooms are disabled")
+        room = self.rooms.get(code.upper())
+        if room is None:
+            raise RoomError(404, "Room not found")
+        return room
+
+    def create(self, host: dict, mode: str, difficulty: str, edu_level: str,
+               questions: list, safe_questions: list, time_per_question: float) -> Room:
+        if not self.enabled:
+            raise RoomError(503, "Multiplayer rooms are disabled")
+        if len(self.rooms) >= MAX_ROOMS:
+            raise RoomError(503, "Too many active rooms, please try again later")
+        code = uuid.uuid4().hex[:6].upper()
+        while code in self.rooms:
+            code = uuid.uuid4().hex[:6].upper()
+        room = Room(code, host["id"], mode, difficulty, edu_level, questions, safe_questions, time_per_question)
+        self._add_player(room, host)
+        self.rooms[code] = room
+        # rooms that never start are cleaned up too
+        self._schedule_expiry(room)
+        logger.info(f"Room {code} created by {host['id']} ({len(questions)} questions)")
+        return room
+
+    async def join(self, code: str, user: dict) -> Room:
+        room = self.get(code)
+        async with room.lock:
+            if user["id"] in room.players:
+                return room
+            if room.state != "lobby":
+                raise RoomError(400, "Room has already started")
+            if len(room.players) >= MAX_PLAYERS_PER_ROOM:
+                raise RoomError(400, "Room is full")
+            self._add_player(room, user)
+            await self._publish(room, "player_joined", {
+                "user_id": user["id"],
+                "display_name": user.get("display_name", "Player"),
+                "scoreboard": room.scoreboard(),
+            })
+        return room
+
+    async def start(self, code: str, user_id: str) -> Room:
+        room = self.get(code)
+        async with room.lock:
+            if room.host_id != user_id:
+                raise RoomError(403, "Only the host can start the room")
+            if room.state != "lobby":
+                raise RoomError(400, "Room has already started")
+            await self._next_question(room)
+        return room
+
+    async def answer(self, code: str, user_id: str, question_index: int, answer: str, used_hint: bool) -> dict:
+        room = self.get(code)
+        async with room.lock:
+            player = room.players.get(user_id)
+            if player is None:
+                raise RoomError(403, "Not a member of this room")
+            if room.state != "question" or question_index != room.current_index:
+                raise RoomError(400, "Question is not open")
+            if question_index in player["answers"]:
+                raise RoomError(400, "Question already answered")
+            if time.monotonic() > room.deadline:
+                raise RoomError(400, "Time is up for this question")
+
+            question = room.questions[question_index]
+            correct_answer = question["correct_answer"]
+            is_correct = answer.lower().strip() == correct_answer.lower().strip()
+            points = self.score_fn(room, question, is_correct, used_hint)
+            player["answers"][question_index] = {"answer": answer, "is_correct": is_correct, "points": points}
+            player["score"] += points
+            if is_correct:
+                player["correct"] += 1
+
+            await self._publish(room, "answer", {
+                "user_id": user_id,
+                "question_index": question_index,
+                "answered": sum(1 for p in room.players.values() if question_index in p["answers"]),
+                "scoreboard": room.scoreboard(),
+            })
+
+            if all(question_index in p["answers"] for p in room.players.values()):
+                await self._close_question(room)
+
+        if self.on_answer is not None:
+            is_last = question_index >= len(room.questions) - 1
+            try:
+                await self.on_answer(user_id, question, is_correct, points, is_last)
+            except Exception as e:
+                logger.error(f"Room {code} stats update failed for {user_id}: {e}")
+
+        return {
+            "is_correct": is_correct,
+            "points": points,
+            "total_score": player["score"],
+            "question_index": question_index,
+        }
+
+    def subscribe(self, code: str) -> Subscription:
+        room = self.get(code)
+        return self.pubsub.subscribe(room.channel)
+
+    # --- internals ---
+    def _add_player(self, room: Room, user: dict):
+        room.players[user["id"]] = {
+            "display_name": user.get("display_name", "Player"),
+            "score": 0,
+            "correct": 0,
+            "answers": {},
+        }
+
+    async def _publish(self, room: Room, event: str, data: dict):
+        message = json.dumps({"event": event, "room": room.code, **data})
+        await self.pubsub.publish(room.channel, message)
+
+    async def _next_question(self, room: Room):
+        room.current_index += 1
+        if room.current_index >= len(room.questions):
+            await self._finish(room)
+            return
+        room.state = "question"
+        room.deadline = time.monotonic() + room.time_per_question
+        self._schedule_timeout(room, room.current_index)
+        await self._publish(room, "question", {
+            "question_index": room.current_index,
+            "question": room.safe_questions[room.current_index],
+            "time_limit": room.time_per_question,
+        })
+
+    async def _close_question(self, room: Room):
+        """Reveal the answer for the open question and move on."""
+        self._cancel_timer(room)
+        question = room.questions[room.current_index]
+        await self._publish(room, "question_result", {
+            "question_index": room.current_index,
+            "correct_answer": question["correct_answer"],
+            "fun_fact": question.get("fun_fact", ""),
+            "scoreboard": room.scoreboard(),
+        })
+        await self._next_question(room)
+
+    async def _finish(self, room: Room):
+        room.state = "finished"
+        room.deadline = None
+        self._cancel_timer(room)
+        await self._publish(room, "finished", {"scoreboard": room.scoreboard()})
+        self._schedule_expiry(room)
+        logger.info(f"Room {room.code} finished with {len(room.players)} players")
+
+    def _schedule_timeout(self, room: Room, index: int):
+        self._cancel_timer(room)
+        loop = asyncio.get_running_loop()
+        room.timer = loop.call_later(room.time_per_question, self._on_timeout, room.code, index)
+
+    def _on_timeout(self, code: str, index: int):
+        room = self.rooms.get(code)
+        if room is None or room.state != "question" or room.current_index != index:
+            return
+        room.timer = None
+        asyncio.ensure_future(self._timeout_question(room, index))
+
+    async def _timeout_question(self, room: Room, index: int):
+        async with room.lock:
+            # an answer may have closed the question while we waited on the lock
+            if room.state == "question" and room.current_index == index:
+                await self._close_question(room)
+
+    def _schedule_expiry(self, room: Room):
+        self._cancel_timer(room)
+        loop = asyncio.get_running_loop()
+        room.timer = loop.call_later(ROOM_TTL_SECONDS, self._expire, room.code, room.state)
+
+    def _expire(self, code: str, state: str):
+        room = self.rooms.get(code)
+        if room is not None and room.state == state:
+            del self.rooms[code]
+            logger.info(f"Room {code} expired")
+
+    def _cancel_timer(self, room: Room):
+        if room.timer is not None:
+            room.timer.cancel()
+            room.timer = None
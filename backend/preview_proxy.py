@@ -0,0 +1,242 @@
+"""Audio preview proxy with a size-bounded on-disk LRU.
+
+With PREVIEW_PROXY=on, quiz questions point `preview_url` at
+`/api/preview/{track_id}` instead of Deezer. The first request for a track
+downloads the preview once; later requests (from any worker) are served
+from disk.
+
+Layout under PREVIEW_CACHE_DIR:
+
+    blobs/ab/abcdef....mp3   content-addressed by SHA-256, written atomically
+    tracks/{track_id}        the digest of that track's preview
+
+Identical audio is therefore stored once. A blob's mtime is bumped on
+every hit, and when the directory grows past PREVIEW_CACHE_MAX_MB the
+least recently used blobs are deleted down to 90% of the limit. An index
+entry whose blob was evicted is simply a miss, also when another worker
+evicts it between the lookup and the read.
+
+Deezer preview URLs are signed and expire. The proxy resolves a URL
+through the server's (cached) preview lookup, and if the download says it
+has expired it asks for a fresh one and retries once; clients never see
+the expiry.
+
+Responses are plain files: `FileResponse` (which uses the ASGI
+`http.response.pathsend` extension, i.e. zero-copy sendfile, when the
+server offers it), or a 206 slice for `Range: bytes=...` requests so audio
+elements can seek. Hit rate and bytes served from disk (bytes saved
+upstream) are exported as `preview_proxy_*` counters on /api/metrics.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from starlette.responses import FileResponse, Response
+
+import metrics
+from providers import PreviewExpiredError
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_PROXY = os.environ.get("PREVIEW_PROXY", "off").lower() in ("1", "on", "true")
+PREVIEW_CACHE_DIR = Path(os.environ.get("PREVIEW_CACHE_DIR", Path(__file__).parent / "previews"))
+PREVIEW_CACHE_MAX_MB = float(os.environ.get("PREVIEW_CACHE_MAX_MB", "512"))
+# prefix for rewritten preview URLs, e.g. https://api.example.com when the
+# frontend is served from another origin; empty gives same-origin paths
+PREVIEW_PROXY_BASE_URL = os.environ.get("PREVIEW_PROXY_BASE_URL", "").rstrip("/")
+# a 30-second MP3 is well under this; anything bigger isn't a preview
+PREVIEW_MAX_BYTES = 5 * 1024 * 1024
+TRACK_ID = re.compile(r"^[A-Za-z0-9]{1,64}$")
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class PreviewStore:
+    """Content-addressed blobs plus a track id index, evicted LRU by mtime."""
+
+    def __init__(self, directory: Path = PREVIEW_CACHE_DIR, max_bytes: int = int(PREVIEW_CACHE_MAX_MB * 1024 * 1024)):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.blobs = directory / "blobs"
+        self.index = directory / "tracks"
+        # this process's running estimate; rescanned when it crosses the limit
+        self.size: Optional[int] = None
+
+    def blob_path(self, digest: str) -> Path:
+        return self.blobs / digest[:2] / f"{digest}.mp3"
+
+    def lookup(self, track_id: str) -> Optional[Path]:
+        try:
+            digest = (self.index / track_id).read_text().strip()
+            path = self.blob_path(digest)
+            os.utime(path)
+            return path
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def store(self, track_id: str, data: bytes) -> Path:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._write_atomic(path, data)
+            if self.size is None:
+                self.size = self._scan_size()
+            else:
+                self.size += len(data)
+        self.index.mkdir(parents=True, exist_ok=True)
+        self._write_atomic(self.index / track_id, digest.encode())
+        if self.size is not None and self.size > self.max_bytes:
+            self.evict()
+        return path
+
+    @staticmethod
+    def _write_atomic(path: Path, data: bytes):
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def _blobs(self) -> list:
+        entries = []
+        if self.blobs.exists():
+            for sub in os.scandir(self.blobs):
+                if sub.is_dir():
+                    entries.extend(e for e in os.scandir(sub.path) if e.is_file() and not e.name.startswith("."))
+        return entries
+
+    def _scan_size(self) -> int:
+        return sum(e.stat().st_size for e in self._blobs())
+
+    def evict(self):
+        """Delete least recently used blobs until the store is at 90% of its limit."""
+        entries = sorted(((e.stat().st_mtime, e.stat().st_size, e.path) for e in self._blobs()))
+        size = sum(s for _, s, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, blob_size, path in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+                size -= blob_size
+            except FileNotFoundError:
+                pass
+        self.size = size
+
+
+class PreviewProxy:
+    def __init__(self, store: PreviewStore, resolve: Callable[[str, bool], Awaitable[Optional[str]]],
+                 fetch_audio: Callable[[str], Awaitable[bytes]]):
+        """`resolve(track_id, refresh)` returns the track's upstream preview URL
+        (bypassing any cached URL when `refresh` is true); `fetch_audio(url)`
+        downloads it."""
+        self.store = store
+        self.resolve = resolve
+        self.fetch_audio = fetch_audio
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def get(self, track_id: str) -> Tuple[Optional[Path], bool]:
+        """Local path of the track's preview (downloading it on a miss) and whether it was a hit."""
+        if not TRACK_ID.match(track_id):
+            return None, False
+        path = await asyncio.to_thread(self.store.lookup, track_id)
+        if path is not None:
+            metrics.PREVIEW_REQUESTS.inc("hit")
+            return path, True
+        # concurrent misses for one track share a single download
+        pending = self._inflight.get(track_id)
+        if pending is not None:
+            return await asyncio.shield(pending), False
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[track_id] = future
+        try:
+            path = await self._download(track_id)
+            future.set_result(path)
+            return path, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # mark retrieved so an unawaited future doesn't log a warning
+            future.exception()
+            raise
+        finally:
+            del self._inflight[track_id]
+
+    async def respond(self, track_id: str, range_header: Optional[str]) -> Optional[Response]:
+        """The track's preview as a response (None if it has none), fetching it on a miss."""
+        path, hit = await self.get(track_id)
+        if path is None:
+            return None
+        try:
+            return await file_response(path, range_header, hit)
+        except FileNotFoundError:
+            # evicted, possibly by another worker, since the lookup: a miss after all
+            path, hit = await self.get(track_id)
+            return await file_response(path, range_header, hit) if path is not None else None
+
+    async def _download(self, track_id: str) -> Optional[Path]:
+        url = await self.resolve(track_id, False)
+        if not url:
+            metrics.PREVIEW_REQUESTS.inc("unavailable")
+            return None
+        try:
+            data = await self.fetch_audio(url)
+        except PreviewExpiredError:
+            url = await self.resolve(track_id, True)
+            if not url:
+                metrics.PREVIEW_REQUESTS.inc("unavailable")
+                return None
+            data = await self.fetch_audio(url)
+        if len(data) > PREVIEW_MAX_BYTES:
+            logger.warning(f"Preview for {track_id} is {len(data)} bytes, not caching it")
+            metrics.PREVIEW_REQUESTS.inc("unavailable")
+            return None
+        metrics.PREVIEW_REQUESTS.inc("miss")
+        metrics.PREVIEW_BYTES.inc("upstream", amount=len(data))
+        return await asyncio.to_thread(self.store.store, track_id, data)
+
+    def stats(self) -> dict:
+        hits = metrics.PREVIEW_REQUESTS.get("hit")
+        misses = metrics.PREVIEW_REQUESTS.get("miss")
+        return {
+            "hits": int(hits),
+            "misses": int(misses),
+            "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+            "bytes_saved": int(metrics.PREVIEW_BYTES.get("cache")),
+            "bytes_fetched": int(metrics.PREVIEW_BYTES.get("upstream")),
+        }
+
+
+def _read_range(path: Path, start: int, length: int) -> bytes:
+    with open(path, "rb") as f:
+        return os.pread(f.fileno(), length, start)
+
+
+async def file_response(path: Path, range_header: Optional[str], hit: bool = True) -> Response:
+    """The preview file, whole or as a single byte range."""
+    stat_result = await asyncio.to_thread(path.stat)
+    size = stat_result.st_size
+    headers = {"accept-ranges": "bytes", "cache-control": "public, max-age=86400",
+               "etag": f'"{path.stem}"', "x-cache": "hit" if hit else "miss"}
+    match = RANGE.match(range_header.strip()) if range_header else None
+    if match is None or match.groups() == ("", ""):
+        if hit:
+            metrics.PREVIEW_BYTES.inc("cache", amount=size)
+        return FileResponse(path, media_type="audio/mpeg", headers=headers, stat_result=stat_result)
+    first, last = match.groups()
+    if first == "":
+        # suffix range: the last N bytes
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return Response(status_code=416, headers={**headers, "content-range": f"bytes */{size}"})
+    body = await asyncio.to_thread(_read_range, path, start, end - start + 1)
+    if hit:
+        metrics.PREVIEW_BYTES.inc("cache", amount=len(body))
+    return Response(body, status_code=206, media_type="audio/mpeg",
+                    headers={**headers, "content-range": f"bytes {start}-{end}/{size}"})
@@ -0,0 +1,502 @@
+"""Pluggable external providers: Spotify search, Deezer previews and the Gemini LLM.
+
+Every provider has a live implementation plus offline ones, so the quiz
+pipeline can be tested and benchmarked without credentials or network:
+
+- `live`       the real APIs
+- `synthetic`  deterministic fake data derived from the request arguments
+- `record`     calls the live API and saves every response to a cassette
+- `replay`     serves responses from a cassette only
+
+Selection is by environment variable: PROVIDERS sets the default for all
+three, and SPOTIFY_PROVIDER / DEEZER_PROVIDER / LLM_PROVIDER override it per
+provider. Non-live providers can be wrapped with simulated behaviour:
+
+    PROVIDER_LATENCY=fixed:50 | uniform:20,200 | lognormal:80,0.5   (ms)
+    PROVIDER_ERROR_RATE=0.05        fraction of calls that raise ProviderError
+    PROVIDER_RATE_LIMIT=20          calls/second before RateLimitedError
+    PROVIDER_SEED=42                makes latency/error draws reproducible
+    PROVIDER_CASSETTE_DIR=cassettes where record/replay keep their files
+
+Recording keeps new responses in memory and writes the cassette in a thread
+every PROVIDER_CASSETTE_FLUSH_SECONDS and at shutdown (`close_cassettes`).
+"""
+import array
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+import random
+import time
+import wave
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = os.environ.get("PROVIDERS", "live").lower()
+PROVIDER_LATENCY = os.environ.get("PROVIDER_LATENCY", "")
+PROVIDER_ERROR_RATE = float(os.environ.get("PROVIDER_ERROR_RATE", "0"))
+PROVIDER_RATE_LIMIT = float(os.environ.get("PROVIDER_RATE_LIMIT", "0"))
+PROVIDER_SEED = os.environ.get("PROVIDER_SEED")
+PROVIDER_CASSETTE_DIR = Path(os.environ.get("PROVIDER_CASSETTE_DIR", Path(__file__).parent / "cassettes"))
+PROVIDER_CASSETTE_FLUSH_SECONDS = float(os.environ.get("PROVIDER_CASSETTE_FLUSH_SECONDS", "5"))
+
+
+class ProviderError(Exception):
+    """A provider call failed (real or injected)."""
+
+
+class RateLimitedError(ProviderError):
+    """The provider (or its simulation) refused the call for exceeding its rate limit."""
+
+
+class PreviewExpiredError(ProviderError):
+    """A preview URL is no longer valid (signed URLs expire); look it up again."""
+
+
+# --- Interfaces ---
+class MusicProvider:
+    """Track search. Returns raw Spotify-shaped track items."""
+
+    name = "spotify"
+
+    async def search_tracks(self, query: str, limit: int) -> list:
+        raise NotImplementedError
+
+
+class PreviewProvider:
+    """30-second preview lookup by track and artist name, and the audio behind it."""
+
+    name = "deezer"
+
+    async def find_preview(self, track_name: str, artist_name: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def fetch_audio(self, url: str) -> bytes:
+        raise NotImplementedError
+
+
+class LLMProvider:
+    """Text generation. `json_output` marks prompts that expect a JSON object back."""
+
+    name = "gemini"
+
+    async def generate(self, system_instruction: str, prompt: str, json_output: bool = False) -> str:
+        raise NotImplementedError
+
+
+# --- Live implementations ---
+class SpotifyMusicProvider(MusicProvider):
+    def __init__(self, client):
+        self.client = client
+
+    async def search_tracks(self, query: str, limit: int) -> list:
+        # spotipy is synchronous; run it off the event loop
+        results = await asyncio.to_thread(self.client.search, q=query, type="track", limit=limit, market="US")
+        return results["tracks"]["items"]
+
+
+class DeezerPreviewProvider(PreviewProvider):
+    def __init__(self, api_url: str = "https://api.deezer.com", timeout: float = 5):
+        self.api_url = api_url.rstrip("/")
+        self.timeout = timeout
+
+    async def find_preview(self, track_name: str, artist_name: str) -> Optional[str]:
+        import aiohttp
+
+        query = f"{track_name} {artist_name}"
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"{self.api_url}/search", params={"q": query, "limit": 3}, timeout=aiohttp.ClientTimeout(total=self.timeout)) as resp:
+                if resp.status == 429:
+                    raise RateLimitedError("Deezer rate limit")
+                if resp.status != 200:
+                    return None
+                data = await resp.json()
+        for item in data.get("data", []):
+            preview = item.get("preview")
+            if preview:
+                return preview
+        return None
+
+    async def fetch_audio(self, url: str) -> bytes:
+        import aiohttp
+
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=self.timeout * 2)) as resp:
+                if resp.status in (403, 404, 410):
+                    raise PreviewExpiredError(f"Deezer preview URL returned {resp.status}")
+                if resp.status == 429:
+                    raise RateLimitedError("Deezer rate limit")
+                if resp.status != 200:
+                    raise ProviderError(f"Deezer preview download returned {resp.status}")
+                return await resp.read()
+
+
+class GeminiLLMProvider(LLMProvider):
+    def __init__(self, api_key: str, model_name: str = "gemini-2.0-flash", api_endpoint: Optional[str] = None):
+        import google.generativeai as genai
+
+        self.genai = genai
+        self.model_name = model_name
+        self.api_endpoint = api_endpoint
+        if api_endpoint:
+            genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": api_endpoint})
+        else:
+            genai.configure(api_key=api_key)
+        self._models = {}
+
+    def _model(self, system_instruction: str):
+        model = self._models.get(system_instruction)
+        if model is None:
+            model = self.genai.GenerativeModel(model_name=self.model_name, system_instruction=system_instruction)
+            self._models[system_instruction] = model
+        return model
+
+    async def generate(self, system_instruction: str, prompt: str, json_output: bool = False) -> str:
+        model = self._model(system_instruction)
+        if self.api_endpoint:
+            # the REST transport has no async client; keep the event loop free
+            response = await asyncio.to_thread(model.generate_content, prompt)
+        else:
+            response = await model.generate_content_async(prompt)
+        return response.text
+
+
+# --- Synthetic implementations ---
+SYNTHETIC_ARTISTS = [
+    "Taylor Swift", "Drake", "The Weeknd", "Billie Eilish", "Ed Sheeran", "Dua Lipa",
+    "Post Malone", "Ariana Grande", "Kendrick Lamar", "Bruno Mars", "Adele", "Coldplay",
+    "Eminem", "Rihanna", "Miles Davis", "Johnny Cash", "Metallica", "B.B. King",
+]
+SYNTHETIC_WORDS = ["Midnight", "Echo", "Golden", "River", "Neon", "Heart", "Summer", "Ghost", "Fire", "Blue", "Road", "Dream"]
+
+
+def stable_hash(*parts) -> int:
+    return int(hashlib.sha1("\x1f".join(str(p) for p in parts).encode()).hexdigest()[:12], 16)
+
+
+class SyntheticMusicProvider(MusicProvider):
+    async def search_tracks(self, query: str, limit: int) -> list:
+        items = []
+        for i in range(limit):
+            h = stable_hash(query, i)
+            track_id = f"{h:012x}syn{i:02d}"
+            items.append({
+                "id": track_id,
+                "name": f"{SYNTHETIC_WORDS[h % 12]} {SYNTHETIC_WORDS[(h // 12) % 12]}",
+                "artists": [{"name": SYNTHETIC_ARTISTS[(h // 144) % len(SYNTHETIC_ARTISTS)]}],
+                "album": {"name": f"{SYNTHETIC_WORDS[(h // 7) % 12]} Sessions", "images": [{"url": f"https://example.invalid/art/{track_id}.jpg"}]},
+                "external_urls": {"spotify": f"https://open.spotify.com/track/{track_id}"},
+                "popularity": h % 100,
+            })
+        return items
+
+
+class SyntheticPreviewProvider(PreviewProvider):
+    def __init__(self, missing_rate: float = 0.2):
+        self.missing_rate = missing_rate
+
+    async def find_preview(self, track_name: str, artist_name: str) -> Optional[str]:
+        h = stable_hash(track_name, artist_name)
+        if (h % 1000) / 1000 < self.missing_rate:
+            return None
+        return f"https://cdn.example.invalid/preview/{h:012x}.mp3"
+
+    async def fetch_audio(self, url: str) -> bytes:
+        return synthetic_wav(stable_hash(url))
+
+
+def synthetic_wav(h: int, seconds: int = 30, rate: int = 2000) -> bytes:
+    """A quiet tone with a louder, busier 10-second "chorus" at a hash-derived offset."""
+    chorus = h % (seconds - 10)
+    freq = 220 + h % 220
+    samples = array.array("h")
+    for i in range(seconds * rate):
+        t = i / rate
+        loud = chorus <= t < chorus + 10
+        tone = math.sin(2 * math.pi * freq * t)
+        if loud:
+            # add a pulsing overtone so the chorus also has onsets
+            tone += 0.6 * math.sin(2 * math.pi * freq * 1.5 * t) * (1 if int(t * 4) % 2 else 0)
+        samples.append(int(tone * (9000 if loud else 2500)))
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(samples.tobytes())
+    return buf.getvalue()
+
+
+class SyntheticLLMProvider(LLMProvider):
+    async def generate(self, system_instruction: str, prompt: str, json_output: bool = False) -> str:
+        h = stable_hash(prompt)
+        if json_output:
+            return json.dumps({
+                "question": f"Synthetic question #{h % 1000}: which one is it?",
+                "hint": "Listen to the rhythm section.",
+                "fun_fact": f"Synthetic fun fact #{h % 97}.",
+            })
+        return f"Synthetic host response #{h % 1000}. Keep going!"
+
+
+# --- Record / replay ---
+class Cassette:
+    """JSON file mapping a hash of (method, args) to the recorded response.
+
+    `put` only updates memory; the file is rewritten in a thread at most
+    every `flush_seconds`, and by `close` at shutdown.
+    """
+
+    def __init__(self, path: Path, flush_seconds: float = PROVIDER_CASSETTE_FLUSH_SECONDS):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.entries = json.loads(path.read_text()) if path.exists() else {}
+        self.dirty = False
+        self._task: Optional[asyncio.Task] = None
+        self._writing: Optional[asyncio.Future] = None
+
+    @staticmethod
+    def key(method: str, *args) -> str:
+        return hashlib.sha1(json.dumps([method, *args], default=str).encode()).hexdigest()
+
+    def get(self, key: str):
+        if key not in self.entries:
+            raise ProviderError(f"No recording in {self.path.name} for {key}")
+        return self.entries[key]
+
+    def put(self, key: str, value):
+        self.entries[key] = value
+        self.dirty = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._save_later())
+
+    async def _save_later(self):
+        await asyncio.sleep(self.flush_seconds)
+        try:
+            await self.save()
+        except OSError as e:
+            logger.error(f"Saving {self.path.name} failed: {e}")
+
+    async def save(self):
+        if self._writing is not None and not self._writing.done():
+            # a cancelled flush leaves its thread running; never write twice at once
+            await asyncio.wait([self._writing])
+        if not self.dirty:
+            return
+        # a snapshot, so recording can go on while the thread writes
+        entries, self.dirty = dict(self.entries), False
+        self._writing = asyncio.ensure_future(asyncio.to_thread(self._write, entries))
+        try:
+            await asyncio.shield(self._writing)
+        except OSError:
+            self.dirty = True
+            raise
+
+    def _write(self, entries: dict):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(entries))
+        tmp.replace(self.path)
+
+    async def close(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        await self.save()
+
+
+# every cassette opened by _build, saved by close_cassettes at shutdown
+CASSETTES = []
+
+
+async def close_cassettes():
+    for cassette in CASSETTES:
+        await cassette.close()
+
+
+class RecordingMusicProvider(MusicProvider):
+    def __init__(self, inner: MusicProvider, cassette: Cassette, replay_only: bool = False):
+        self.inner, self.cassette, self.replay_only = inner, cassette, replay_only
+
+    async def search_tracks(self, query: str, limit: int) -> list:
+        key = Cassette.key("search_tracks", query, limit)
+        if self.replay_only:
+            return self.cassette.get(key)
+        result = await self.inner.search_tracks(query, limit)
+        self.cassette.put(key, result)
+        return result
+
+
+class RecordingPreviewProvider(PreviewProvider):
+    def __init__(self, inner: PreviewProvider, cassette: Cassette, replay_only: bool = False):
+        self.inner, self.cassette, self.replay_only = inner, cassette, replay_only
+
+    async def find_preview(self, track_name: str, artist_name: str) -> Optional[str]:
+        key = Cassette.key("find_preview", track_name, artist_name)
+        if self.replay_only:
+            return self.cassette.get(key)
+        result = await self.inner.find_preview(track_name, artist_name)
+        self.cassette.put(key, result)
+        return result
+
+    async def fetch_audio(self, url: str) -> bytes:
+        # audio is too large for a JSON cassette; only recording sessions can fetch it
+        if self.replay_only:
+            raise ProviderError("Preview audio is not recorded")
+        return await self.inner.fetch_audio(url)
+
+
+class RecordingLLMProvider(LLMProvider):
+    def __init__(self, inner: LLMProvider, cassette: Cassette, replay_only: bool = False):
+        self.inner, self.cassette, self.replay_only = inner, cassette, replay_only
+
+    async def generate(self, system_instruction: str, prompt: str, json_output: bool = False) -> str:
+        key = Cassette.key("generate", system_instruction, prompt, json_output)
+        if self.replay_only:
+            return self.cassette.get(key)
+        result = await self.inner.generate(system_instruction, prompt, json_output)
+        self.cassette.put(key, result)
+        return result
+
+
+# --- Simulated latency, errors and rate limits ---
+class LatencyModel:
+    """Parses PROVIDER_LATENCY specs and draws delays in seconds."""
+
+    def __init__(self, spec: str, rng: random.Random):
+        self.rng = rng
+        self.kind, _, params = (spec or "fixed:0").partition(":")
+        self.params = [float(p) for p in params.split(",") if p] or [0.0]
+
+    def sample(self) -> float:
+        if self.kind == "uniform":
+            lo, hi = self.params[0], self.params[-1]
+            ms = self.rng.uniform(lo, hi)
+        elif self.kind == "lognormal":
+            median = self.params[0]
+            sigma = self.params[1] if len(self.params) > 1 else 0.5
+            ms = median * self.rng.lognormvariate(0, sigma)
+        else:
+            ms = self.params[0]
+        return max(ms, 0) / 1000
+
+
+class TokenBucket:
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class FaultInjector:
+    """Applies latency, error and rate-limit simulation before a provider call."""
+
+    def __init__(self, name: str, latency: str = PROVIDER_LATENCY, error_rate: float = PROVIDER_ERROR_RATE,
+                 rate_limit: float = PROVIDER_RATE_LIMIT, seed: Optional[str] = PROVIDER_SEED):
+        self.name = name
+        self.rng = random.Random(f"{seed}:{name}" if seed is not None else None)
+        self.latency_spec = latency
+        self.latency = LatencyModel(latency, self.rng)
+        self.error_rate = error_rate
+        self.bucket = TokenBucket(rate_limit) if rate_limit > 0 else None
+
+    @property
+    def active(self) -> bool:
+        return bool(self.latency_spec or self.error_rate or self.bucket)
+
+    async def before_call(self):
+        if self.bucket is not None and not self.bucket.take():
+            raise RateLimitedError(f"{self.name}: simulated rate limit")
+        delay = self.latency.sample()
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and self.rng.random() < self.error_rate:
+            raise ProviderError(f"{self.name}: injected failure")
+
+
+class FaultyMusicProvider(MusicProvider):
+    def __init__(self, inner: MusicProvider, faults: FaultInjector):
+        self.inner, self.faults = inner, faults
+
+    async def search_tracks(self, query: str, limit: int) -> list:
+        await self.faults.before_call()
+        return await self.inner.search_tracks(query, limit)
+
+
+class FaultyPreviewProvider(PreviewProvider):
+    def __init__(self, inner: PreviewProvider, faults: FaultInjector):
+        self.inner, self.faults = inner, faults
+
+    async def find_preview(self, track_name: str, artist_name: str) -> Optional[str]:
+        await self.faults.before_call()
+        return await self.inner.find_preview(track_name, artist_name)
+
+    async def fetch_audio(self, url: str) -> bytes:
+        await self.faults.before_call()
+        return await self.inner.fetch_audio(url)
+
+
+class FaultyLLMProvider(LLMProvider):
+    def __init__(self, inner: LLMProvider, faults: FaultInjector):
+        self.inner, self.faults = inner, faults
+
+    async def generate(self, system_instruction: str, prompt: str, json_output: bool = False) -> str:
+        await self.faults.before_call()
+        return await self.inner.generate(system_instruction, prompt, json_output)
+
+
+# --- Factories ---
+def provider_kind(env_name: str) -> str:
+    kind = os.environ.get(env_name, PROVIDERS).lower()
+    if kind not in ("live", "synthetic", "record", "replay"):
+        logger.warning(f"Unknown {env_name} '{kind}', using live")
+        kind = "live"
+    return kind
+
+
+def _build(kind: str, name: str, live_factory, synthetic_cls, recording_cls, faulty_cls):
+    if kind == "synthetic":
+        provider = synthetic_cls()
+    elif kind in ("record", "replay"):
+        cassette = Cassette(PROVIDER_CASSETTE_DIR / f"{name}.json")
+        CASSETTES.append(cassette)
+        inner = live_factory() if kind == "record" else None
+        provider = recording_cls(inner, cassette, replay_only=kind == "replay")
+    else:
+        return live_factory()
+    faults = FaultInjector(name)
+    if faults.active:
+        provider = faulty_cls(provider, faults)
+    logger.info(f"Using {kind} {name} provider")
+    return provider
+
+
+def build_music_provider(spotify_client_factory) -> MusicProvider:
+    return _build(provider_kind("SPOTIFY_PROVIDER"), "spotify",
+                  lambda: SpotifyMusicProvider(spotify_client_factory()),
+                  SyntheticMusicProvider, RecordingMusicProvider, FaultyMusicProvider)
+
+
+def build_preview_provider(api_url: str) -> PreviewProvider:
+    return _build(provider_kind("DEEZER_PROVIDER"), "deezer",
+                  lambda: DeezerPreviewProvider(api_url),
+                  SyntheticPreviewProvider, RecordingPreviewProvider, FaultyPreviewProvider)
+
+
+def build_llm_provider(api_key: str, api_endpoint: Optional[str] = None) -> LLMProvider:
+    return _build(provider_kind("LLM_PROVIDER"), "gemini",
+                  lambda: GeminiLLMProvider(api_key, api_endpoint=api_endpoint),
+                  SyntheticLLMProvider, RecordingLLMProvider, FaultyLLMProvider)
@@ -0,0 +1,180 @@
+"""Response cache and conditional GETs for read-heavy endpoints.
+
+Each cached route declares the version counters its response depends on,
+e.g. `/api/user/stats` depends on `user:{user_id}` and `/api/leaderboard`
+on `leaderboard`. Writes call `bump()` on the counters they affect. The
+ETag is a hash of the path, query, user and current counter values, so it
+can be computed (and a 304 returned) without running the handler or
+touching MongoDB; a full response is served from the cache tier when the
+same ETag has been rendered before.
+
+Counters live in the shared cache (cache.py), so a bump in one worker
+changes the ETag in all of them. A counter is a time-based token rather
+than a plain integer, so an evicted or expired counter can never come back
+with a value an old ETag was built from. Counters expire after
+RESPONSE_CACHE_TTL_SECONDS, which also bounds staleness for writes that
+don't bump (e.g. `lifecycle.py` run by hand, outside the server).
+"""
+import hashlib
+import logging
+import os
+import re
+import time
+from typing import Callable, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE", "on").lower() not in ("0", "off", "false")
+RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", "300"))
+# don't keep very large bodies in the cache tier; they still get ETags
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", "262144"))
+
+
+class Rule:
+    """A cacheable GET route.
+
+    `path` may contain `{param}` segments. `versions` are counter names and
+    may reference `{user_id}`. Routes that aren't `public` are keyed per
+    user and only cached for authenticated requests. `endpoint` is recorded
+    in the scope for requests answered without reaching the router, so
+    metrics and traces still attribute them to the route.
+    """
+
+    def __init__(self, path: str, versions: Sequence[str], public: bool = False, endpoint: Optional[Callable] = None):
+        self.path = path
+        self.endpoint = endpoint
+        self.pattern = re.compile("^" + re.sub(r"\{[^/]+\}", "[^/]+", path) + "$")
+        self.versions = tuple(versions)
+        self.public = public
+
+
+def version_key(name: str) -> str:
+    return f"ver:{name}"
+
+
+async def current_version(cache, name: str) -> int:
+    key = version_key(name)
+    value = await cache.get(key)
+    if value is None:
+        value = time.time_ns()
+        await cache.set(key, value, RESPONSE_CACHE_TTL_SECONDS)
+    return value
+
+
+async def bump(cache, *names: str):
+    """Invalidate every cached response depending on these counters."""
+    for name in names:
+        try:
+            await cache.set(version_key(name), time.time_ns(), RESPONSE_CACHE_TTL_SECONDS)
+        except Exception as e:
+            # worst case the old ETag stays valid until the counter expires
+            logger.warning(f"Failed to bump response version {name}: {e}")
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    return any(tag.strip() == etag for tag in header.split(","))
+
+
+class ResponseCacheMiddleware:
+    """Pure ASGI middleware serving 304s and cached bodies for `rules`.
+
+    `get_cache` returns the cache tier (resolved per request so the
+    dependency container stays lazy); `identify` maps the request headers
+    to a user id, or None for anonymous/invalid credentials.
+    """
+
+    def __init__(self, app, rules: Sequence[Rule], get_cache: Callable, identify: Callable[[dict], Optional[str]]):
+        self.app = app
+        self.rules = rules
+        self.get_cache = get_cache
+        self.identify = identify
+
+    def match(self, scope) -> Optional[Rule]:
+        if scope["type"] != "http" or scope["method"] != "GET":
+            return None
+        for rule in self.rules:
+            if rule.pattern.match(scope["path"]):
+                return rule
+        return None
+
+    async def __call__(self, scope, receive, send):
+        rule = self.match(scope) if RESPONSE_CACHE_ENABLED else None
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+        user_id = None
+        if not rule.public:
+            user_id = self.identify(headers)
+            if user_id is None:
+                # let the endpoint produce its 401
+                await self.app(scope, receive, send)
+                return
+
+        cache = self.get_cache()
+        try:
+            versions = [await current_version(cache, v.format(user_id=user_id)) for v in rule.versions]
+        except Exception as e:
+            logger.warning(f"Response cache unavailable: {e}")
+            await self.app(scope, receive, send)
+            return
+
+        digest = hashlib.sha1(
+            f"{scope['path']}?{scope['query_string'].decode('latin-1')}|{user_id}|{versions}".encode()
+        ).hexdigest()[:20]
+        etag = f'W/"{digest}"'
+        cache_control = "public, no-cache" if rule.public else "private, no-cache"
+        base_headers = [(b"etag", etag.encode()), (b"cache-control", cache_control.encode())]
+
+        if rule.endpoint is not None:
+            scope["endpoint"] = rule.endpoint
+
+        if etag_matches(headers.get("if-none-match", ""), etag):
+            await send({"type": "http.response.start", "status": 304, "headers": base_headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        body_key = f"resp:{digest}"
+        try:
+            cached = await cache.get(body_key)
+        except Exception:
+            cached = None
+        if cached is not None:
+            body = cached["body"].encode()
+            await send({"type": "http.response.start", "status": 200, "headers": base_headers + [
+                (b"content-type", cached["content_type"].encode()),
+                (b"content-length", str(len(body)).encode()),
+                (b"x-cache", b"hit"),
+            ]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        captured = {"status": None, "content_type": None, "chunks": [], "size": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                captured["status"] = message["status"]
+                if message["status"] == 200:
+                    for k, v in message.get("headers", []):
+                        if k.lower() == b"content-type":
+                            captured["content_type"] = v.decode("latin-1")
+                    message = dict(message, headers=list(message.get("headers", [])) + base_headers + [(b"x-cache", b"miss")])
+            elif message["type"] == "http.response.body" and captured["status"] == 200:
+                captured["size"] += len(message.get("body", b""))
+                if captured["size"] <= RESPONSE_CACHE_MAX_BYTES:
+                    captured["chunks"].append(message.get("body", b""))
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+        if captured["status"] == 200 and captured["content_type"] and captured["size"] <= RESPONSE_CACHE_MAX_BYTES:
+            try:
+                await cache.set(body_key, {
+                    "body": b"".join(captured["chunks"]).decode(),
+                    "content_type": captured["content_type"],
+                }, RESPONSE_CACHE_TTL_SECONDS)
+            except Exception as e:
+                logger.warning(f"Failed to store cached response for {scope['path']}: {e}")
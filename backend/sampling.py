@@ -0,0 +1,126 @@
+"""Weighted random sampling.
+
+`WeightTree` keeps the weights in a Fenwick (binary indexed) tree: adding an
+item, changing a weight and drawing are each O(log n). catalog.Catalog uses
+it, because crawls keep adding and re-weighting tracks between draws, which
+a structure built once (such as an alias table) would have to redo in O(n).
+"""
+import random
+from typing import Dict, Generic, Hashable, Iterable, List, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class WeightTree(Generic[T]):
+    __slots__ = ("items", "weights", "tree", "positions")
+
+    def __init__(self, entries: Iterable[Tuple[Hashable, T, float]] = ()):
+        self.items: List[T] = []
+        self.weights: List[float] = []
+        self.positions: Dict[Hashable, int] = {}
+        for key, item, weight in entries:
+            self.positions[key] = len(self.items)
+            self.items.append(item)
+            self.weights.append(float(weight))
+        # tree[i] holds the sum of weights[i - lowbit(i) : i] (1-based); built in O(n)
+        n = len(self.weights)
+        self.tree = [0.0] + self.weights
+        for i in range(1, n + 1):
+            parent = i + (i & -i)
+            if parent <= n:
+                self.tree[parent] += self.tree[i]
+
+    def __len__(self):
+        return len(self.items)
+
+    def _add(self, index: int, delta: float):
+        i = index + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, count: int) -> float:
+        """Sum of the first `count` weights."""
+        total = 0.0
+        while count > 0:
+            total += self.tree[count]
+            count -= count & -count
+        return total
+
+    @property
+    def total(self) -> float:
+        return self._prefix(len(self.items))
+
+    def set(self, key: Hashable, item: T, weight: float):
+        """Add `item` under `key`, or replace it and its weight."""
+        weight = float(weight)
+        index = self.positions.get(key)
+        if index is not None:
+            self.items[index] = item
+            self._add(index, weight - self.weights[index])
+            self.weights[index] = weight
+            return
+        index = self.positions[key] = len(self.items)
+        self.items.append(item)
+        self.weights.append(weight)
+        # the new node covers weights[index - lowbit + 1 : index + 1]
+        i = index + 1
+        self.tree.append(weight + self._prefix(i - 1) - self._prefix(i - (i & -i)))
+
+    def _find(self, target: float) -> int:
+        """The index whose cumulative weight range contains `target`."""
+        pos, step = 0, 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            nxt = pos + step
+            if nxt < len(self.tree) and self.tree[nxt] <= target:
+                pos = nxt
+                target -= self.tree[nxt]
+            step >>= 1
+        # rounding can walk past the last item with weight; check the tree,
+        # not self.weights, since draw_distinct zeroes drawn items there
+        while pos >= len(self.items) or self._weight(pos) <= 0:
+            pos -= 1
+        return pos
+
+    def _weight(self, index: int) -> float:
+        """The weight the tree currently holds for `index`."""
+        return self._prefix(index + 1) - self._prefix(index)
+
+    def draw_index(self, rng=random) -> int:
+        total = self.total
+        if total <= 0:
+            return rng.randrange(len(self.items))
+        return self._find(rng.random() * total)
+
+    def draw(self, rng=random) -> T:
+        return self.items[self.draw_index(rng)]
+
+    def draw_distinct(self, k: int, rng=random) -> List[T]:
+        """Up to k distinct items, drawn without replacement in O(k log n).
+
+        Each drawn item's weight is zeroed for the following draws and
+        restored afterwards. Once only zero-weight items remain, the rest
+        are picked uniformly.
+        """
+        n = len(self.items)
+        if k >= n:
+            items = list(self.items)
+            rng.shuffle(items)
+            return items
+        picked: List[int] = []
+        try:
+            while len(picked) < k:
+                total = self.total
+                if total <= 1e-12 * max(1, n):
+                    break
+                i = self._find(rng.random() * total)
+                picked.append(i)
+                self._add(i, -self.weights[i])
+        finally:
+            for i in picked:
+                self._add(i, self.weights[i])
+        if len(picked) < k:
+            chosen = set(picked)
+            rest = [i for i in range(n) if i not in chosen]
+            picked.extend(rng.sample(rest, k - len(picked)))
+        return [self.items[i] for i in picked]
@@ -1,81 +1,206 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, FileResponse, JSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 import uuid
-import jwt as pyjwt
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth
 from pydantic import BaseModel, Field
 from typing import List, Optional
+from contextlib import asynccontextmanager
+from collections import Counter
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
+import math
 import random
 import requests
 import asyncio
-
-# custom quiz question data for educational mode
-# `quiz_data.py` sits alongside server.py, so import directly
-import quiz_data
+import json
+
+# backend modules sit alongside server.py, so import directly
+import container
+import database
+import multiplayer
+import timers
+import lifecycle
+import providers
+import metrics
+import tracing
+import response_cache
+import fastjson
+import compression
+import distractors
+import adaptive
+import calibration
+import events
+import counters
+import guests
+import tokens
+import catalog
+import preview_proxy
+import audio_features
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-'''mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ.get('DB_NAME', 'musicquiz')]'''
-#mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-mongo_url = os.environ.get("MONGO_URL") or "mongodb://localhost:27017"
-if "mongodb+srv" in mongo_url:
-    # Cloud (MongoDB Atlas / Render)
-    client = AsyncIOMotorClient(
-        mongo_url,
-        tls=True,
-        tlsAllowInvalidCertificates=True
-    )
-else:
-    # Local MongoDB
-    client = AsyncIOMotorClient(mongo_url)
-
-db = client[os.environ.get('DB_NAME', 'musicquiz')]
-
 # Config
+MONGO_URL = os.environ.get("MONGO_URL") or "mongodb://localhost:27017"
+DB_NAME = os.environ.get('DB_NAME', 'musicquiz')
 SPOTIFY_CLIENT_ID = os.environ.get('SPOTIFY_CLIENT_ID', 'dummy_spotify_id')
 SPOTIFY_CLIENT_SECRET = os.environ.get('SPOTIFY_CLIENT_SECRET', 'dummy_spotify_secret')
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', 'dummy_gemini_key')
 LLM_API_KEY = GEMINI_API_KEY
-JWT_SECRET = os.environ.get('JWT_SECRET', 'fallback_secret')
+# one of JWT_SECRET / JWT_KEYS is required; the server won't start without
+JWT_SECRET = os.environ.get('JWT_SECRET')
+# "kid:secret,..." signing keys, newest first (see tokens.py); defaults to JWT_SECRET
+JWT_KEYS = os.environ.get('JWT_KEYS', '')
+# with JWT_KEYS, tokens without a key id verify with JWT_SECRET until this ISO time
+JWT_LEGACY_TOKENS_UNTIL = os.environ.get('JWT_LEGACY_TOKENS_UNTIL', '')
+# when set, /api/metrics requires "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# /api/admin/* endpoints are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
 FRONTEND_URL = os.environ.get('FRONTEND_URL', 'http://localhost:3000')
 
+# Provider endpoints; overridden to point at local stubs when benchmarking
+SPOTIFY_API_URL = os.environ.get('SPOTIFY_API_URL')
+SPOTIFY_ACCOUNTS_URL = os.environ.get('SPOTIFY_ACCOUNTS_URL')
+DEEZER_API_URL = os.environ.get('DEEZER_API_URL', 'https://api.deezer.com').rstrip('/')
+GEMINI_API_ENDPOINT = os.environ.get('GEMINI_API_ENDPOINT')
+
 # Spotify OAuth
 SPOTIFY_REDIRECT_URI = os.environ.get('SPOTIPY_REDIRECT_URI', f"{FRONTEND_URL}/callback")
 #SPOTIFY_REDIRECT_URI = "http://127.0.0.1:8888/callback"
 SPOTIFY_SCOPES = "user-read-private user-read-email user-top-read"
 
-print("SPOTIFY REDIRECT URI =", SPOTIFY_REDIRECT_URI)
-sp_oauth = SpotifyOAuth(
-    client_id=SPOTIFY_CLIENT_ID,
-    client_secret=SPOTIFY_CLIENT_SECRET,
-    redirect_uri=SPOTIFY_REDIRECT_URI,
-    scope=SPOTIFY_SCOPES,
-    show_dialog=True,  # Forces the login window to appear even if authorized previously
-    cache_path=None    # Prevent caching of tokens on disk
-)
-
-# Spotify client credentials for general API access
-sp_client = spotipy.Spotify(auth_manager=SpotifyClientCredentials(
-    client_id=SPOTIFY_CLIENT_ID,
-    client_secret=SPOTIFY_CLIENT_SECRET
-))
-
-# Gemini LLM
-import google.generativeai as genai
+# MongoDB, Spotify clients, music/preview/LLM providers (see providers.py;
+# PROVIDERS=synthetic/record/replay runs the pipeline offline) and the
+# question bank are built lazily by the container and warmed at startup;
+# pool size, timeouts and per-operation-class routing come from database.py
+mongo_pool = metrics.MongoPoolListener()
+deps = container.Container({
+    "mongo_url": MONGO_URL,
+    "db_name": DB_NAME,
+    "spotify_client_id": SPOTIFY_CLIENT_ID,
+    "spotify_client_secret": SPOTIFY_CLIENT_SECRET,
+    "spotify_redirect_uri": SPOTIFY_REDIRECT_URI,
+    "spotify_scopes": SPOTIFY_SCOPES,
+    "spotify_accounts_url": SPOTIFY_ACCOUNTS_URL,
+    "spotify_api_url": SPOTIFY_API_URL,
+    "deezer_api_url": DEEZER_API_URL,
+    "llm_api_key": LLM_API_KEY,
+    "gemini_api_endpoint": GEMINI_API_ENDPOINT,
+}, mongo_listeners=[metrics.MongoCommandListener(), tracing.MongoSpanListener(), mongo_pool])
+
+SESSION_REAPER_INTERVAL_MINUTES = float(os.environ.get("SESSION_REAPER_INTERVAL_MINUTES", "0"))
+CALIBRATION_INTERVAL_MINUTES = float(os.environ.get("CALIBRATION_INTERVAL_MINUTES", "0"))
+# flat per-answer analytics events, written in batches (see events.py)
+answer_events = events.create_sink(lambda: deps.db_for("telemetry"))
+async def on_counters_flushed(user_ids: list):
+    # other workers' cached stats, profiles and leaderboards now change too
+    await response_cache.bump(deps.cache, "leaderboard", *(f"user:{uid}" for uid in user_ids))
+
+async def on_sessions_changed(user_ids: set):
+    # reaped or compacted sessions: cached session and stats bodies are stale
+    await response_cache.bump(deps.cache, *(f"user:{uid}" for uid in user_ids))
+
+# per-user stats, buffered and written in coalesced batches (see counters.py)
+stat_counters = counters.create_counters(lambda: deps.db, on_flush=on_counters_flushed)
+# never returned to clients
+USER_PROJECTION = {"_id": 0, "counter_batches": 0, "guest_key": 0}
+GUEST_CLEANUP_INTERVAL_MINUTES = float(os.environ.get("GUEST_CLEANUP_INTERVAL_MINUTES", "0"))
+guest_directory = guests.GuestDirectory(lambda: deps.db_for("critical"), USER_PROJECTION)
+
+async def record_user_counters(batch: dict):
+    """Apply {user_id: {field: delta}} now (STAT_COUNTERS=direct) or through the write-behind buffer."""
+    if stat_counters is None:
+        await counters.apply(deps.db, batch)
+        return
+    for user_id, deltas in batch.items():
+        await stat_counters.record(user_id, deltas)
+
+def with_pending_counters(user: dict) -> dict:
+    """The user document plus this worker's not yet written counter deltas and sets."""
+    if stat_counters is None:
+        return user
+    return counters.merge(user, stat_counters.pending_for(user["id"]), stat_counters.pending_sets_for(user["id"]))
+
+async def apply_calibration(stats: dict):
+    """Overlay calibrated question difficulty (calibration.py) on the question bank."""
+    if stats:
+        deps.use_question_bank(calibration.apply(deps.question_bank, stats))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # build providers, load questions and ping Mongo before taking traffic
+    # the worker count as gunicorn.conf.py and uvicorn's --workers default
+    # see it; an explicit `uvicorn --workers N` isn't visible here (README)
+    workers = int(os.environ.get("WEB_CONCURRENCY") or "1")
+    multiplayer.check_workers(workers)
+    await deps.warm()
+    if workers > 1 and deps.cache.name == "memory":
+        logger.warning("Running multiple workers with CACHE_BACKEND=memory; caches and the Spotify token are per-worker")
+    timer_engine.start()
+    if tracing.exporter is not None:
+        tracing.exporter.start()
+    if answer_events is not None:
+        if isinstance(answer_events, events.CollectionSink):
+            await events.ensure_indexes(deps.db)
+        answer_events.start()
+    if stat_counters is not None:
+        await stat_counters.start()
+    try:
+        await apply_calibration(await calibration.load_stats(deps.db))
+    except Exception as e:
+        logger.warning(f"Could not load question calibration: {e}")
+    if TRACK_CATALOG != "off":
+        try:
+            await use_track_catalog(await catalog.Catalog.load(deps.db))
+        except Exception as e:
+            logger.warning(f"Could not load track catalog: {e}")
+    jobs = []
+    try:
+        await tokens.ensure_indexes(deps.db)
+        # the unique guest name index is what makes guest logins race-free
+        await guests.ensure_indexes(deps.db)
+    except Exception as e:
+        logger.warning(f"Could not create user indexes: {e}")
+    jobs.append(asyncio.ensure_future(guests.backfill_keys(deps.db)))
+    if SESSION_REAPER_INTERVAL_MINUTES > 0:
+        await lifecycle.ensure_indexes(deps.db)
+        jobs.append(asyncio.ensure_future(lifecycle.run_periodically(deps.db, SESSION_REAPER_INTERVAL_MINUTES, on_sessions_changed)))
+    if CALIBRATION_INTERVAL_MINUTES > 0:
+        await calibration.ensure_indexes(deps.db)
+        jobs.append(asyncio.ensure_future(calibration.run_periodically(deps.db, CALIBRATION_INTERVAL_MINUTES, apply_calibration)))
+    if CATALOG_CRAWL_INTERVAL_MINUTES > 0:
+        await catalog.ensure_indexes(deps.db)
+        jobs.append(asyncio.ensure_future(catalog.run_periodically(
+            deps.db, fetch_spotify_tracks, catalog_plan(), CATALOG_CRAWL_INTERVAL_MINUTES, lambda: deps.track_catalog)))
+    if AUDIO_ANALYSIS_INTERVAL_MINUTES > 0:
+        jobs.append(asyncio.ensure_future(audio_features.run_periodically(
+            deps.db, load_preview_audio, AUDIO_ANALYSIS_INTERVAL_MINUTES, lambda: deps.track_catalog)))
+    if GUEST_CLEANUP_INTERVAL_MINUTES > 0:
+        jobs.append(asyncio.ensure_future(guests.run_periodically(deps.db, GUEST_CLEANUP_INTERVAL_MINUTES, guest_directory)))
+    yield
+    for job in jobs:
+        job.cancel()
+    await timer_engine.stop()
+    if tracing.exporter is not None:
+        await tracing.exporter.stop()
+    if answer_events is not None:
+        try:
+            await answer_events.stop()
+        except Exception as e:
+            logger.warning(f"Could not flush {len(answer_events.buffer)} answer events: {e}")
+    if stat_counters is not None:
+        try:
+            await stat_counters.stop()
+        except Exception as e:
+            logger.warning(f"Could not flush user counters, they stay journaled for the next start: {e}")
+    await deps.close()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 api_router = APIRouter(prefix="/api")
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -85,15 +210,21 @@ logger = logging.getLogger(__name__)
 class SpotifyCallbackRequest(BaseModel):
     code: str
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
 class QuizStartRequest(BaseModel):
     mode: str
     mood: Optional[str] = None
-    # for most modes this is the normal difficulty setting (easy/medium/hard)
+    # for most modes this is the normal difficulty setting (easy/medium/hard),
+    # or "adaptive" to pick it from the player's skill ratings
     difficulty: Optional[str] = "medium"
     # number of questions applies to educational and timed modes
     num_questions: Optional[int] = 5
-    # educational quiz level selection: easy / moderate / difficult / hybrid
+    # educational quiz level selection: easy / moderate / difficult / hybrid / adaptive
     edu_level: Optional[str] = None
+    # "time" adds a bonus for answering quickly in timed mode
+    scoring: Optional[str] = None
 
 class QuizAnswerRequest(BaseModel):
     session_id: str
@@ -108,35 +239,78 @@ class UserProfileUpdate(BaseModel):
 class GuestRequest(BaseModel):
     name: str
 
+class RoomCreateRequest(BaseModel):
+    mode: str
+    mood: Optional[str] = None
+    difficulty: Optional[str] = "medium"
+    num_questions: Optional[int] = 5
+    edu_level: Optional[str] = None
+    # seconds each question stays open for answers
+    time_per_question: Optional[int] = 20
+
+class RoomAnswerRequest(BaseModel):
+    question_index: int
+    answer: str
+    used_hint: Optional[bool] = False
+
 # --- Auth Helpers ---
-def create_jwt_token(user_id: str, spotify_token: str) -> str:
-    payload = {
-        "user_id": user_id,
-        "spotify_token": spotify_token,
-        "exp": datetime.now(timezone.utc) + timedelta(hours=24),
-        "iat": datetime.now(timezone.utc)
-    }
-    return pyjwt.encode(payload, JWT_SECRET, algorithm="HS256")
+# access tokens carry the claims most endpoints need; see tokens.py
+token_service = tokens.TokenService(JWT_SECRET, JWT_KEYS, JWT_LEGACY_TOKENS_UNTIL)
+
+async def issue_tokens(user: dict, spotify: Optional[dict] = None) -> dict:
+    """A new auth session: access token, refresh token and the access token's lifetime."""
+    sid, refresh_token = await tokens.create_session(deps.db_for("critical"), user["id"], spotify)
+    return {"token": token_service.issue(user, sid), "refresh_token": refresh_token,
+            "expires_in": round(token_service.access_seconds)}
 
 def decode_jwt_token(token: str) -> dict:
     try:
-        return pyjwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-    except pyjwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token expired")
-    except pyjwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+        return token_service.verify(token)
+    except tokens.TokenError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+
+def user_id_from_headers(headers: dict) -> Optional[str]:
+    """User id from a Bearer token without raising; used by the response cache."""
+    auth_header = headers.get("authorization", "")
+    if not auth_header.startswith("Bearer "):
+        return None
+    try:
+        return token_service.verify(auth_header[7:])["id"]
+    except tokens.TokenError:
+        return None
 
-async def get_current_user(request: Request):
+def bearer_token(request: Request) -> str:
     auth_header = request.headers.get("Authorization")
     if not auth_header or not auth_header.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Missing auth token")
-    token = auth_header.split(" ")[1]
-    payload = decode_jwt_token(token)
-    user = await db.users.find_one({"id": payload["user_id"]}, {"_id": 0})
+    return auth_header.split(" ")[1]
+
+async def get_current_claims(request: Request) -> dict:
+    """The caller as the access token describes them ("id", "display_name",
+    "guest", "sid"), without reading the database."""
+    # async so FastAPI runs it inline instead of in the threadpool
+    return decode_jwt_token(bearer_token(request))
+
+async def get_current_user(request: Request):
+    """The caller's full user document, for endpoints that return or need it."""
+    return await get_user_from_token(bearer_token(request))
+
+def require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    if request.headers.get("Authorization") != f"Bearer {ADMIN_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+async def get_user_from_token(token: str):
+    claims = decode_jwt_token(token)
+    user = await deps.db.users.find_one({"id": claims["id"]}, USER_PROJECTION)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    user["spotify_token"] = payload.get("spotify_token", "")
-    return user
+    return with_pending_counters(user)
+
+async def load_user_fields(user_id: str, *fields: str) -> dict:
+    """Profile fields the access token doesn't carry, read by the few requests that need them."""
+    return await deps.db.users.find_one({"id": user_id}, {"_id": 0, **{f: 1 for f in fields}}) or {}
 
 # --- Genre & Mood Mappings ---
 GENRE_LIST = ["pop", "rock", "hip hop", "electronic", "jazz", "classical", "r&b", "country", "latin", "indie", "metal", "blues", "folk", "reggae", "soul"]
@@ -157,77 +331,275 @@ MOOD_SEARCH_TERMS = {
     "focus": ["study music", "classical focus", "ambient work", "concentration"]
 }
 
+# "similarity" is the share of wrong options drawn from related genres /
+# same-genre artists (see distractors.py); "popularity_bias" weights
+# catalog tracks toward popular (> 0) or obscure (< 0) ones (see catalog.py)
 DIFFICULTY_SETTINGS = {
-    "easy": {"options": 3, "points": 10},
-    "medium": {"options": 4, "points": 20},
-    "hard": {"options": 5, "points": 30}
+    "easy": {"options": 3, "points": 10, "similarity": 0.25, "popularity_bias": 1.0},
+    "medium": {"options": 4, "points": 20, "similarity": 0.5, "popularity_bias": 0.0},
+    "hard": {"options": 5, "points": 30, "similarity": 0.9, "popularity_bias": -1.0}
 }
 
+# search queries per genre for the genre quiz (and the catalog crawl)
+GENRE_QUERIES = [
+    ("pop", ["top pop hits 2024", "pop classics"]),
+    ("rock", ["rock anthems", "classic rock hits"]),
+    ("hip hop", ["hip hop hits", "rap classics"]),
+    ("electronic", ["edm hits", "electronic dance"]),
+    ("jazz", ["jazz standards", "smooth jazz"]),
+    ("classical", ["famous classical pieces", "classical music popular"]),
+    ("r&b", ["r&b hits", "soul r&b"]),
+    ("country", ["country hits", "country music top"]),
+    ("latin", ["latin hits reggaeton", "latin pop"]),
+    ("indie", ["indie rock hits", "alternative indie"]),
+    ("metal", ["heavy metal hits", "metal rock"]),
+    ("blues", ["blues music classic", "blues guitar"]),
+]
+
+# artists used by the artist quiz, with the genre used to pick similar distractors
+ARTIST_QUIZ_SEEDS = {
+    "Taylor Swift": "pop", "Drake": "hip hop", "The Weeknd": "r&b", "Billie Eilish": "pop",
+    "Ed Sheeran": "pop", "Dua Lipa": "pop", "Post Malone": "hip hop", "Ariana Grande": "pop",
+    "Kendrick Lamar": "hip hop", "Bruno Mars": "pop", "Adele": "pop", "Coldplay": "rock",
+    "Eminem": "hip hop", "Rihanna": "r&b", "Justin Bieber": "pop", "Lady Gaga": "pop",
+    "Beyonce": "r&b", "Travis Scott": "hip hop", "Bad Bunny": "latin", "Harry Styles": "pop"
+}
+
+distractor_engine = distractors.DistractorEngine(GENRE_LIST, seed_artists=ARTIST_QUIZ_SEEDS)
+
+@asynccontextmanager
+async def provider_call(provider: str, operation: str):
+    """Trace span plus latency metric around one outbound provider call."""
+    with tracing.span(f"{provider}.{operation}", provider=provider):
+        async with metrics.provider_call(provider, operation):
+            yield
+
+# --- Shared cache helpers ---
+# provider results are cached in the shared tier (cache.py) so every worker
+# benefits from a lookup any of them made; a cache outage only costs a miss
+SEARCH_CACHE_TTL_SECONDS = float(os.environ.get('SEARCH_CACHE_TTL_SECONDS', '3600'))
+# Deezer preview URLs are signed and expire, so keep these short-lived
+PREVIEW_CACHE_TTL_SECONDS = float(os.environ.get('PREVIEW_CACHE_TTL_SECONDS', '900'))
+# "Deezer has no preview for this track" is stable, so it's remembered much longer
+PREVIEW_MISS_TTL_SECONDS = float(os.environ.get('PREVIEW_MISS_TTL_SECONDS', '86400'))
+# cached in place of a URL for a known miss
+NO_PREVIEW = ""
+
+async def cache_get(key: str):
+    try:
+        return await deps.cache.get(key)
+    except Exception as e:
+        logger.warning(f"Cache read failed for {key}: {e}")
+        return None
+
+async def cache_set(key: str, value, ttl: Optional[float] = None):
+    try:
+        await deps.cache.set(key, value, ttl)
+    except Exception as e:
+        logger.warning(f"Cache write failed for {key}: {e}")
+
 # --- Deezer Preview Helper ---
 async def get_deezer_preview(track_name: str, artist_name: str) -> Optional[str]:
     """Search Deezer for a matching track and return its 30-sec preview URL."""
+    key = f"preview:{track_name}|{artist_name}"
+    cached = await cache_get(key)
+    if cached is not None:
+        return cached or None
     try:
-        query = f"{track_name} {artist_name}"
-        async with aiohttp.ClientSession() as session:
-            async with session.get("https://api.deezer.com/search", params={"q": query, "limit": 3}, timeout=aiohttp.ClientTimeout(total=5)) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    for item in data.get("data", []):
-                        preview = item.get("preview")
-                        if preview:
-                            return preview
+        async with provider_call("deezer", "find_preview"):
+            preview = await deps.preview_provider.find_preview(track_name, artist_name)
+        if preview:
+            await cache_set(key, preview, PREVIEW_CACHE_TTL_SECONDS)
+        else:
+            await cache_set(key, NO_PREVIEW, PREVIEW_MISS_TTL_SECONDS)
+        return preview
     except Exception as e:
         logger.warning(f"Deezer preview lookup failed for {track_name}: {e}")
     return None
 
+async def search_tracks(query: str, limit: int) -> list:
+    """Spotify track search, cached across workers."""
+    key = f"search:{limit}:{query}"
+    items = await cache_get(key)
+    if items is None:
+        async with provider_call("spotify", "search_tracks"):
+            items = await deps.music_provider.search_tracks(query, limit)
+        await cache_set(key, items, SEARCH_CACHE_TTL_SECONDS)
+    return items
+
 # --- Spotify Track Fetching ---
-async def fetch_spotify_tracks(search_queries: list, limit_per_query: int = 10) -> list:
-    """Fetch tracks from Spotify and enrich with Deezer previews."""
+# bound concurrent Deezer lookups so one quiz start can't trip its rate limit
+DEEZER_CONCURRENCY = int(os.environ.get('DEEZER_CONCURRENCY', '8'))
+deezer_semaphore = asyncio.Semaphore(DEEZER_CONCURRENCY)
+
+async def fetch_spotify_tracks(search_queries: list, limit_per_query: int = 10, enrich: bool = True) -> list:
+    """Fetch tracks from Spotify and enrich with Deezer previews.
+
+    Quiz building passes `enrich=False` and looks up previews only for the
+    tracks it selects (see `select_tracks_with_previews`).
+    """
     all_tracks = []
     seen_ids = set()
 
-    for query in search_queries:
+    with metrics.stage("track_fetch"):
+        for query in search_queries:
+            try:
+                items = await search_tracks(query, limit_per_query)
+                for track in items:
+                    if track["id"] in seen_ids:
+                        continue
+                    seen_ids.add(track["id"])
+
+                    artist_name = ", ".join([a["name"] for a in track["artists"]])
+                    album_art = track["album"]["images"][0]["url"] if track["album"]["images"] else None
+
+                    all_tracks.append({
+                        "id": track["id"],
+                        "name": track["name"],
+                        "artist": artist_name,
+                        "artists": [a["name"] for a in track["artists"]],
+                        "album": track["album"]["name"],
+                        "album_art": album_art,
+                        "preview_url": None,
+                        "spotify_url": track["external_urls"].get("spotify", ""),
+                        "popularity": track["popularity"]
+                    })
+            except Exception as e:
+                logger.error(f"Spotify search error for '{query}': {e}")
+
+    if enrich:
+        await enrich_previews(all_tracks)
+    return all_tracks
+
+async def enrich_previews(tracks: list):
+    """Fill in Deezer preview URLs concurrently."""
+    async def enrich(track):
+        async with deezer_semaphore:
+            track["preview_url"] = await get_deezer_preview(track["name"], track["artists"][0])
+
+    with metrics.stage("preview_enrichment"):
+        await asyncio.gather(*(enrich(t) for t in tracks))
+
+# rounds of replacing selected tracks that turned out to have no preview
+PREVIEW_REPLACE_ROUNDS = int(os.environ.get('PREVIEW_REPLACE_ROUNDS', '2'))
+# candidates fetched beyond what a quiz uses, to replace tracks without previews
+TRACK_OVERFLOW = int(os.environ.get('TRACK_OVERFLOW', '10'))
+
+async def select_tracks_with_previews(selected: list, overflow: list) -> list:
+    """Look up previews for `selected` only, swapping tracks without one for overflow tracks.
+
+    Catalog tracks known to have a preview are tried first. If the overflow
+    runs out (or after PREVIEW_REPLACE_ROUNDS), tracks without audio fill
+    the remaining slots so the quiz keeps its length.
+    """
+    # stable sort: known previews first, then unknown (live), then known misses
+    overflow = sorted(overflow, key=lambda t: {True: 0, None: 1, False: 2}[t.get("has_preview")])
+    wanted = len(selected)
+    chosen, silent = [], []
+    pending = list(selected)
+    for round_ in range(PREVIEW_REPLACE_ROUNDS + 1):
+        await enrich_previews(pending)
+        for t in pending:
+            (chosen if t.get("preview_url") else silent).append(t)
+        need = wanted - len(chosen)
+        if not need or not overflow or round_ == PREVIEW_REPLACE_ROUNDS:
+            break
+        pending, overflow = overflow[:need], overflow[need:]
+    return chosen + silent[:wanted - len(chosen)]
+
+# --- Preview Proxy ---
+# PREVIEW_PROXY=on serves previews from /api/preview/{track_id} through a
+# disk cache (see preview_proxy.py) instead of linking Deezer directly
+PREVIEW_TRACK_TTL_SECONDS = float(os.environ.get('PREVIEW_TRACK_TTL_SECONDS', str(7 * 86400)))
+
+async def resolve_preview_url(track_id: str, refresh: bool = False) -> Optional[str]:
+    """Upstream preview URL for a track handed out by the proxy."""
+    track = deps.track_catalog.tracks.get(track_id) or await cache_get(f"track:{track_id}")
+    if not track:
+        return None
+    name, artist = track["name"], track["artists"][0]
+    if refresh:
         try:
-            results = sp_client.search(q=query, type="track", limit=limit_per_query, market="US")
-            for track in results["tracks"]["items"]:
-                if track["id"] in seen_ids:
-                    continue
-                seen_ids.add(track["id"])
-
-                artist_name = ", ".join([a["name"] for a in track["artists"]])
-                album_art = track["album"]["images"][0]["url"] if track["album"]["images"] else None
-
-                # Get Deezer preview
-                preview_url = await get_deezer_preview(track["name"], track["artists"][0]["name"])
-
-                all_tracks.append({
-                    "id": track["id"],
-                    "name": track["name"],
-                    "artist": artist_name,
-                    "artists": [a["name"] for a in track["artists"]],
-                    "album": track["album"]["name"],
-                    "album_art": album_art,
-                    "preview_url": preview_url,
-                    "spotify_url": track["external_urls"].get("spotify", ""),
-                    "popularity": track["popularity"]
-                })
+            await deps.cache.delete(f"preview:{name}|{artist}")
         except Exception as e:
-            logger.error(f"Spotify search error for '{query}': {e}")
+            logger.warning(f"Cache delete failed for preview of {track_id}: {e}")
+    return await get_deezer_preview(name, artist)
 
-    return all_tracks
-
-def get_educational_questions(limit: int = 5, level: str = "hybrid") -> list:
+async def proxy_previews(tracks: list):
+    """Point preview URLs at the proxy, remembering how to look each track up again."""
+    for t in tracks:
+        if t.get("preview_url"):
+            await cache_set(f"track:{t['id']}", {"name": t["name"], "artists": t["artists"][:1]}, PREVIEW_TRACK_TTL_SECONDS)
+            t["preview_url"] = f"{preview_proxy.PREVIEW_PROXY_BASE_URL}/api/preview/{t['id']}"
+
+preview_service = preview_proxy.PreviewProxy(
+    preview_proxy.PreviewStore(), resolve_preview_url, lambda url: deps.preview_provider.fetch_audio(url)
+) if preview_proxy.PREVIEW_PROXY else None
+
+# --- Preview audio analysis ---
+# waveform, loudness gain and hook offset for catalog previews (audio_features.py)
+AUDIO_ANALYSIS_INTERVAL_MINUTES = float(os.environ.get("AUDIO_ANALYSIS_INTERVAL_MINUTES", "0"))
+
+async def load_preview_audio(track: dict) -> Optional[bytes]:
+    """A catalog track's preview audio, from the proxy cache when it's enabled."""
+    track_id = track["_id"]
+    if preview_service is not None:
+        path, _ = await preview_service.get(track_id)
+        return await asyncio.to_thread(path.read_bytes) if path else None
+    url = await resolve_preview_url(track_id)
+    if not url:
+        return None
+    try:
+        return await deps.preview_provider.fetch_audio(url)
+    except providers.PreviewExpiredError:
+        url = await resolve_preview_url(track_id, refresh=True)
+        return await deps.preview_provider.fetch_audio(url) if url else None
+
+# --- Track Catalog ---
+# auto: sample from the crawled catalog (catalog.py) when it has enough
+# tracks for the request, search live otherwise; off: always search live
+TRACK_CATALOG = os.environ.get("TRACK_CATALOG", "auto").lower()
+CATALOG_CRAWL_INTERVAL_MINUTES = float(os.environ.get("CATALOG_CRAWL_INTERVAL_MINUTES", "0"))
+
+def catalog_plan() -> list:
+    """Every query the track quizzes search, with the labels it implies."""
+    plan = []
+    for genre, queries in GENRE_QUERIES:
+        plan.extend((q, {"genres": [genre]}) for q in queries)
+    plan.extend((artist, {"seed_artists": [artist]}) for artist in ARTIST_QUIZ_SEEDS)
+    for mood, queries in MOOD_SEARCH_TERMS.items():
+        plan.extend((q, {"moods": [mood]}) for q in queries)
+    return plan
+
+async def use_track_catalog(track_catalog: catalog.Catalog):
+    deps.use_track_catalog(track_catalog)
+    logger.info(f"Track catalog loaded: {len(track_catalog)} tracks")
+
+def catalog_usable(field: str, labels: list, per_label: int) -> bool:
+    if TRACK_CATALOG == "off":
+        return False
+    return all(deps.track_catalog.count(field, label) >= per_label for label in labels)
+
+question_index = adaptive.QuestionIndex()
+
+def get_educational_questions(limit: int = 5, level: str = "hybrid", skill: Optional[dict] = None) -> list:
     """Return a random slice of educational quiz questions.
     Questions are defined in backend/quiz_data.py and already contain
     'question', 'choices', 'answer' and (new) 'level' fields.
 
     The `level` argument allows the caller to restrict questions to a
     particular difficulty (easy/moderate/difficult) or request a
-    'hybrid' mix (default).
+    'hybrid' mix (default). With a `skill` map (adaptive quizzes) the
+    questions are the ones nearest the player's target difficulty instead.
     """
-    all_qs = quiz_data.questions
+    all_qs = deps.question_bank
     if not all_qs:
         return []
+    if skill is not None:
+        specific = level in ("easy", "moderate", "difficult")
+        rating = adaptive.rating_of(skill, f"edu:{level}" if specific else "overall")[0]
+        target = adaptive.target_difficulty(rating, options=4)
+        return question_index.sample(all_qs, target, limit, level if specific else None)
     if level in ("easy", "moderate", "difficult"):
         filtered = [q for q in all_qs if q.get("level") == level]
     else:
@@ -238,29 +610,23 @@ def get_educational_questions(limit: int = 5, level: str = "hybrid") -> list:
     return random.sample(filtered, min(limit, len(filtered)))
 
 
-async def get_tracks_for_genre_quiz(limit: int = 10) -> list:
+async def get_tracks_for_genre_quiz(limit: int = 10, popularity_bias: float = 0.0) -> list:
     """Get diverse tracks across genres for genre guessing."""
-    genre_queries = [
-        ("pop", ["top pop hits 2024", "pop classics"]),
-        ("rock", ["rock anthems", "classic rock hits"]),
-        ("hip hop", ["hip hop hits", "rap classics"]),
-        ("electronic", ["edm hits", "electronic dance"]),
-        ("jazz", ["jazz standards", "smooth jazz"]),
-        ("classical", ["famous classical pieces", "classical music popular"]),
-        ("r&b", ["r&b hits", "soul r&b"]),
-        ("country", ["country hits", "country music top"]),
-        ("latin", ["latin hits reggaeton", "latin pop"]),
-        ("indie", ["indie rock hits", "alternative indie"]),
-        ("metal", ["heavy metal hits", "metal rock"]),
-        ("blues", ["blues music classic", "blues guitar"]),
-    ]
-
     all_tracks = []
-    selected_genres = random.sample(genre_queries, min(6, len(genre_queries)))
+    selected_genres = random.sample(GENRE_QUERIES, min(6, len(GENRE_QUERIES)))
+
+    if catalog_usable("genres", [g for g, _ in selected_genres], 6):
+        for genre_name, _ in selected_genres:
+            tracks = deps.track_catalog.sample("genres", genre_name, 6, popularity_bias)
+            for t in tracks:
+                t["genre"] = genre_name
+            all_tracks.extend(tracks)
+        random.shuffle(all_tracks)
+        return all_tracks[:limit]
 
     for genre_name, queries in selected_genres:
         query = random.choice(queries)
-        tracks = await fetch_spotify_tracks([query], limit_per_query=6)
+        tracks = await fetch_spotify_tracks([query], limit_per_query=6, enrich=False)
         for t in tracks:
             t["genre"] = genre_name
         all_tracks.extend(tracks)
@@ -268,27 +634,33 @@ async def get_tracks_for_genre_quiz(limit: int = 10) -> list:
     random.shuffle(all_tracks)
     return all_tracks[:limit]
 
-async def get_tracks_for_artist_quiz(limit: int = 10) -> list:
+async def get_tracks_for_artist_quiz(limit: int = 10, popularity_bias: float = 0.0) -> list:
     """Get tracks from well-known artists for artist guessing."""
-    artist_queries = [
-        "Taylor Swift", "Drake", "The Weeknd", "Billie Eilish",
-        "Ed Sheeran", "Dua Lipa", "Post Malone", "Ariana Grande",
-        "Kendrick Lamar", "Bruno Mars", "Adele", "Coldplay",
-        "Eminem", "Rihanna", "Justin Bieber", "Lady Gaga",
-        "Beyonce", "Travis Scott", "Bad Bunny", "Harry Styles"
-    ]
+    artist_queries = list(ARTIST_QUIZ_SEEDS)
     selected = random.sample(artist_queries, min(8, len(artist_queries)))
-    tracks = await fetch_spotify_tracks(selected, limit_per_query=3)
+    if catalog_usable("seed_artists", selected, 3):
+        tracks = []
+        seen_ids = set()
+        for artist in selected:
+            for t in deps.track_catalog.sample("seed_artists", artist, 3, popularity_bias):
+                if t["id"] not in seen_ids:
+                    seen_ids.add(t["id"])
+                    tracks.append(t)
+    else:
+        tracks = await fetch_spotify_tracks(selected, limit_per_query=3, enrich=False)
     random.shuffle(tracks)
 
     for t in tracks:
         t["genre"] = "mixed"
     return tracks[:limit]
 
-async def get_tracks_for_mood(mood: str, limit: int = 10) -> list:
+async def get_tracks_for_mood(mood: str, limit: int = 10, popularity_bias: float = 0.0) -> list:
     """Get mood-appropriate tracks."""
     queries = MOOD_SEARCH_TERMS.get(mood, ["popular music"])
-    tracks = await fetch_spotify_tracks(queries, limit_per_query=8)
+    if catalog_usable("moods", [mood], limit):
+        tracks = deps.track_catalog.sample("moods", mood, limit, popularity_bias)
+    else:
+        tracks = await fetch_spotify_tracks(queries, limit_per_query=8, enrich=False)
     genres = MOOD_GENRE_MAP.get(mood, ["pop"])
     for t in tracks:
         t["genre"] = random.choice(genres)
@@ -298,12 +670,7 @@ async def get_tracks_for_mood(mood: str, limit: int = 10) -> list:
 # --- Gemini LLM Helpers ---
 async def generate_quiz_content(track: dict, mode: str, options: list):
     """Use Gemini to generate quiz question, hint, and fun fact."""
-    session_id = f"quiz-{uuid.uuid4().hex[:8]}"
-    genai.configure(api_key=LLM_API_KEY)
-    model = genai.GenerativeModel(
-        model_name="gemini-2.0-flash",
-        system_instruction="You are a music quiz master. Generate engaging quiz content. Respond ONLY in valid JSON, no markdown."
-    )
+    system_instruction = "You are a music quiz master. Generate engaging quiz content. Respond ONLY in valid JSON, no markdown."
 
     if mode == "genre":
         prompt = f"""Generate a genre quiz question for "{track['name']}" by {track['artist']}.
@@ -318,9 +685,9 @@ Return JSON: {{"question": "an engaging question about who performs this song",
 Return JSON: {{"question": "a fun trivia question about this track or genre", "hint": "a helpful hint", "fun_fact": "a fascinating music fact"}}"""
 
     try:
-        response = await model.generate_content_async(prompt)
-        import json
-        cleaned = response.text.strip()
+        async with provider_call("gemini", "quiz_content"):
+            text = await deps.llm_provider.generate(system_instruction, prompt, json_output=True)
+        cleaned = text.strip()
         if cleaned.startswith("```"):
             lines = cleaned.split("\n")
             cleaned = "\n".join(lines[1:])
@@ -337,11 +704,7 @@ Return JSON: {{"question": "a fun trivia question about this track or genre", "h
         return {"question": f"Music trivia: What do you know about \"{track['name']}\"?", "hint": "Listen to the musical elements.", "fun_fact": "Music brings people together!"}
 
 async def generate_answer_response(track: dict, correct: bool, user_answer: str, correct_answer: str):
-    genai.configure(api_key=LLM_API_KEY)
-    model = genai.GenerativeModel(
-        model_name="gemini-2.0-flash",
-        system_instruction="You are a fun, encouraging music quiz host. Keep responses to 2 sentences max. Be enthusiastic but concise."
-    )
+    system_instruction = "You are a fun, encouraging music quiz host. Keep responses to 2 sentences max. Be enthusiastic but concise."
 
     if correct:
         prompt = f"The user correctly answered '{correct_answer}' for \"{track['name']}\" by {track['artist']}. Give a brief congrats and one music fact. 2 sentences max."
@@ -349,8 +712,9 @@ async def generate_answer_response(track: dict, correct: bool, user_answer: str,
         prompt = f"The user guessed '{user_answer}' but the answer was '{correct_answer}' for \"{track['name']}\" by {track['artist']}. Encourage them briefly. 2 sentences max."
 
     try:
-        response = await model.generate_content_async(prompt)
-        return response.text.strip()
+        async with provider_call("gemini", "answer_response"):
+            text = await deps.llm_provider.generate(system_instruction, prompt)
+        return text.strip()
     except Exception as e:
         logger.error(f"Gemini answer response error: {e}")
         if correct:
@@ -360,54 +724,30 @@ async def generate_answer_response(track: dict, correct: bool, user_answer: str,
 # --- Auth Routes ---
 @api_router.get("/auth/spotify-login")
 async def spotify_login():
-    auth_url = sp_oauth.get_authorize_url()
+    auth_url = deps.sp_oauth.get_authorize_url()
     return {"auth_url": auth_url}
 
 @api_router.post("/auth/guest")
 async def guest_login(req: GuestRequest):
     """Create or return a guest user record and issue a JWT.
 
-    Guests are identified by display name and marked with a `guest` flag
-    in the database. This allows anonymous play without Spotify
-    authentication while still populating the leaderboard.
+    Guests are identified by display name (compared case- and
+    whitespace-insensitively) and marked with a `guest` flag in the
+    database. This allows anonymous play without Spotify authentication
+    while still populating the leaderboard.
     """
     name = req.name.strip() or "Guest"
-    # look for existing guest with same display name
-    existing = await db.users.find_one({"display_name": name, "guest": True}, {"_id": 0})
-    if existing:
-        user = existing
-        user_id = user["id"]
-    else:
-        user_id = f"guest-{uuid.uuid4().hex[:8]}"
-        user = {
-            "id": user_id,
-            "display_name": name,
-            "email": "",
-            "avatar": None,
-            "favorite_genres": [],
-            "total_score": 0,
-            "total_games": 0,
-            "total_correct": 0,
-            "total_questions": 0,
-            "genre_accuracy": {},
-            "difficulty_level": "medium",
-            "streak": 0,
-            "best_streak": 0,
-            "guest": True,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "last_login": datetime.now(timezone.utc).isoformat()
-        }
-        await db.users.insert_one(user)
-    token = create_jwt_token(user_id, "")
-    return {"token": token, "user": user}
+    # one atomic upsert on the normalized name (see guests.py)
+    user = with_pending_counters(await guest_directory.login(name))
+    return {**await issue_tokens(user), "user": user}
 
 @api_router.post("/auth/spotify-callback")
 async def spotify_callback(req: SpotifyCallbackRequest):
     try:
-        #token_info = sp_oauth.get_access_token(req.code, as_dict=True)
-        token_info = sp_oauth.get_access_token(req.code)
+        #token_info = deps.sp_oauth.get_access_token(req.code, as_dict=True)
+        token_info = deps.sp_oauth.get_access_token(req.code)
         access_token = token_info["access_token"]
-        sp_user = spotipy.Spotify(auth=access_token)
+        sp_user = deps.user_client(access_token)
         profile = sp_user.me()
         #sp_user = spotipy.Spotify(auth=token_info["access_token"])
         #profile = sp_user.me()
@@ -417,14 +757,15 @@ async def spotify_callback(req: SpotifyCallbackRequest):
         email = profile.get("email", "")
         avatar = profile["images"][0]["url"] if profile.get("images") else None
 
-        existing_user = await db.users.find_one({"id": user_id}, {"_id": 0})
+        existing_user = await deps.db.users.find_one({"id": user_id}, {"_id": 0})
         if existing_user:
-            await db.users.update_one(
+            await deps.db_for("critical").users.update_one(
                 {"id": user_id},
                 {"$set": {"display_name": display_name, "email": email, "avatar": avatar, "last_login": datetime.now(timezone.utc).isoformat()}}
             )
+            await response_cache.bump(deps.cache, f"user:{user_id}", "leaderboard")
         else:
-            await db.users.insert_one({
+            await deps.db_for("critical").users.insert_one({
                 "id": user_id,
                 "display_name": display_name,
                 "email": email,
@@ -442,52 +783,84 @@ async def spotify_callback(req: SpotifyCallbackRequest):
                 "last_login": datetime.now(timezone.utc).isoformat()
             })
 
-        jwt_token = create_jwt_token(user_id, token_info["access_token"])
-        return {"token": jwt_token, "user": {"id": user_id, "display_name": display_name, "email": email, "avatar": avatar}}
+        user = {"id": user_id, "display_name": display_name, "email": email, "avatar": avatar}
+        # the Spotify token stays server-side with the auth session
+        spotify = {k: token_info.get(k) for k in ("access_token", "refresh_token", "expires_at")}
+        return {**await issue_tokens(user, spotify), "user": user}
     except Exception as e:
         logger.error(f"Spotify callback error: {e}")
         raise HTTPException(status_code=400, detail=f"Authentication failed: {str(e)}")
 
+@api_router.post("/auth/refresh")
+async def refresh_tokens(req: RefreshRequest):
+    """Exchange a refresh token for a new access token (and a rotated refresh token)."""
+    try:
+        session, refresh_token = await tokens.rotate(deps.db_for("critical"), req.refresh_token)
+    except tokens.TokenError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    user = await deps.db.users.find_one({"id": session["user_id"]}, USER_PROJECTION)
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    body = {"token": token_service.issue(user, session["_id"]), "expires_in": round(token_service.access_seconds)}
+    if refresh_token:
+        body["refresh_token"] = refresh_token
+    return body
+
+@api_router.post("/auth/logout")
+async def logout(req: RefreshRequest, request: Request):
+    """End the auth session; its access tokens still work until they expire."""
+    try:
+        await tokens.revoke(deps.db_for("critical"), req.refresh_token)
+    except tokens.TokenError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    auth_header = request.headers.get("Authorization", "")
+    if auth_header.startswith("Bearer "):
+        token_service.forget(auth_header[7:])
+    return {"status": "ok"}
+
 @api_router.get("/auth/me")
 async def get_me(user=Depends(get_current_user)):
-    return {k: v for k, v in user.items() if k != "spotify_token"}
+    return user
 
-# --- Quiz Routes ---
-@api_router.post("/quiz/start")
-async def start_quiz(req: QuizStartRequest, user=Depends(get_current_user)):
-    # normalize mode to lowercase for comparisons
-    mode = req.mode.lower() if req.mode else ""
-    difficulty = req.difficulty or user.get("difficulty_level", "medium")
-    settings = DIFFICULTY_SETTINGS.get(difficulty, DIFFICULTY_SETTINGS["medium"])
+# --- Quiz Building ---
+EDUCATIONAL_MODES = ("educational", "educationalquiz", "education")
 
-    # determine educational level selection (if any)
-    edu_level = (req.edu_level or "hybrid").lower()
-    if edu_level not in ("easy", "moderate", "difficult", "hybrid"):
-        edu_level = "hybrid"
+def is_educational(mode: str) -> bool:
+    return mode in EDUCATIONAL_MODES
 
-    logger.info(f"Starting quiz: mode={mode}, mood={req.mood}, difficulty={difficulty}, edu_level={edu_level}")
+async def build_quiz_questions(mode: str, mood: Optional[str], settings: dict, edu_level: str, num_questions: Optional[int],
+                               skill: Optional[dict] = None) -> list:
+    """Fetch tracks (or educational questions) and build the full question set.
 
+    The returned questions still carry `correct_answer`; use
+    `build_safe_questions` before sending them to a client. Shared by
+    single-player sessions and multiplayer rooms so both get the same
+    question pipeline. Passing the player's `skill` map selects
+    questions adaptively (see adaptive.py).
+    """
     # Fetch tracks or questions based on mode
     questions = []
     tracks = []
-    if mode in ("educational", "educationalquiz", "education"):
+    # catalog sampling leans popular for easy quizzes, obscure for hard ones
+    bias = settings.get("popularity_bias", 0.0)
+    if is_educational(mode):
         # grab a random batch from static quiz dataset with requested num_questions
-        requested_num = req.num_questions or 5
-        questions = get_educational_questions(limit=requested_num, level=edu_level)
-    elif mode == "mood" and req.mood:
-        tracks = await get_tracks_for_mood(req.mood)
+        requested_num = num_questions or 5
+        questions = get_educational_questions(limit=requested_num, level=edu_level, skill=skill)
+    elif mode == "mood" and mood:
+        tracks = await get_tracks_for_mood(mood, limit=10 + TRACK_OVERFLOW, popularity_bias=bias)
     elif mode == "artist":
-        tracks = await get_tracks_for_artist_quiz()
+        tracks = await get_tracks_for_artist_quiz(limit=10 + TRACK_OVERFLOW, popularity_bias=bias)
     elif mode == "genre":
-        tracks = await get_tracks_for_genre_quiz()
+        tracks = await get_tracks_for_genre_quiz(limit=10 + TRACK_OVERFLOW, popularity_bias=bias)
     elif mode == "timed":
-        tracks = await get_tracks_for_genre_quiz(limit=15)
+        tracks = await get_tracks_for_genre_quiz(limit=15 + TRACK_OVERFLOW, popularity_bias=bias)
     else:
-        tracks = await get_tracks_for_genre_quiz()
+        tracks = await get_tracks_for_genre_quiz(limit=10 + TRACK_OVERFLOW, popularity_bias=bias)
 
     # if we're in educational mode we already have questions,
     # otherwise fall back to the track-based logic below.
-    if mode in ("educational", "educationalquiz", "education"):
+    if is_educational(mode):
         if not questions:
             raise HTTPException(status_code=400, detail="No educational questions available.")
         # questions list already contains the dicts from quiz_data
@@ -500,107 +873,89 @@ async def start_quiz(req: QuizStartRequest, user=Depends(get_current_user)):
                 "topic": q.get("topic"),
                 "mode": mode,
                 # keep the level so that scoring logic knows which value to use
-                "level": q.get("level", "easy")
+                "level": q.get("level", "easy"),
+                "question_id": q.get("id"),
+                "rating": adaptive.question_rating(q)
             })
-    else:
-        logger.info(f"Fetched {len(tracks)} tracks, {sum(1 for t in tracks if t.get('preview_url'))} with audio previews")
+        return session_questions
 
-        if len(tracks) < 4:
-            raise HTTPException(status_code=400, detail="Not enough tracks found. Please try again.")
+    if len(tracks) < 4:
+        raise HTTPException(status_code=400, detail="Not enough tracks found. Please try again.")
 
-        # Build questions for non‑educational modes
-        num_questions = 5 if mode != "timed" else 10
+    # Build questions for non‑educational modes
+    num_questions = 5 if mode != "timed" else 10
+    if skill is not None:
+        selected_tracks = adaptive.pick_tracks(tracks, skill, num_questions, settings["options"])
+    else:
         selected_tracks = random.sample(tracks, min(num_questions, len(tracks)))
-        session_questions = []
-
-        # Prepare data for parallel LLM calls
-        llm_tasks = []
-        track_options = []
-        for track in selected_tracks:
-            if mode == "genre":
-                correct = track["genre"]
-                wrong_pool = [g for g in GENRE_LIST if g.lower() != correct.lower()]
-                wrong = random.sample(wrong_pool, min(settings["options"] - 1, len(wrong_pool)))
-                all_options = [correct] + wrong
-                random.shuffle(all_options)
-            elif mode == "artist":
-                correct = track["artist"]
-                other_artists = list(set([t["artist"] for t in tracks if t["artist"] != correct]))
-                if len(other_artists) < settings["options"] - 1:
-                    other_artists += ["Unknown Artist", "Mystery Singer", "Anonymous Band"]
-                wrong = random.sample(other_artists, min(settings["options"] - 1, len(other_artists)))
-                all_options = [correct] + wrong
-                random.shuffle(all_options)
-            else:
-                correct = track["genre"]
-                wrong_pool = [g for g in GENRE_LIST if g.lower() != correct.lower()]
-                wrong = random.sample(wrong_pool, min(settings["options"] - 1, len(wrong_pool)))
-                all_options = [correct] + wrong
-                random.shuffle(all_options)
-
-            track_options.append((track, all_options, correct))
-            llm_tasks.append(generate_quiz_content(track, mode, wrong))
-
-        # Execute LLM calls in parallel
-        llm_results = await asyncio.gather(*llm_tasks, return_exceptions=True)
-
-        for i, (track, all_options, correct) in enumerate(track_options):
-            llm_data = llm_results[i]
-            if isinstance(llm_data, Exception):
-                logger.error(f"LLM generation failed: {llm_data}")
-                llm_data = {
-                    "question": f"What genre is \"{track['name']}\"?" if mode == "genre" else f"Who sings \"{track['name']}\"?",
-                    "hint": "Think about the musical style!",
-                    "fun_fact": f"This track is by {track['artist']}."
-                }
+    selected_ids = {t["id"] for t in selected_tracks}
+    selected_tracks = await select_tracks_with_previews(selected_tracks, [t for t in tracks if t["id"] not in selected_ids])
+    logger.info(f"Fetched {len(tracks)} tracks, selected {len(selected_tracks)}, "
+                f"{sum(1 for t in selected_tracks if t.get('preview_url'))} with audio previews")
+    if preview_service is not None:
+        await proxy_previews(selected_tracks)
+    session_questions = []
+
+    # Prepare data for parallel LLM calls
+    llm_tasks = []
+    track_options = []
+    # mood-quiz genres are guessed from the mood, so don't learn artist genres from them
+    distractor_engine.observe(tracks, genre_labels=mode != "mood")
+    similarity = settings.get("similarity", 0.5)
+    for track in selected_tracks:
+        if mode == "artist":
+            correct = track["artist"]
+            wrong = distractor_engine.artist_options(track, settings["options"] - 1, similarity)
+        else:
+            correct = track["genre"]
+            wrong = distractor_engine.genre_options(correct, settings["options"] - 1, similarity)
+        all_options = [correct] + wrong
+        random.shuffle(all_options)
 
-            session_questions.append({
-                "track": {
-                    "id": track["id"],
-                    "name": track["name"],
-                    "artist": track["artist"],
-                    "album": track["album"],
-                    "album_art": track["album_art"],
-                    "preview_url": track.get("preview_url"),
-                    "spotify_url": track.get("spotify_url", ""),
-                    "genre": track["genre"]
-                },
-                "question": llm_data.get("question", "Guess!"),
-                "hint": llm_data.get("hint", "Listen carefully!"),
-                "fun_fact": llm_data.get("fun_fact", "Music is amazing!"),
-                "options": all_options,
-                "correct_answer": correct,
-                "mode": mode
-            })
-    # end building questions
+        track_options.append((track, all_options, correct))
+        llm_tasks.append(generate_quiz_content(track, mode, wrong))
 
-    # rename session_questions to questions variable used later
-    questions = session_questions
+    # Execute LLM calls in parallel
+    with metrics.stage("llm_generation"):
+        llm_results = await asyncio.gather(*llm_tasks, return_exceptions=True)
 
-    session_id = str(uuid.uuid4())
-    session = {
-        "id": session_id,
-        "user_id": user["id"],
-        "mode": mode,
-        "mood": req.mood,
-        "difficulty": difficulty,
-        "questions": questions,
-        "answers": [],
-        "score": 0,
-        "total_questions": len(questions),
-        "current_index": 0,
-        # store educational level for scoring later
-        "edu_level": edu_level,
-        "started_at": datetime.now(timezone.utc).isoformat(),
-        "completed": False,
-        "time_limit": 60 if mode == "timed" else None
-    }
-    await db.quiz_sessions.insert_one(session)
+    for i, (track, all_options, correct) in enumerate(track_options):
+        llm_data = llm_results[i]
+        if isinstance(llm_data, Exception):
+            logger.error(f"LLM generation failed: {llm_data}")
+            llm_data = {
+                "question": f"What genre is \"{track['name']}\"?" if mode == "genre" else f"Who sings \"{track['name']}\"?",
+                "hint": "Think about the musical style!",
+                "fun_fact": f"This track is by {track['artist']}."
+            }
+
+        session_questions.append({
+            "track": {
+                "id": track["id"],
+                "name": track["name"],
+                "artist": track["artist"],
+                "album": track["album"],
+                "album_art": track["album_art"],
+                "preview_url": track.get("preview_url"),
+                "spotify_url": track.get("spotify_url", ""),
+                "genre": track["genre"],
+                "audio": track.get("audio")
+            },
+            "question": llm_data.get("question", "Guess!"),
+            "hint": llm_data.get("hint", "Listen carefully!"),
+            "fun_fact": llm_data.get("fun_fact", "Music is amazing!"),
+            "options": all_options,
+            "correct_answer": correct,
+            "mode": mode,
+            "rating": adaptive.track_rating(track, len(all_options))
+        })
+    return session_questions
 
-    # Return session without correct answers
+def build_safe_questions(questions: list, mode: str) -> list:
+    """Strip answers and internal fields from questions before returning them."""
     safe_questions = []
     for q in questions:
-        if mode in ("educational", "educationalquiz", "education"):
+        if is_educational(mode):
             # educational items have no track field
             safe_questions.append({
                 "question": q["question"],
@@ -620,41 +975,221 @@ async def start_quiz(req: QuizStartRequest, user=Depends(get_current_user)):
                     "album_art": q["track"]["album_art"],
                     "preview_url": q["track"].get("preview_url"),
                     "spotify_url": q["track"].get("spotify_url", ""),
+                    # waveform / gain_db / hook_ms for catalog tracks (audio_features.py)
+                    "audio": q["track"].get("audio"),
                 },
                 "question": q["question"],
                 "hint": q["hint"],
                 "options": q["options"],
                 "mode": q["mode"]
             })
-    
+    return safe_questions
 
+def get_points_per_correct(mode: str, edu_level: str, settings: dict) -> Optional[int]:
     # points_per_correct is mostly informational for the frontend; in
     # educational mode the value may vary by level or per-question.
-    points_info = settings["points"]
-    if mode in ("educational", "educationalquiz", "education"):
+    if is_educational(mode):
         if edu_level == "easy":
-            points_info = 10
+            return 10
         elif edu_level == "moderate":
-            points_info = 15
+            return 15
         elif edu_level == "difficult":
-            points_info = 20
-        else:
-            # hybrid or unknown: client should not rely on this value
-            points_info = None
+            return 20
+        # hybrid or unknown: client should not rely on this value
+        return None
+    return settings["points"]
 
-    return {
-        "session_id": session_id,
-        "questions": safe_questions,
-        "total_questions": len(questions),
-        "difficulty": difficulty,
+def score_answer(session: dict, question: dict, is_correct: bool, used_hint: bool, time_remaining: Optional[float] = None) -> int:
+    """Points for one answer, based on the session's mode, difficulty and level.
+
+    Sessions started with `scoring="time"` earn up to double points, scaled
+    by the fraction of the time limit still remaining.
+    """
+    if not is_correct:
+        return 0
+    points = base_points(session, question, used_hint)
+    time_limit = session.get("time_limit")
+    if session.get("scoring") == "time" and time_limit and time_remaining is not None:
+        points += round(points * min(max(time_remaining / time_limit, 0), 1))
+    return points
+
+def base_points(session: dict, question: dict, used_hint: bool) -> int:
+    if is_educational(session.get("mode")):
+        # educational quiz scoring depends on the selected level and the
+        # individual question's level when in hybrid mode.
+        sel = session.get("edu_level", "hybrid")
+        if sel == "easy":
+            points = 10
+        elif sel == "moderate":
+            points = 15
+        elif sel == "difficult":
+            points = 20
+        else:  # hybrid
+            qlevel = question.get("level", "easy")
+            mapping = {"easy": 10, "moderate": 15, "difficult": 20}
+            points = mapping.get(qlevel, 10)
+
+        # Apply hint penalty (50% reduction, rounded up)
+        if used_hint:
+            points = math.ceil(points / 2)
+        return points
+    difficulty = session.get("difficulty", "medium")
+    return DIFFICULTY_SETTINGS.get(difficulty, DIFFICULTY_SETTINGS["medium"])["points"]
+
+# --- Timed Sessions ---
+async def complete_expired_sessions(session_ids: List[str]):
+    """Complete timed sessions whose deadline has passed.
+
+    Each session is completed by its own conditional update, and only the
+    sessions this call completed count as games: one that an answer finished
+    in the meantime was already counted by that answer.
+    """
+    completed_at = datetime.now(timezone.utc).isoformat()
+    results = await asyncio.gather(*(
+        deps.db.quiz_sessions.find_one_and_update(
+            {"id": session_id, "completed": False},
+            {"$set": {"completed": True, "timed_out": True, "completed_at": completed_at}},
+            projection={"_id": 0, "user_id": 1})
+        for session_id in session_ids
+    ))
+    games = Counter(s["user_id"] for s in results if s is not None)
+    if not games:
+        return
+    await record_user_counters({uid: {"total_games": n} for uid, n in games.items()})
+    await response_cache.bump(deps.cache, "leaderboard", *(f"user:{uid}" for uid in games))
+    logger.info(f"Completed {sum(games.values())} expired timed sessions")
+
+timer_engine = timers.SessionTimerEngine(complete_expired_sessions)
+
+def session_time_remaining(session: dict) -> Optional[float]:
+    """Seconds left on a timed session, or None if it has no time limit.
+
+    Sessions tracked by this worker use the monotonic deadline; otherwise
+    (another worker, or a restart) fall back to the stored wall-clock one.
+    """
+    if not session.get("time_limit"):
+        return None
+    remaining = timer_engine.remaining(session["id"])
+    if remaining is not None:
+        return remaining
+    deadline_at = session.get("deadline_at")
+    if deadline_at:
+        deadline = datetime.fromisoformat(deadline_at)
+    else:
+        deadline = datetime.fromisoformat(session["started_at"]) + timedelta(seconds=session["time_limit"])
+    return (deadline - datetime.now(timezone.utc)).total_seconds()
+
+def answer_sets(user_data: dict, question: dict, is_correct: bool, used_hint: Optional[bool]) -> dict:
+    """The streak and skill fields after one answer, as a `$set`.
+
+    Skill ratings are updated for single-player answers, which pass `used_hint`.
+    """
+    user_set = {}
+    if used_hint is not None:
+        user_set.update(adaptive.update(user_data.get("skill"), question, is_correct, used_hint) or {})
+    if is_correct:
+        new_streak = (user_data.get("streak", 0) or 0) + 1
+        user_set["streak"] = new_streak
+        user_set["best_streak"] = max(new_streak, user_data.get("best_streak", 0) or 0)
+    else:
+        user_set["streak"] = 0
+    return user_set
+
+async def record_answer_stats(user_id: str, question: dict, is_correct: bool, points: int, is_last: bool,
+                             used_hint: Optional[bool] = None):
+    """Apply one answer to the user's totals, genre accuracy, streak and skill ratings."""
+    deltas = counters.answer_deltas(question, is_correct, points, is_last)
+    if stat_counters is not None:
+        # buffered with the counters; streak and skill come from the worker's
+        # copy of the user's state, so the answer needs no Mongo round trip
+        state = await stat_counters.load_state(
+            user_id, lambda: load_user_fields(user_id, "streak", "best_streak", "skill"))
+        await stat_counters.record(user_id, deltas, answer_sets(state, question, is_correct, used_hint))
+        # this worker's stats and session responses changed now; the
+        # leaderboard (and other workers' copies) change when the batch is written
+        await response_cache.bump(deps.cache, f"user:{user_id}")
+        return
+
+    await counters.apply(deps.db, {user_id: deltas})
+    user_data = {}
+    if is_correct or used_hint is not None:
+        user_data = await load_user_fields(user_id, "streak", "best_streak", *(("skill",) if used_hint is not None else ()))
+    await deps.db.users.update_one({"id": user_id}, {"$set": answer_sets(user_data, question, is_correct, used_hint)})
+    # stats, profile and session responses changed; so may the leaderboard
+    await response_cache.bump(deps.cache, f"user:{user_id}", "leaderboard")
+
+# --- Quiz Routes ---
+@api_router.post("/quiz/start")
+async def start_quiz(req: QuizStartRequest, user=Depends(get_current_claims)):
+    # normalize mode to lowercase for comparisons
+    mode = req.mode.lower() if req.mode else ""
+    difficulty = req.difficulty or (await load_user_fields(user["id"], "difficulty_level")).get("difficulty_level", "medium")
+
+    # determine educational level selection (if any)
+    edu_level = (req.edu_level or "hybrid").lower()
+    if edu_level not in ("easy", "moderate", "difficult", "hybrid", "adaptive"):
+        edu_level = "hybrid"
+
+    # "adaptive" picks the option count and questions from the player's skill ratings
+    skill = None
+    if difficulty == "adaptive" or edu_level == "adaptive":
+        skill = (await load_user_fields(user["id"], "skill")).get("skill") or {}
+    if difficulty == "adaptive":
+        difficulty = adaptive.choose_difficulty(skill, DIFFICULTY_SETTINGS)
+    settings = DIFFICULTY_SETTINGS.get(difficulty, DIFFICULTY_SETTINGS["medium"])
+
+    logger.info(f"Starting quiz: mode={mode}, mood={req.mood}, difficulty={difficulty}, edu_level={edu_level}")
+
+    with metrics.track_stages():
+        questions = await build_quiz_questions(mode, req.mood, settings, edu_level, req.num_questions, skill)
+        with metrics.stage("session_insert"):
+            session = await create_quiz_session(user, req, mode, difficulty, edu_level, questions)
+        with metrics.stage("response_build"):
+            response = {
+                "session_id": session["id"],
+                "questions": build_safe_questions(questions, mode),
+                "total_questions": len(questions),
+                "difficulty": difficulty,
+                "mode": mode,
+                "time_limit": session["time_limit"],
+                "deadline_at": session.get("deadline_at"),
+                "scoring": session["scoring"],
+                "points_per_correct": get_points_per_correct(mode, edu_level, settings)
+            }
+    return fastjson.json_response(response)
+
+async def create_quiz_session(user: dict, req: QuizStartRequest, mode: str, difficulty: str, edu_level: str, questions: list) -> dict:
+    session_id = str(uuid.uuid4())
+    started_at = datetime.now(timezone.utc)
+    time_limit = 60 if mode == "timed" else None
+    session = {
+        "id": session_id,
+        "user_id": user["id"],
         "mode": mode,
-        "time_limit": session["time_limit"],
-        "points_per_correct": points_info
+        "mood": req.mood,
+        "difficulty": difficulty,
+        "questions": questions,
+        "answers": [],
+        "score": 0,
+        "total_questions": len(questions),
+        "current_index": 0,
+        # store educational level for scoring later
+        "edu_level": edu_level,
+        "started_at": started_at.isoformat(),
+        "completed": False,
+        "time_limit": time_limit,
+        "scoring": "time" if time_limit and req.scoring == "time" else "standard"
     }
+    if time_limit:
+        session["deadline_at"] = (started_at + timedelta(seconds=time_limit)).isoformat()
+    await deps.db.quiz_sessions.insert_one(session)
+    if time_limit:
+        timer_engine.add(session_id, time_limit)
+    return session
 
 @api_router.post("/quiz/answer")
-async def answer_question(req: QuizAnswerRequest, user=Depends(get_current_user)):
-    session = await db.quiz_sessions.find_one({"id": req.session_id, "user_id": user["id"]}, {"_id": 0})
+async def answer_question(req: QuizAnswerRequest, user=Depends(get_current_claims)):
+    session = await deps.db.quiz_sessions.find_one({"id": req.session_id, "user_id": user["id"]}, {"_id": 0})
     if not session:
         raise HTTPException(status_code=404, detail="Quiz session not found")
     if session["completed"]:
@@ -662,37 +1197,17 @@ async def answer_question(req: QuizAnswerRequest, user=Depends(get_current_user)
     if req.question_index >= len(session["questions"]):
         raise HTTPException(status_code=400, detail="Invalid question index")
 
+    time_remaining = session_time_remaining(session)
+    if time_remaining is not None and time_remaining < -timer_engine.grace:
+        timer_engine.discard(session["id"])
+        await complete_expired_sessions([session["id"]])
+        raise HTTPException(status_code=400, detail="Time limit exceeded")
+
     question = session["questions"][req.question_index]
     correct_answer = question["correct_answer"]
     is_correct = req.answer.lower().strip() == correct_answer.lower().strip()
 
-    # calculate points depending on mode/educational settings
-    points = 0
-    if session.get("mode") in ("educational", "educationalquiz", "education"):
-        # educational quiz scoring depends on the selected level and the
-        # individual question's level when in hybrid mode.
-        if is_correct:
-            sel = session.get("edu_level", "hybrid")
-            if sel == "easy":
-                points = 10
-            elif sel == "moderate":
-                points = 15
-            elif sel == "difficult":
-                points = 20
-            else:  # hybrid
-                qlevel = question.get("level", "easy")
-                mapping = {"easy": 10, "moderate": 15, "difficult": 20}
-                points = mapping.get(qlevel, 10)
-            
-            # Apply hint penalty (50% reduction, rounded up)
-            if req.used_hint:
-                import math
-                points = math.ceil(points / 2)
-        else:
-            points = 0
-    else:
-        difficulty = session.get("difficulty", "medium")
-        points = DIFFICULTY_SETTINGS.get(difficulty, DIFFICULTY_SETTINGS["medium"])["points"] if is_correct else 0
+    points = score_answer(session, question, is_correct, req.used_hint, time_remaining)
 
     # educational questions don't have a track object
     if "track" in question:
@@ -701,14 +1216,19 @@ async def answer_question(req: QuizAnswerRequest, user=Depends(get_current_user)
         # simple static response for educational mode
         bot_response = "Great job!" if is_correct else "Better luck next time!"
 
+    answered_at = datetime.now(timezone.utc)
+    # time since the previous answer (or the start) approximates time spent on this question
+    shown_at = session["answers"][-1]["timestamp"] if session["answers"] else session["started_at"]
     answer_record = {
         "question_index": req.question_index,
+        "question_id": question.get("question_id"),
         "user_answer": req.answer,
         "correct_answer": correct_answer,
         "is_correct": is_correct,
         "used_hint": req.used_hint,
         "points": points,
-        "timestamp": datetime.now(timezone.utc).isoformat()
+        "elapsed_ms": round((answered_at - datetime.fromisoformat(shown_at)).total_seconds() * 1000),
+        "timestamp": answered_at.isoformat()
     }
 
     new_score = session["score"] + points
@@ -722,35 +1242,17 @@ async def answer_question(req: QuizAnswerRequest, user=Depends(get_current_user)
         update_data["$set"]["completed"] = True
         update_data["$set"]["completed_at"] = datetime.now(timezone.utc).isoformat()
 
-    await db.quiz_sessions.update_one({"id": req.session_id}, update_data)
-
-    # Update user stats
-    user_update = {"$inc": {"total_questions": 1}}
-    if is_correct:
-        user_update["$inc"]["total_correct"] = 1
-        user_update["$inc"]["total_score"] = points
-    await db.users.update_one({"id": user["id"]}, user_update)
-
-    # If this was a track‑based question also update genre accuracy
-    if "track" in question:
-        genre = question["track"].get("genre", "unknown")
-        genre_key = f"genre_accuracy.{genre}"
-        inc_update = {f"{genre_key}.total": 1}
-        if is_correct:
-            inc_update[f"{genre_key}.correct"] = 1
-        await db.users.update_one({"id": user["id"]}, {"$inc": inc_update})
-
-    # Update streak
-    if is_correct:
-        user_data = await db.users.find_one({"id": user["id"]}, {"_id": 0, "streak": 1, "best_streak": 1})
-        new_streak = (user_data.get("streak", 0) or 0) + 1
-        best = max(new_streak, user_data.get("best_streak", 0) or 0)
-        await db.users.update_one({"id": user["id"]}, {"$set": {"streak": new_streak, "best_streak": best}})
-    else:
-        await db.users.update_one({"id": user["id"]}, {"$set": {"streak": 0}})
-
+    # conditional, so an answer racing the timer (or a second tab) can't
+    # land on, or count again, a session that was completed meanwhile
+    result = await deps.db.quiz_sessions.update_one({"id": req.session_id, "completed": False}, update_data)
+    if result.matched_count == 0:
+        raise HTTPException(status_code=400, detail="Quiz already completed")
     if is_last:
-        await db.users.update_one({"id": user["id"]}, {"$inc": {"total_games": 1}})
+        timer_engine.discard(req.session_id)
+
+    await record_answer_stats(user["id"], question, is_correct, points, is_last, bool(req.used_hint))
+    if answer_events is not None:
+        answer_events.emit(events.answer_event(user["id"], session, question, answer_record))
 
     response_payload = {
         "is_correct": is_correct,
@@ -763,6 +1265,8 @@ async def answer_question(req: QuizAnswerRequest, user=Depends(get_current_user)
         "is_last_question": is_last,
         "question_index": req.question_index
     }
+    if time_remaining is not None:
+        response_payload["time_remaining"] = round(max(time_remaining, 0), 2)
     if "track" in question:
         response_payload["track_info"] = {
             "name": question["track"]["name"],
@@ -772,39 +1276,163 @@ async def answer_question(req: QuizAnswerRequest, user=Depends(get_current_user)
             "genre": question["track"].get("genre", ""),
             "spotify_url": question["track"].get("spotify_url", "")
         }
-    return response_payload
+    return fastjson.json_response(response_payload)
+
+async def find_one_reporting(collection: str, query: dict, projection: dict):
+    """find_one on the reporting handle (a secondary with MONGO_READ_REPLICAS=on).
+
+    A document written moments ago may not have replicated yet, so a miss is
+    retried on the primary; players never see their own new data missing.
+    """
+    reporting = deps.db_for("reporting")
+    doc = await reporting[collection].find_one(query, projection)
+    if doc is None and reporting is not deps.db:
+        doc = await deps.db[collection].find_one(query, projection)
+    return doc
 
 @api_router.get("/quiz/session/{session_id}")
-async def get_quiz_session(session_id: str, user=Depends(get_current_user)):
-    session = await db.quiz_sessions.find_one(
+async def get_quiz_session(session_id: str, user=Depends(get_current_claims)):
+    session = await find_one_reporting(
+        "quiz_sessions",
         {"id": session_id, "user_id": user["id"]},
         {"_id": 0, "questions.correct_answer": 0}
     )
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
-    return session
+    return fastjson.json_response(session)
+
+# --- Multiplayer Rooms ---
+def score_room_answer(room, question: dict, is_correct: bool, used_hint: bool) -> int:
+    session_like = {"mode": room.mode, "difficulty": room.difficulty, "edu_level": room.edu_level}
+    return score_answer(session_like, question, is_correct, used_hint)
+
+room_manager = multiplayer.RoomManager(
+    multiplayer.create_pubsub(),
+    score_fn=score_room_answer,
+    on_answer=record_answer_stats,
+)
+
+def room_error(e: multiplayer.RoomError) -> HTTPException:
+    return HTTPException(status_code=e.status_code, detail=e.detail)
+
+@api_router.post("/rooms")
+async def create_room(req: RoomCreateRequest, user=Depends(get_current_claims)):
+    """Build one question set with the normal quiz pipeline and open a room for it."""
+    mode = req.mode.lower() if req.mode else ""
+    difficulty = req.difficulty or (await load_user_fields(user["id"], "difficulty_level")).get("difficulty_level", "medium")
+    settings = DIFFICULTY_SETTINGS.get(difficulty, DIFFICULTY_SETTINGS["medium"])
+    edu_level = (req.edu_level or "hybrid").lower()
+    if edu_level not in ("easy", "moderate", "difficult", "hybrid"):
+        edu_level = "hybrid"
+    time_per_question = min(max(req.time_per_question or 20, 5), 120)
+
+    questions = await build_quiz_questions(mode, req.mood, settings, edu_level, req.num_questions)
+    try:
+        room = room_manager.create(
+            user, mode, difficulty, edu_level,
+            questions, build_safe_questions(questions, mode), time_per_question
+        )
+    except multiplayer.RoomError as e:
+        raise room_error(e)
+    return {
+        "code": room.code,
+        "room": room.snapshot(),
+        "points_per_correct": get_points_per_correct(mode, edu_level, settings)
+    }
+
+@api_router.post("/rooms/{code}/join")
+async def join_room(code: str, user=Depends(get_current_claims)):
+    try:
+        room = await room_manager.join(code, user)
+    except multiplayer.RoomError as e:
+        raise room_error(e)
+    return room.snapshot()
+
+@api_router.post("/rooms/{code}/start")
+async def start_room(code: str, user=Depends(get_current_claims)):
+    try:
+        room = await room_manager.start(code, user["id"])
+    except multiplayer.RoomError as e:
+        raise room_error(e)
+    return room.snapshot()
+
+@api_router.post("/rooms/{code}/answer")
+async def answer_room_question(code: str, req: RoomAnswerRequest, user=Depends(get_current_claims)):
+    try:
+        return await room_manager.answer(code, user["id"], req.question_index, req.answer, req.used_hint)
+    except multiplayer.RoomError as e:
+        raise room_error(e)
+
+@api_router.get("/rooms/{code}")
+async def get_room(code: str, user=Depends(get_current_claims)):
+    try:
+        room = room_manager.get(code)
+    except multiplayer.RoomError as e:
+        raise room_error(e)
+    return room.snapshot()
+
+@api_router.websocket("/rooms/{code}/ws")
+async def room_updates(websocket: WebSocket, code: str, token: str = ""):
+    """Live room events (joins, questions, answers, scoreboard) for one player."""
+    try:
+        user = decode_jwt_token(token)
+        room = room_manager.get(code)
+    except (HTTPException, multiplayer.RoomError):
+        await websocket.close(code=4401)
+        return
+    if user["id"] not in room.players:
+        await websocket.close(code=4403)
+        return
+
+    await websocket.accept()
+    subscription = room_manager.subscribe(code)
+    try:
+        await websocket.send_json({"event": "snapshot", "room": room.code, **room.snapshot()})
+
+        async def forward():
+            try:
+                while True:
+                    await websocket.send_text(await subscription.get())
+            except WebSocketDisconnect:
+                pass
+
+        async def drain():
+            # clients don't send anything meaningful; this only detects disconnects
+            try:
+                while True:
+                    await websocket.receive_text()
+            except WebSocketDisconnect:
+                pass
+
+        tasks = [asyncio.ensure_future(forward()), asyncio.ensure_future(drain())]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for t in pending:
+            t.cancel()
+    finally:
+        subscription.close()
 
 # --- User Routes ---
 @api_router.get("/user/profile")
 async def get_user_profile(user=Depends(get_current_user)):
-    return {k: v for k, v in user.items() if k != "spotify_token"}
+    return fastjson.json_response(user)
 
 @api_router.put("/user/profile")
-async def update_user_profile(req: UserProfileUpdate, user=Depends(get_current_user)):
+async def update_user_profile(req: UserProfileUpdate, user=Depends(get_current_claims)):
     update = {}
     if req.favorite_genres is not None:
         update["favorite_genres"] = req.favorite_genres
     if req.difficulty_level is not None:
         update["difficulty_level"] = req.difficulty_level
     if update:
-        await db.users.update_one({"id": user["id"]}, {"$set": update})
-    updated = await db.users.find_one({"id": user["id"]}, {"_id": 0})
-    return {k: v for k, v in updated.items() if k != "spotify_token"}
+        await deps.db_for("critical").users.update_one({"id": user["id"]}, {"$set": update})
+        await response_cache.bump(deps.cache, f"user:{user['id']}")
+    updated = with_pending_counters(await deps.db.users.find_one({"id": user["id"]}, USER_PROJECTION))
+    return fastjson.json_response(updated)
 
 @api_router.get("/user/stats")
-async def get_user_stats(user=Depends(get_current_user)):
-    user_data = await db.users.find_one({"id": user["id"]}, {"_id": 0})
-    sessions = await db.quiz_sessions.find(
+async def get_user_stats(user=Depends(get_current_claims)):
+    user_data = with_pending_counters(await find_one_reporting("users", {"id": user["id"]}, USER_PROJECTION))
+    sessions = await deps.db_for("reporting").quiz_sessions.find(
         {"user_id": user["id"], "completed": True},
         {"_id": 0, "id": 1, "mode": 1, "score": 1, "total_questions": 1, "started_at": 1, "difficulty": 1}
     ).sort("started_at", -1).to_list(50)
@@ -829,7 +1457,7 @@ async def get_user_stats(user=Depends(get_current_user)):
 
     score_history = [{"date": s.get("started_at", ""), "score": s.get("score", 0), "mode": s.get("mode", ""), "total_questions": s.get("total_questions", 0)} for s in sessions[-20:]]
 
-    return {
+    return fastjson.json_response({
         "total_games": user_data.get("total_games", 0),
         "total_score": user_data.get("total_score", 0),
         "total_correct": total_correct,
@@ -841,17 +1469,26 @@ async def get_user_stats(user=Depends(get_current_user)):
         "streak": user_data.get("streak", 0),
         "best_streak": user_data.get("best_streak", 0),
         "difficulty_level": user_data.get("difficulty_level", "medium"),
+        "skill": {k: round(v[0]) for k, v in user_data.get("skill", {}).items()},
         "score_history": score_history,
         "recent_sessions": sessions[:10]
-    }
+    })
 
 # --- Leaderboard ---
 @api_router.get("/leaderboard")
 async def get_leaderboard():
-    users = await db.users.find(
-        {"total_games": {"$gt": 0}},
-        {"_id": 0, "id": 1, "display_name": 1, "avatar": 1, "total_score": 1, "total_games": 1, "total_correct": 1, "total_questions": 1, "best_streak": 1}
-    ).sort("total_score", -1).to_list(50)
+    projection = {"_id": 0, "id": 1, "display_name": 1, "avatar": 1, "total_score": 1, "total_games": 1, "total_correct": 1, "total_questions": 1, "best_streak": 1}
+    reporting = deps.db_for("reporting")
+    users = await reporting.users.find({"total_games": {"$gt": 0}}, projection).sort("total_score", -1).to_list(50)
+    pending_ids = stat_counters.pending_users() if stat_counters is not None else []
+    if pending_ids:
+        # unwritten deltas can lift players into the top 50 or reorder it
+        listed = {u["id"] for u in users}
+        missing = [uid for uid in pending_ids if uid not in listed]
+        if missing:
+            users += await reporting.users.find({"id": {"$in": missing}}, projection).to_list(len(missing))
+        users = [with_pending_counters(u) for u in users]
+        users = sorted((u for u in users if u.get("total_games", 0) > 0), key=lambda u: u.get("total_score", 0), reverse=True)[:50]
 
     leaderboard = []
     for i, u in enumerate(users):
@@ -867,15 +1504,97 @@ async def get_leaderboard():
             "accuracy": accuracy,
             "best_streak": u.get("best_streak", 0)
         })
-    return {"leaderboard": leaderboard}
+    return fastjson.json_response({"leaderboard": leaderboard})
 
 # --- Health ---
 @api_router.get("/")
 async def root():
     return {"message": "Music Quiz Bot API", "status": "running"}
 
+@api_router.get("/health/live")
+async def health_live():
+    """The process is up and serving requests."""
+    return {"status": "ok"}
+
+@api_router.get("/health/ready")
+async def health_ready():
+    """Dependencies are warmed and MongoDB answers a ping; includes connection pool usage."""
+    if not deps.warmed:
+        return JSONResponse({"status": "starting", "checks": deps.checks}, status_code=503)
+    await deps.check_mongo()
+    body = {"status": "ready" if deps.ready else "unavailable", "warm_ms": deps.warm_ms, "checks": deps.checks,
+            "mongo_pool": {"max_pool_size": database.max_pool_size(), "servers": mongo_pool.stats()}}
+    return body if deps.ready else JSONResponse(body, status_code=503)
+
+@api_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(request: Request):
+    """Prometheus text exposition of the in-process metrics."""
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# --- Preview proxy ---
+@api_router.get("/preview/{track_id}")
+async def get_preview_audio(track_id: str, request: Request):
+    """A track's 30-second preview, served from the local cache (PREVIEW_PROXY=on)."""
+    if preview_service is None:
+        raise HTTPException(status_code=404, detail="Preview proxy is disabled")
+    try:
+        response = await preview_service.respond(track_id, request.headers.get("range"))
+    except Exception as e:
+        logger.warning(f"Preview download failed for {track_id}: {e}")
+        raise HTTPException(status_code=502, detail="Preview unavailable upstream")
+    if response is None:
+        raise HTTPException(status_code=404, detail="No preview for this track")
+    return response
+
+@api_router.get("/admin/previews", dependencies=[Depends(require_admin)])
+async def preview_cache_stats():
+    """Preview proxy hit rate and bytes served from disk instead of upstream."""
+    if preview_service is None:
+        return {"enabled": False}
+    return {"enabled": True, **preview_service.stats()}
+
+# --- Admin: profiler output ---
+@api_router.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """Recent cProfile captures (PROFILE_SAMPLE_EVERY enables sampling)."""
+    return {"sample_every": tracing.profiler.every, "profiles": list(reversed(tracing.profiler.recent))}
+
+@api_router.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: str, format: str = "prof"):
+    """Download a capture as a .prof file (for snakeviz/pstats) or a text summary."""
+    if format == "text":
+        summary = await asyncio.to_thread(tracing.profiler.summary, profile_id)
+        if summary is None:
+            raise HTTPException(status_code=404, detail="Profile not found")
+        return PlainTextResponse(summary)
+    path = tracing.profiler.path_for(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=path.name)
+
 app.include_router(api_router)
 
+# ETags and cached bodies for polled read endpoints; writes bump the
+# version counters each rule lists (response_cache.bump)
+app.add_middleware(
+    response_cache.ResponseCacheMiddleware,
+    rules=[
+        response_cache.Rule("/api/leaderboard", ["leaderboard"], public=True, endpoint=get_leaderboard),
+        response_cache.Rule("/api/user/stats", ["user:{user_id}"], endpoint=get_user_stats),
+        response_cache.Rule("/api/user/profile", ["user:{user_id}"], endpoint=get_user_profile),
+        response_cache.Rule("/api/quiz/session/{session_id}", ["user:{user_id}"], endpoint=get_quiz_session),
+    ],
+    get_cache=lambda: deps.cache,
+    identify=user_id_from_headers,
+)
+# outside the response cache so cached bodies are stored uncompressed
+app.add_middleware(compression.CompressionMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(tracing.TracingMiddleware)
+# outermost, so responses sent by the middlewares above (cached bodies,
+# 304s, preflights) carry the CORS headers too
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -883,7 +1602,3 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
@@ -0,0 +1,117 @@
+"""Server-authoritative deadlines for timed quiz sessions.
+
+Each timed session gets a monotonic deadline. `answer_question` checks it
+with a dict lookup, and one scheduler task per worker drains a min-heap of
+deadlines, handing every session that expired in the same tick to a single
+bulk callback. Thousands of timed sessions therefore cost one task and one
+heap entry each, not one sleeping task each.
+"""
+import asyncio
+import heapq
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# extra seconds allowed for network latency before an answer counts as late
+TIMER_GRACE_SECONDS = float(os.environ.get("TIMER_GRACE_SECONDS", "2"))
+# expired sessions are collected for up to this long before one bulk flush
+TIMER_RESOLUTION_SECONDS = float(os.environ.get("TIMER_RESOLUTION_SECONDS", "0.5"))
+
+
+class SessionTimerEngine:
+    """Min-heap of (deadline, session_id) drained by a single background task.
+
+    Removing a session only drops it from `deadlines`; its stale heap entry
+    is skipped when popped (lazy deletion), so `discard` is O(1).
+    """
+
+    def __init__(self, on_expired: Callable[[List[str]], Awaitable[None]],
+                 grace: float = TIMER_GRACE_SECONDS, resolution: float = TIMER_RESOLUTION_SECONDS):
+        self.on_expired = on_expired
+        self.grace = grace
+        self.resolution = resolution
+        self.deadlines: Dict[str, float] = {}
+        self.heap: List[Tuple[float, str]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, session_id: str, time_limit: float) -> float:
+        """Register a session and return its monotonic deadline."""
+        deadline = time.monotonic() + time_limit
+        self.deadlines[session_id] = deadline
+        heapq.heappush(self.heap, (deadline + self.grace, session_id))
+        # only wake the scheduler if this deadline is now the earliest
+        if self._wakeup is not None and self.heap[0][1] == session_id:
+            self._wakeup.set()
+        return deadline
+
+    def discard(self, session_id: str):
+        self.deadlines.pop(session_id, None)
+
+    def tracks(self, session_id: str) -> bool:
+        return session_id in self.deadlines
+
+    def remaining(self, session_id: str) -> Optional[float]:
+        """Seconds left (negative once expired), or None if not tracked here."""
+        deadline = self.deadlines.get(session_id)
+        if deadline is None:
+            return None
+        return deadline - time.monotonic()
+
+    def is_expired(self, session_id: str) -> bool:
+        remaining = self.remaining(session_id)
+        return remaining is not None and remaining < -self.grace
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def pop_expired(self, now: Optional[float] = None) -> List[str]:
+        """Remove and return every tracked session whose deadline has passed."""
+        now = time.monotonic() if now is None else now
+        expired = []
+        while self.heap and self.heap[0][0] <= now:
+            due, session_id = heapq.heappop(self.heap)
+            deadline = self.deadlines.get(session_id)
+            # skip entries that were discarded or re-added with a new deadline
+            if deadline is None or deadline + self.grace != due:
+                continue
+            del self.deadlines[session_id]
+            expired.append(session_id)
+        return expired
+
+    async def _run(self):
+        while True:
+            if self.heap:
+                delay = max(self.heap[0][0] - time.monotonic(), 0)
+                # batch expiries that land close together into one flush
+                delay = max(delay, self.resolution)
+            else:
+                delay = None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            expired = self.pop_expired()
+            if not expired:
+                continue
+            try:
+                await self.on_expired(expired)
+            except Exception as e:
+                logger.error(f"Failed to complete {len(expired)} expired sessions: {e}")
@@ -0,0 +1,237 @@
+"""Access and refresh tokens.
+
+Logins return a short-lived access token (a JWT) and a long-lived refresh
+token.
+
+Access token claims:
+
+    {"sub": user id, "sid": auth session id, "name": display name,
+     "guest": bool, "iat", "exp"}                    header: {"kid": key id}
+
+These claims cover what the quiz, room and stats endpoints need, so those
+endpoints authenticate without touching MongoDB.
+
+A token that has been verified once is cached per worker until it expires
+(TOKEN_CACHE_SIZE). Later requests with the same token skip the HMAC check
+and the JSON parse: a dict lookup.
+
+Signing keys come from JWT_KEYS, a comma-separated list of `kid:secret`
+pairs. The first pair signs and every pair verifies. To rotate, put the
+new key first and drop the old one once REFRESH_TOKEN_DAYS have passed,
+because by then every session has refreshed onto the new key. Without
+JWT_KEYS, JWT_SECRET is the only key. One of the two must be set, and
+neither may be the old `fallback_secret` default; otherwise the server
+refuses to start.
+
+Tokens issued before key ids existed have no `kid`. Without JWT_KEYS they
+verify with JWT_SECRET, which is also the signing key. With JWT_KEYS they
+are rejected unless JWT_LEGACY_TOKENS_UNTIL (an ISO timestamp) is set, and
+then only with JWT_SECRET and only until that time. Set it to the upgrade
+time plus the old 24 hour token lifetime.
+
+Refresh tokens are `{session id}.{secret}`. The session lives in the
+`auth_sessions` collection, which stores the secret's SHA-256, and is
+removed by a TTL index when it expires. The Spotify tokens from a Spotify
+login are saved with the session instead of travelling in every JWT; no
+endpoint acts as the user on Spotify yet, so nothing reads them back.
+
+Each refresh rotates the secret. Presenting an already rotated secret
+revokes the whole session, on the assumption that it was stolen. The one
+exception is a grace window (REFRESH_REUSE_GRACE_SECONDS) for two tabs
+that refresh at the same moment.
+
+Access tokens are not revocable; ACCESS_TOKEN_MINUTES bounds how long one
+outlives a logout.
+"""
+import hashlib
+import os
+import secrets
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Optional, Tuple
+
+import jwt as pyjwt
+from pymongo import ReturnDocument
+
+import cache
+
+ACCESS_TOKEN_MINUTES = float(os.environ.get("ACCESS_TOKEN_MINUTES", "15"))
+REFRESH_TOKEN_DAYS = float(os.environ.get("REFRESH_TOKEN_DAYS", "30"))
+REFRESH_REUSE_GRACE_SECONDS = float(os.environ.get("REFRESH_REUSE_GRACE_SECONDS", "30"))
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "50000"))
+SESSIONS = "auth_sessions"
+ALGORITHM = "HS256"
+# secrets that have shipped as defaults and must never sign or verify
+INSECURE_SECRETS = {"fallback_secret"}
+
+
+class TokenError(Exception):
+    """An access or refresh token that must be rejected (HTTP 401)."""
+
+
+def parse_keys(spec: str) -> Dict[str, str]:
+    keys = {}
+    for part in spec.split(","):
+        kid, sep, secret = part.strip().partition(":")
+        if not sep or not kid or not secret:
+            raise ValueError("JWT_KEYS must be a comma-separated list of kid:secret")
+        keys[kid] = secret
+    return keys
+
+
+def parse_cutoff(value: str) -> Optional[float]:
+    """JWT_LEGACY_TOKENS_UNTIL as a Unix time (naive timestamps are UTC)."""
+    if not value:
+        return None
+    cutoff = datetime.fromisoformat(value)
+    if cutoff.tzinfo is None:
+        cutoff = cutoff.replace(tzinfo=timezone.utc)
+    return cutoff.timestamp()
+
+
+class TokenService:
+    def __init__(self, legacy_secret: Optional[str], keys_spec: str = "", legacy_until: str = "",
+                 access_minutes: float = ACCESS_TOKEN_MINUTES, cache_size: int = TOKEN_CACHE_SIZE):
+        if keys_spec:
+            self.keys = parse_keys(keys_spec)
+        elif legacy_secret:
+            self.keys = {"default": legacy_secret}
+        else:
+            raise ValueError("Set JWT_SECRET or JWT_KEYS")
+        if INSECURE_SECRETS & {legacy_secret, *self.keys.values()}:
+            raise ValueError("JWT_SECRET/JWT_KEYS use a default secret; set a random one")
+        # dicts keep insertion order: the first key signs
+        self.kid = next(iter(self.keys))
+        # kid-less tokens: verified with JWT_SECRET, which without JWT_KEYS
+        # is the signing key itself, and with JWT_KEYS only until the cutoff
+        self.legacy_secret = legacy_secret
+        self.legacy_until = parse_cutoff(legacy_until) if keys_spec else None
+        if keys_spec and self.legacy_until is not None and not legacy_secret:
+            raise ValueError("JWT_LEGACY_TOKENS_UNTIL needs JWT_SECRET")
+        self.legacy_always = not keys_spec
+        self.access_seconds = access_minutes * 60
+        # token -> claims, expiring with the token
+        self.verified = cache.MemoryCache(max_entries=cache_size)
+
+    def issue(self, user: dict, sid: str) -> str:
+        now = datetime.now(timezone.utc)
+        payload = {
+            "sub": user["id"],
+            "sid": sid,
+            "name": user.get("display_name"),
+            "guest": bool(user.get("guest")),
+            "iat": now,
+            "exp": now + timedelta(seconds=self.access_seconds),
+        }
+        return pyjwt.encode(payload, self.keys[self.kid], algorithm=ALGORITHM, headers={"kid": self.kid})
+
+    def verify(self, token: str) -> dict:
+        """Claims of a valid access token: {"id", "sid", "display_name", "guest"}."""
+        claims = self.verified.get_sync(token)
+        if claims is not None:
+            return claims
+        try:
+            kid = pyjwt.get_unverified_header(token).get("kid")
+            secret = self.keys.get(kid) if kid else self._legacy_secret()
+            if secret is None:
+                raise TokenError("Invalid token")
+            payload = pyjwt.decode(token, secret, algorithms=[ALGORITHM], options={"require": ["exp"]})
+        except pyjwt.ExpiredSignatureError:
+            raise TokenError("Token expired")
+        except pyjwt.InvalidTokenError:
+            raise TokenError("Invalid token")
+        user_id = payload.get("sub") or payload.get("user_id")
+        if not user_id:
+            raise TokenError("Invalid token")
+        claims = {
+            "id": user_id,
+            "sid": payload.get("sid"),
+            "display_name": payload.get("name"),
+            "guest": payload.get("guest", False),
+        }
+        expires = payload["exp"]
+        if not kid and self.legacy_until is not None:
+            expires = min(expires, self.legacy_until)
+        ttl = expires - time.time()
+        if ttl > 0:
+            self.verified.set_sync(token, claims, ttl)
+        return claims
+
+    def _legacy_secret(self) -> Optional[str]:
+        if self.legacy_always:
+            return self.legacy_secret
+        if self.legacy_until is not None and time.time() < self.legacy_until:
+            return self.legacy_secret
+        return None
+
+    def forget(self, token: str):
+        self.verified.delete_sync([token])
+
+
+def _digest(secret: str) -> str:
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+
+def _split(refresh_token: str) -> Tuple[str, str]:
+    sid, sep, secret = (refresh_token or "").partition(".")
+    if not sep or not sid or not secret:
+        raise TokenError("Invalid refresh token")
+    return sid, secret
+
+
+async def ensure_indexes(db):
+    await db[SESSIONS].create_index("expires_at", expireAfterSeconds=0)
+    await db[SESSIONS].create_index("user_id")
+
+
+async def create_session(db, user_id: str, spotify: Optional[dict] = None,
+                         refresh_days: float = REFRESH_TOKEN_DAYS) -> Tuple[str, str]:
+    """Start an auth session; returns (session id, refresh token)."""
+    sid, secret = uuid.uuid4().hex, secrets.token_urlsafe(32)
+    now = datetime.now(timezone.utc)
+    await db[SESSIONS].insert_one({
+        "_id": sid,
+        "user_id": user_id,
+        "refresh_hash": _digest(secret),
+        "previous_hash": None,
+        "rotated_at": time.time(),
+        "revoked": False,
+        "spotify": spotify,
+        "created_at": now,
+        "expires_at": now + timedelta(days=refresh_days),
+    })
+    return sid, f"{sid}.{secret}"
+
+
+async def rotate(db, refresh_token: str, grace_seconds: float = REFRESH_REUSE_GRACE_SECONDS) -> Tuple[dict, Optional[str]]:
+    """Exchange a refresh token: (session, new refresh token).
+
+    The new token is None when a concurrent refresh already rotated this
+    one within the grace window; the caller then issues only an access token.
+    """
+    sid, secret = _split(refresh_token)
+    digest, new_secret = _digest(secret), secrets.token_urlsafe(32)
+    now = datetime.now(timezone.utc)
+    session = await db[SESSIONS].find_one_and_update(
+        {"_id": sid, "refresh_hash": digest, "revoked": False, "expires_at": {"$gt": now}},
+        {"$set": {"refresh_hash": _digest(new_secret), "previous_hash": digest, "rotated_at": time.time()}},
+        return_document=ReturnDocument.AFTER)
+    if session is not None:
+        return session, f"{sid}.{new_secret}"
+    session = await db[SESSIONS].find_one({"_id": sid})
+    if session is None or session["revoked"] or session["expires_at"].replace(tzinfo=timezone.utc) <= now:
+        raise TokenError("Invalid refresh token")
+    if session.get("previous_hash") == digest and time.time() - session["rotated_at"] < grace_seconds:
+        return session, None
+    # an old secret came back after it was rotated: treat the session as stolen
+    await db[SESSIONS].update_one({"_id": sid}, {"$set": {"revoked": True}})
+    raise TokenError("Refresh token reused")
+
+
+async def revoke(db, refresh_token: str):
+    sid, secret = _split(refresh_token)
+    digest = _digest(secret)
+    await db[SESSIONS].update_one(
+        {"_id": sid, "$or": [{"refresh_hash": digest}, {"previous_hash": digest}]}, {"$set": {"revoked": True}})
+
@@ -0,0 +1,365 @@
+"""Request-scoped tracing and an opt-in sampling profiler.
+
+Every HTTP request gets a trace id, taken from an incoming W3C
+`traceparent` or `X-Trace-Id` header or generated, and echoed back in
+`X-Trace-Id`. Code opens child spans with `span(name, **attributes)`;
+MongoDB commands become spans automatically through a pymongo listener.
+Finished traces are batched and exported off the request path:
+
+    TRACE_EXPORTER=none | json | otlp
+    TRACE_SAMPLE_RATE=1.0            fraction of requests whose spans are exported
+    TRACE_DIR=traces                 json: one NDJSON file of spans per day
+    OTLP_ENDPOINT=http://localhost:4318/v1/traces   otlp: OTLP/HTTP JSON
+
+The profiler runs cProfile on 1 in PROFILE_SAMPLE_EVERY requests (0 = off).
+Only one request is profiled at a time, and the profile covers everything
+the event loop did meanwhile. Results are saved under PROFILE_DIR and can
+be listed and downloaded from the /api/admin/profiles endpoints.
+"""
+import asyncio
+import contextvars
+import cProfile
+import io
+import itertools
+import json
+import logging
+import os
+import pstats
+import random
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "none").lower()
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_DIR = Path(os.environ.get("TRACE_DIR", Path(__file__).parent / "traces"))
+OTLP_ENDPOINT = os.environ.get("OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_FLUSH_SECONDS = float(os.environ.get("TRACE_FLUSH_SECONDS", "2"))
+SERVICE_NAME = os.environ.get("SERVICE_NAME", "musicquiz-backend")
+
+PROFILE_SAMPLE_EVERY = int(os.environ.get("PROFILE_SAMPLE_EVERY", "0"))
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", Path(__file__).parent / "profiles"))
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "50"))
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str, attributes: dict):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+
+    def finish(self):
+        self.end_ns = time.time_ns()
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": datetime.fromtimestamp(self.start_ns / 1e9, timezone.utc).isoformat(),
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class Trace:
+    __slots__ = ("trace_id", "sampled", "spans")
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans: List[Span] = []
+
+
+_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+_parent: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("trace_parent", default=None)
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a block as a child of the current span. No-op outside a trace."""
+    trace = _trace.get()
+    if trace is None or not trace.sampled:
+        yield None
+        return
+    parent = _parent.get()
+    s = Span(trace.trace_id, parent.span_id if parent else None, name, attributes)
+    token = _parent.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _parent.reset(token)
+        s.finish()
+        trace.spans.append(s)
+
+
+class MongoSpanListener(monitoring.CommandListener):
+    """Turns every MongoDB command into a span of the request that issued it."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, None)
+
+    def failed(self, event):
+        self._record(event, str(event.failure))
+
+    def _record(self, event, error):
+        trace = _trace.get()
+        if trace is None or not trace.sampled:
+            return
+        parent = _parent.get()
+        s = Span(trace.trace_id, parent.span_id if parent else None, f"mongo.{event.command_name}", {"db": event.database_name})
+        s.end_ns = s.start_ns
+        s.start_ns -= event.duration_micros * 1000
+        s.error = error
+        trace.spans.append(s)
+
+
+# --- Exporters ---
+class Exporter:
+    """Buffers finished traces and flushes them in batches from a background task."""
+
+    def __init__(self):
+        self.buffer: List[Span] = []
+        self._task = None
+
+    def export(self, spans: List[Span]):
+        self.buffer.extend(spans)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(TRACE_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Trace export failed: {e}")
+
+    async def flush(self):
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        await self.write(batch)
+
+    async def write(self, spans: List[Span]):
+        pass
+
+
+class JSONFileExporter(Exporter):
+    def __init__(self, directory: Path = TRACE_DIR):
+        super().__init__()
+        self.directory = directory
+
+    async def write(self, spans: List[Span]):
+        lines = [json.dumps(s.to_dict(), default=str) + "\n" for s in spans]
+        await asyncio.to_thread(self._append, lines)
+
+    def _append(self, lines: list):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"traces-{datetime.now(timezone.utc):%Y%m%d}.ndjson"
+        with open(path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+
+
+class OTLPExporter(Exporter):
+    """Minimal OTLP/HTTP JSON exporter, e.g. for a local OpenTelemetry collector."""
+
+    def __init__(self, endpoint: str = OTLP_ENDPOINT):
+        super().__init__()
+        self.endpoint = endpoint
+
+    @staticmethod
+    def _attr(key, value) -> dict:
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    async def write(self, spans: List[Span]):
+        import aiohttp
+
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [self._attr("service.name", SERVICE_NAME)]},
+            "scopeSpans": [{
+                "scope": {"name": "musicquiz.tracing"},
+                "spans": [{
+                    "traceId": s.trace_id,
+                    "spanId": s.span_id,
+                    "parentSpanId": s.parent_id or "",
+                    "name": s.name,
+                    "kind": 2 if s.parent_id is None else 1,
+                    "startTimeUnixNano": str(s.start_ns),
+                    "endTimeUnixNano": str(s.end_ns),
+                    "attributes": [self._attr(k, v) for k, v in s.attributes.items()],
+                    "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+                } for s in spans],
+            }],
+        }]}
+        async with aiohttp.ClientSession() as session:
+            async with session.post(self.endpoint, json=payload, timeout=aiohttp.ClientTimeout(total=5)) as resp:
+                if resp.status >= 400:
+                    logger.warning(f"OTLP export returned {resp.status}")
+
+
+def create_exporter() -> Optional[Exporter]:
+    if TRACE_EXPORTER == "json":
+        return JSONFileExporter()
+    if TRACE_EXPORTER == "otlp":
+        return OTLPExporter()
+    return None
+
+
+exporter = create_exporter()
+
+
+# --- Profiler ---
+class Profiler:
+    """cProfile on 1 in N requests, one at a time."""
+
+    def __init__(self, every: int = PROFILE_SAMPLE_EVERY, directory: Path = PROFILE_DIR, keep: int = PROFILE_KEEP):
+        self.every = every
+        self.directory = directory
+        self.counter = itertools.count(1)
+        self.active = False
+        self.recent = deque(maxlen=keep)
+
+    def should_profile(self) -> bool:
+        return self.every > 0 and not self.active and next(self.counter) % self.every == 0
+
+    def start(self) -> cProfile.Profile:
+        self.active = True
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    async def stop(self, profile: cProfile.Profile, trace_id: str, route: str, duration_ms: float):
+        profile.disable()
+        self.active = False
+        profile_id = f"{int(time.time())}-{trace_id[:8]}"
+        # dump_stats and the retention sweep are file I/O: keep them off the loop
+        await asyncio.to_thread(self._save, profile, profile_id)
+        self.recent.append({"id": profile_id, "trace_id": trace_id, "route": route, "duration_ms": round(duration_ms, 2),
+                            "created_at": datetime.now(timezone.utc).isoformat()})
+        await asyncio.to_thread(self._prune, {p["id"] for p in self.recent})
+
+    def _save(self, profile: cProfile.Profile, profile_id: str):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        profile.dump_stats(str(self.directory / f"{profile_id}.prof"))
+
+    def _prune(self, kept: set):
+        # drop files that fell out of the retention window
+        for old in self.directory.glob("*.prof"):
+            if old.stem not in kept:
+                old.unlink(missing_ok=True)
+
+    def path_for(self, profile_id: str) -> Optional[Path]:
+        if not any(p["id"] == profile_id for p in self.recent):
+            return None
+        path = self.directory / f"{profile_id}.prof"
+        return path if path.exists() else None
+
+    def summary(self, profile_id: str, limit: int = 40) -> Optional[str]:
+        path = self.path_for(profile_id)
+        if path is None:
+            return None
+        out = io.StringIO()
+        pstats.Stats(str(path), stream=out).sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+
+profiler = Profiler()
+
+
+# --- Middleware ---
+def _incoming_trace_id(headers: list) -> Optional[str]:
+    for key, value in headers:
+        if key == b"traceparent":
+            parts = value.decode("latin-1").split("-")
+            if len(parts) >= 2 and len(parts[1]) == 32:
+                return parts[1]
+        elif key == b"x-trace-id":
+            candidate = value.decode("latin-1").strip().lower()
+            if 8 <= len(candidate) <= 32 and all(c in "0123456789abcdef" for c in candidate):
+                return candidate.rjust(32, "0")
+    return None
+
+
+class TracingMiddleware:
+    """Pure ASGI middleware: opens the root span, echoes the trace id, and samples profiles."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace_id = _incoming_trace_id(scope["headers"]) or uuid.uuid4().hex
+        sampled = exporter is not None and (TRACE_SAMPLE_RATE >= 1 or random.random() < TRACE_SAMPLE_RATE)
+        trace = Trace(trace_id, sampled)
+        trace_token = _trace.set(trace)
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", trace_id.encode())]
+            await send(message)
+
+        profile = profiler.start() if profiler.should_profile() else None
+        start = time.perf_counter()
+        try:
+            with span(f"{scope['method']} {scope['path']}", method=scope["method"]) as root:
+                await self.app(scope, receive, send_wrapper)
+                if root is not None:
+                    root.attributes["status"] = status_holder[0]
+                    endpoint = scope.get("endpoint")
+                    root.attributes["route"] = endpoint.__name__ if endpoint else "unmatched"
+        finally:
+            _trace.reset(trace_token)
+            if profile is not None:
+                endpoint = scope.get("endpoint")
+                await profiler.stop(profile, trace_id, endpoint.__name__ if endpoint else scope["path"],
+                                    (time.perf_counter() - start) * 1000)
+            if sampled:
+                exporter.export(trace.spans)
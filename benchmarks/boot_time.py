@@ -0,0 +1,109 @@
+"""Measure how long the backend takes to import and to become ready.
+
+Each run starts a fresh interpreter (so nothing is already imported),
+times `import server`, then enters the FastAPI lifespan (dependency warm-up,
+timer engine, exporter) and times that too. Providers default to the
+in-process synthetic fakes so no network is involved.
+
+    python benchmarks/boot_time.py --runs 5
+    python benchmarks/boot_time.py --import-budget-ms 1000 --boot-budget-ms 2000
+    python benchmarks/boot_time.py --mongo mongodb://localhost:27017 --json boot.json
+
+Exits non-zero when the median import or boot time exceeds its budget, so
+it can gate a deploy alongside load_test.py.
+"""
+import argparse
+import json
+import os
+import secrets
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT / "backend"
+
+# runs in the child interpreter; prints one JSON line
+CHILD = r"""
+import asyncio, json, sys, time
+sys.path.insert(0, sys.argv[1])
+mongo = sys.argv[2]
+
+start = time.perf_counter()
+import server
+import_ms = (time.perf_counter() - start) * 1000
+
+if mongo == "mock":
+    from mongomock_motor import AsyncMongoMockClient
+    server.deps.use_mongo_client(AsyncMongoMockClient())
+
+async def boot():
+    start = time.perf_counter()
+    async with server.app.router.lifespan_context(server.app):
+        boot_ms = (time.perf_counter() - start) * 1000
+        checks = dict(server.deps.checks)
+    return boot_ms, checks
+
+boot_ms, checks = asyncio.run(boot())
+print(json.dumps({"import_ms": import_ms, "boot_ms": boot_ms, "checks": checks}))
+"""
+
+
+def run_once(mongo: str, env: dict) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD, str(BACKEND_DIR), mongo],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure backend import and startup time.")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to start")
+    parser.add_argument("--mongo", default="mock", help="'mock' for mongomock, or a MongoDB URL")
+    parser.add_argument("--providers", default="synthetic", help="PROVIDERS value for the child (synthetic/live/replay)")
+    parser.add_argument("--import-budget-ms", type=float, help="fail if median `import server` time exceeds this")
+    parser.add_argument("--boot-budget-ms", type=float, help="fail if median lifespan startup time exceeds this")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    env = dict(os.environ, PROVIDERS=args.providers, TRACE_EXPORTER=os.environ.get("TRACE_EXPORTER", "none"))
+    env.setdefault("JWT_SECRET", secrets.token_urlsafe(32))
+    if args.mongo != "mock":
+        env["MONGO_URL"] = args.mongo
+
+    runs = []
+    for i in range(args.runs):
+        try:
+            runs.append(run_once(args.mongo, env))
+        except subprocess.CalledProcessError as e:
+            print(e.stderr, file=sys.stderr)
+            sys.exit(2)
+        print(f"run {i + 1}: import {runs[-1]['import_ms']:.0f}ms, boot {runs[-1]['boot_ms']:.0f}ms")
+
+    result = {
+        "import_ms": round(statistics.median(r["import_ms"] for r in runs), 1),
+        "boot_ms": round(statistics.median(r["boot_ms"] for r in runs), 1),
+        "checks": runs[-1]["checks"],
+        "config": {k: v for k, v in vars(args).items() if k != "json"},
+    }
+    print(f"\nmedian import {result['import_ms']}ms, boot {result['boot_ms']}ms")
+    print(f"checks: {result['checks']}")
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=2))
+
+    failures = []
+    if args.import_budget_ms is not None and result["import_ms"] > args.import_budget_ms:
+        failures.append(f"import {result['import_ms']}ms > budget {args.import_budget_ms}ms")
+    if args.boot_budget_ms is not None and result["boot_ms"] > args.boot_budget_ms:
+        failures.append(f"boot {result['boot_ms']}ms > budget {args.boot_budget_ms}ms")
+    if failures:
+        print("\nOver budget:")
+        for f in failures:
+            print(f"  {f}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""Load test for the quiz API with local stand-ins for every dependency.
+
+Starts `stub_providers.py` in a subprocess, points the backend at it, and
+drives the FastAPI app in-process (or any running server via --target)
+with concurrent virtual players. Each player runs the realistic flow:
+
+    guest login -> quiz start -> N answers -> stats -> leaderboard
+
+and the report gives p50/p95/p99 latency and throughput per endpoint.
+
+    python benchmarks/load_test.py --players 200 --concurrency 20 --mongo mock
+    python benchmarks/load_test.py --mongo mongodb://localhost:27017 --json bench.json
+    python benchmarks/load_test.py --baseline bench.json --max-regression 0.2
+    python benchmarks/load_test.py --mongo "mongodb://localhost:27017,localhost:27018/?replicaSet=rs0" --read-replicas
+    python benchmarks/load_test.py --providers synthetic --provider-latency lognormal:80,0.5
+
+--providers synthetic skips the stub servers and uses the in-process fake
+providers from backend/providers.py instead (no sockets at all).
+
+With --baseline the run exits non-zero if any endpoint's p95 is more than
+--max-regression slower than the baseline, so it can gate a deploy.
+
+With a real MongoDB the report ends with per-member connection pool usage,
+which shows whether --read-replicas moved the read-only endpoints
+(leaderboard, stats, session history) onto secondaries.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT / "backend"
+MODES = ["genre", "artist", "mood", "timed", "educational"]
+MOODS = ["happy", "chill", "energetic", "sad", "focus"]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, client: httpx.AsyncClient, name: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[name] += 1
+            return None
+        self.latencies[name].append((time.perf_counter() - start) * 1000)
+        if resp.status_code >= 400:
+            self.errors[name] += 1
+            return None
+        return resp.json()
+
+    def report(self, elapsed: float) -> dict:
+        result = {}
+        for name, values in sorted(self.latencies.items()):
+            values.sort()
+            result[name] = {
+                "count": len(values),
+                "errors": self.errors.get(name, 0),
+                "mean_ms": round(sum(values) / len(values), 2),
+                "p50_ms": round(percentile(values, 50), 2),
+                "p95_ms": round(percentile(values, 95), 2),
+                "p99_ms": round(percentile(values, 99), 2),
+                "throughput_rps": round(len(values) / elapsed, 2),
+            }
+        return result
+
+
+async def play(client: httpx.AsyncClient, rec: Recorder, player_id: int, answers: int):
+    """One virtual player's session."""
+    data = await rec.call(client, "POST /auth/guest", "POST", "/api/auth/guest", json={"name": f"bench-{player_id}"})
+    if not data:
+        return
+    headers = {"Authorization": f"Bearer {data['token']}"}
+
+    mode = random.choice(MODES)
+    body = {"mode": mode, "difficulty": random.choice(["easy", "medium", "hard"])}
+    if mode == "mood":
+        body["mood"] = random.choice(MOODS)
+    quiz = await rec.call(client, "POST /quiz/start", "POST", "/api/quiz/start", json=body, headers=headers)
+    if quiz:
+        for i, q in enumerate(quiz["questions"][:answers]):
+            await rec.call(client, "POST /quiz/answer", "POST", "/api/quiz/answer", headers=headers, json={
+                "session_id": quiz["session_id"],
+                "question_index": i,
+                "answer": random.choice(q["options"]),
+                "used_hint": random.random() < 0.2,
+            })
+
+    await rec.call(client, "GET /user/stats", "GET", "/api/user/stats", headers=headers)
+    await rec.call(client, "GET /leaderboard", "GET", "/api/leaderboard")
+
+
+async def run_load(client: httpx.AsyncClient, players: int, concurrency: int, answers: int) -> dict:
+    rec = Recorder()
+    sem = asyncio.Semaphore(concurrency)
+
+    async def bounded(i):
+        async with sem:
+            await play(client, rec, i, answers)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(bounded(i) for i in range(players)))
+    elapsed = time.perf_counter() - start
+    return {"elapsed_s": round(elapsed, 2), "endpoints": rec.report(elapsed)}
+
+
+def start_stubs(args) -> tuple:
+    port = free_port()
+    proc = subprocess.Popen([
+        sys.executable, str(Path(__file__).parent / "stub_providers.py"), "--port", str(port),
+        "--spotify-latency-ms", str(args.spotify_latency_ms),
+        "--deezer-latency-ms", str(args.deezer_latency_ms),
+        "--gemini-latency-ms", str(args.gemini_latency_ms),
+        "--jitter", str(args.jitter),
+    ])
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return proc, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("stub providers did not start")
+
+
+def load_app(stub_url: str, mongo: str):
+    """Import the backend with its providers pointed at the stubs (if any)."""
+    os.environ["DB_NAME"] = os.environ.get("BENCH_DB_NAME", "musicquiz_bench")
+    # tokens are issued and verified in this process only
+    os.environ.setdefault("JWT_SECRET", secrets.token_urlsafe(32))
+    if stub_url:
+        os.environ.update({
+            "SPOTIFY_API_URL": f"{stub_url}/v1/",
+            "SPOTIFY_ACCOUNTS_URL": f"{stub_url}/api/token",
+            "DEEZER_API_URL": f"{stub_url}/deezer",
+            "GEMINI_API_ENDPOINT": stub_url,
+        })
+    if mongo != "mock":
+        os.environ["MONGO_URL"] = mongo
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+
+    if mongo == "mock":
+        # optional dependency, only needed for --mongo mock
+        from mongomock_motor import AsyncMongoMockClient
+        server.deps.use_mongo_client(AsyncMongoMockClient())
+    return server
+
+
+def print_report(result: dict):
+    print(f"\nCompleted in {result['elapsed_s']}s")
+    header = f"{'endpoint':<20} {'count':>6} {'errors':>6} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'req/s':>8}"
+    print(header)
+    print("-" * len(header))
+    for name, s in result["endpoints"].items():
+        print(f"{name:<20} {s['count']:>6} {s['errors']:>6} {s['mean_ms']:>9.1f} {s['p50_ms']:>9.1f} {s['p95_ms']:>9.1f} {s['p99_ms']:>9.1f} {s['throughput_rps']:>8.1f}")
+
+
+def check_regressions(result: dict, baseline_path: str, max_regression: float) -> list:
+    baseline = json.loads(Path(baseline_path).read_text())["endpoints"]
+    failures = []
+    for name, s in result["endpoints"].items():
+        base = baseline.get(name)
+        if base and base["p95_ms"] > 0 and s["p95_ms"] > base["p95_ms"] * (1 + max_regression):
+            failures.append(f"{name}: p95 {s['p95_ms']}ms vs baseline {base['p95_ms']}ms")
+    return failures
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark the quiz API against local provider stubs.")
+    parser.add_argument("--players", type=int, default=100, help="virtual players to run in total")
+    parser.add_argument("--concurrency", type=int, default=10, help="players active at the same time")
+    parser.add_argument("--answers", type=int, default=5, help="answers submitted per quiz")
+    parser.add_argument("--mongo", default="mock", help="'mock' for mongomock, or a MongoDB URL")
+    parser.add_argument("--read-replicas", action="store_true",
+                        help="route read-only endpoints to secondaries (MONGO_READ_REPLICAS=on)")
+    parser.add_argument("--target", help="benchmark a running server at this base URL instead of in-process")
+    parser.add_argument("--spotify-latency-ms", type=float, default=80)
+    parser.add_argument("--deezer-latency-ms", type=float, default=40)
+    parser.add_argument("--gemini-latency-ms", type=float, default=300)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--providers", choices=("stub", "synthetic", "replay"), default="stub",
+                        help="stub HTTP servers, or backend/providers.py fakes selected via PROVIDERS")
+    parser.add_argument("--provider-latency", default="", help="PROVIDER_LATENCY spec for --providers synthetic/replay")
+    parser.add_argument("--provider-error-rate", type=float, default=0.0)
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="compare p95 latencies against a previous --json report")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    stubs = None
+    try:
+        if args.target:
+            client = httpx.AsyncClient(base_url=args.target, timeout=60)
+        else:
+            stub_url = None
+            if args.read_replicas:
+                os.environ["MONGO_READ_REPLICAS"] = "on"
+            if args.providers == "stub":
+                stubs, stub_url = start_stubs(args)
+            else:
+                os.environ.update({
+                    "PROVIDERS": args.providers,
+                    "PROVIDER_LATENCY": args.provider_latency,
+                    "PROVIDER_ERROR_RATE": str(args.provider_error_rate),
+                    "PROVIDER_SEED": str(args.seed),
+                })
+            server = load_app(stub_url, args.mongo)
+            # ASGITransport doesn't run the lifespan; warm up front so the
+            # first requests don't pay for provider construction
+            await server.deps.warm()
+            transport = httpx.ASGITransport(app=server.app)
+            client = httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60)
+
+        async with client:
+            result = await run_load(client, args.players, args.concurrency, args.answers)
+        if not args.target and args.mongo != "mock":
+            result["mongo_pool"] = server.mongo_pool.stats()
+    finally:
+        if stubs is not None:
+            stubs.terminate()
+
+    result["config"] = {k: v for k, v in vars(args).items() if k not in ("json", "baseline")}
+    print_report(result)
+    for member, pool in result.get("mongo_pool", {}).items():
+        print(f"mongo {member}: {pool['checkouts']} checkouts, avg wait {pool['avg_checkout_ms']}ms, "
+              f"{pool['open']} open, {pool['checkout_failures']} failed")
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=2))
+    if args.baseline:
+        failures = check_regressions(result, args.baseline, args.max_regression)
+        if failures:
+            print("\nRegressions:")
+            for f in failures:
+                print(f"  {f}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
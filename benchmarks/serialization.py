@@ -0,0 +1,111 @@
+"""Serialization and compression cost per response.
+
+Builds realistic payloads by driving the app in-process (synthetic
+providers, mongomock): a 15-question `/api/quiz/start` response, a
+`/api/user/stats` response with a full history, and the leaderboard. Each
+payload is then rendered the way FastAPI does by default
+(`jsonable_encoder` + `JSONResponse`) and the way FAST_JSON=on does
+(`ORJSONResponse` directly), and compressed with gzip and, if installed,
+brotli.
+
+    python benchmarks/serialization.py --iterations 2000
+    python benchmarks/serialization.py --json serialization.json
+
+Times are CPU microseconds per response (process time).
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import secrets
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT / "backend"
+
+
+async def build_payloads(games: int) -> dict:
+    """Play a few games through the API and capture the JSON it returns."""
+    import httpx
+    import server
+    from mongomock_motor import AsyncMongoMockClient
+
+    server.deps.use_mongo_client(AsyncMongoMockClient())
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async with server.app.router.lifespan_context(server.app):
+            resp = await client.post("/api/auth/guest", json={"name": "serializer"})
+            headers = {"Authorization": f"Bearer {resp.json()['token']}"}
+            start = None
+            for i in range(games):
+                mode = ("educational", "genre", "timed")[i % 3]
+                start = (await client.post("/api/quiz/start", headers=headers,
+                                           json={"mode": mode, "num_questions": 15})).json()
+                for j, q in enumerate(start["questions"]):
+                    await client.post("/api/quiz/answer", headers=headers, json={
+                        "session_id": start["session_id"], "question_index": j, "answer": q["options"][0],
+                    })
+            stats = (await client.get("/api/user/stats", headers=headers)).json()
+            leaderboard = (await client.get("/api/leaderboard")).json()
+    return {"quiz_start": start, "user_stats": stats, "leaderboard": leaderboard}
+
+
+def cpu_us(fn, iterations: int) -> float:
+    start = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - start) / iterations * 1e6
+
+
+def measure(payload, iterations: int) -> dict:
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse, ORJSONResponse
+
+    import compression
+
+    body = ORJSONResponse(payload).body
+    result = {
+        "bytes": len(body),
+        "default_us": round(cpu_us(lambda: JSONResponse(jsonable_encoder(payload)).body, iterations), 1),
+        "orjson_us": round(cpu_us(lambda: ORJSONResponse(payload).body, iterations), 1),
+        "gzip_bytes": len(gzip.compress(body, compresslevel=compression.GZIP_LEVEL)),
+        "gzip_us": round(cpu_us(lambda: compression.compress(body, "gzip"), iterations), 1),
+    }
+    result["speedup"] = round(result["default_us"] / max(result["orjson_us"], 0.01), 1)
+    if compression.brotli is not None:
+        result["br_bytes"] = len(compression.compress(body, "br"))
+        result["br_us"] = round(cpu_us(lambda: compression.compress(body, "br"), iterations), 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure JSON serialization and compression CPU per response.")
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--games", type=int, default=12, help="games played to fill the stats history")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    os.environ.setdefault("PROVIDERS", "synthetic")
+    os.environ.setdefault("PROVIDER_SEED", "1")
+    os.environ.setdefault("JWT_SECRET", secrets.token_urlsafe(32))
+    sys.path.insert(0, str(BACKEND_DIR))
+    payloads = asyncio.run(build_payloads(args.games))
+
+    report = {name: measure(payload, args.iterations) for name, payload in payloads.items()}
+    header = f"{'payload':<12} {'bytes':>7} {'default':>9} {'orjson':>8} {'speedup':>8} {'gzip':>12}"
+    print(header)
+    print("-" * len(header))
+    for name, r in report.items():
+        gz = f"{r['gzip_bytes']}B/{r['gzip_us']:.0f}us"
+        print(f"{name:<12} {r['bytes']:>7} {r['default_us']:>7.0f}us {r['orjson_us']:>6.0f}us {r['speedup']:>7}x {gz:>12}")
+        if "br_bytes" in r:
+            print(f"{'':<12} brotli: {r['br_bytes']}B in {r['br_us']:.0f}us")
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
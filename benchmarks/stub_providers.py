@@ -0,0 +1,116 @@
+"""Local stand-ins for the Spotify, Deezer and Gemini HTTP APIs.
+
+Responses are synthetic but shaped like the real APIs, and each provider
+sleeps for a configurable latency (plus optional jitter) before answering,
+so the quiz pipeline can be benchmarked without credentials or network.
+
+    python benchmarks/stub_providers.py --port 9100 --spotify-latency-ms 80 --deezer-latency-ms 40 --gemini-latency-ms 300
+
+Point the backend at it with:
+
+    SPOTIFY_API_URL=http://127.0.0.1:9100/v1/
+    SPOTIFY_ACCOUNTS_URL=http://127.0.0.1:9100/api/token
+    DEEZER_API_URL=http://127.0.0.1:9100/deezer
+    GEMINI_API_ENDPOINT=http://127.0.0.1:9100
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+
+from fastapi import FastAPI, Request
+
+ARTISTS = [
+    "Taylor Swift", "Drake", "The Weeknd", "Billie Eilish", "Ed Sheeran", "Dua Lipa",
+    "Post Malone", "Ariana Grande", "Kendrick Lamar", "Bruno Mars", "Adele", "Coldplay",
+    "Eminem", "Rihanna", "Miles Davis", "Johnny Cash", "Metallica", "B.B. King",
+]
+WORDS = ["Midnight", "Echo", "Golden", "River", "Neon", "Heart", "Summer", "Ghost", "Fire", "Blue", "Road", "Dream"]
+
+latency_ms = {"spotify": 0.0, "deezer": 0.0, "gemini": 0.0}
+jitter = 0.0
+
+
+async def simulate_latency(provider: str):
+    base = latency_ms[provider] / 1000
+    if base <= 0:
+        return
+    await asyncio.sleep(max(0.0, random.gauss(base, base * jitter)) if jitter else base)
+
+
+def synthetic_track(query: str, i: int) -> dict:
+    digest = hashlib.md5(f"{query}:{i}".encode()).hexdigest()
+    seed = int(digest[:8], 16)
+    artist = ARTISTS[seed % len(ARTISTS)]
+    return {
+        "id": digest[:22],
+        "name": f"{WORDS[seed % len(WORDS)]} {WORDS[(seed // 7) % len(WORDS)]}",
+        "artists": [{"name": artist}],
+        "album": {"name": f"{WORDS[(seed // 13) % len(WORDS)]} Sessions", "images": [{"url": f"https://example.invalid/art/{digest[:8]}.jpg"}]},
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{digest[:22]}"},
+        "popularity": seed % 100,
+    }
+
+
+app = FastAPI()
+
+
+@app.post("/api/token")
+async def spotify_token():
+    await simulate_latency("spotify")
+    return {"access_token": "stub-token", "token_type": "Bearer", "expires_in": 3600}
+
+
+@app.get("/v1/search")
+async def spotify_search(q: str, limit: int = 10, type: str = "track", market: str = "US"):
+    await simulate_latency("spotify")
+    return {"tracks": {"items": [synthetic_track(q, i) for i in range(limit)]}}
+
+
+@app.get("/deezer/search")
+async def deezer_search(q: str, limit: int = 3):
+    await simulate_latency("deezer")
+    digest = hashlib.md5(q.encode()).hexdigest()
+    # roughly one in five tracks has no preview, like the real catalog
+    if int(digest[:2], 16) < 51:
+        return {"data": []}
+    return {"data": [{"preview": f"https://cdn.example.invalid/preview/{digest[:12]}.mp3"}]}
+
+
+@app.post("/v1beta/models/{model}:generateContent")
+async def gemini_generate(model: str, request: Request):
+    await simulate_latency("gemini")
+    body = await request.json()
+    prompt = body.get("contents", [{}])[-1].get("parts", [{}])[0].get("text", "")
+    if "Return JSON" in prompt:
+        text = json.dumps({
+            "question": "Which one is it?",
+            "hint": "Listen to the rhythm section.",
+            "fun_fact": "This response came from the benchmark stub.",
+        })
+    else:
+        text = "Nice one! That was a benchmark stub response."
+    return {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": 1}]}
+
+
+def main():
+    global jitter
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Stub Spotify/Deezer/Gemini servers for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--spotify-latency-ms", type=float, default=80)
+    parser.add_argument("--deezer-latency-ms", type=float, default=40)
+    parser.add_argument("--gemini-latency-ms", type=float, default=300)
+    parser.add_argument("--jitter", type=float, default=0.2, help="latency stddev as a fraction of the mean")
+    args = parser.parse_args()
+
+    latency_ms.update(spotify=args.spotify_latency_ms, deezer=args.deezer_latency_ms, gemini=args.gemini_latency_ms)
+    jitter = args.jitter
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,41 @@ const API =
     ? "https://musicquiz-backend-q37u.onrender.com/api"
     : "http://localhost:8000/api";
 
+// one refresh at a time, shared by every request that got a 401
+let refreshing = null;
+
+// Access tokens are short-lived; the refresh token gets a new one
+// (and is itself rotated) when a request comes back 401.
+async function refreshAccessToken() {
+  const refreshToken = localStorage.getItem('quiz_refresh_token');
+  if (!refreshToken) return null;
+  if (!refreshing) {
+    refreshing = axios.post(`${API}/auth/refresh`, { refresh_token: refreshToken })
+      .then((res) => {
+        localStorage.setItem('quiz_token', res.data.token);
+        if (res.data.refresh_token) {
+          localStorage.setItem('quiz_refresh_token', res.data.refresh_token);
+        }
+        return res.data.token;
+      })
+      .catch(() => null)
+      .finally(() => { refreshing = null; });
+  }
+  return refreshing;
+}
+
+function storeTokens(data) {
+  localStorage.setItem('quiz_token', data.token);
+  if (data.refresh_token) {
+    localStorage.setItem('quiz_refresh_token', data.refresh_token);
+  }
+}
+
+function clearTokens() {
+  localStorage.removeItem('quiz_token');
+  localStorage.removeItem('quiz_refresh_token');
+}
+
 export function AuthProvider({ children }) {
   const [user, setUser] = useState(null);
   const [token, setToken] = useState(localStorage.getItem('quiz_token'));
@@ -25,8 +60,16 @@ export function AuthProvider({ children }) {
       });
       setUser(res.data);
     } catch (err) {
+      if (err.response?.status === 401) {
+        const newToken = await refreshAccessToken();
+        if (newToken) {
+          // re-runs this check with the new token
+          setToken(newToken);
+          return;
+        }
+      }
       console.error('Auth check failed:', err);
-      localStorage.removeItem('quiz_token');
+      clearTokens();
       setToken(null);
       setUser(null);
     } finally {
@@ -51,7 +94,7 @@ export function AuthProvider({ children }) {
     try {
       const res = await axios.post(`${API}/auth/spotify-callback`, { code });
       const { token: newToken, user: userData } = res.data;
-      localStorage.setItem('quiz_token', newToken);
+      storeTokens(res.data);
       setToken(newToken);
       setUser(userData);
       return true;
@@ -65,7 +108,7 @@ export function AuthProvider({ children }) {
     try {
       const res = await axios.post(`${API}/auth/guest`, { name });
       const { token: newToken, user: userData } = res.data;
-      localStorage.setItem('quiz_token', newToken);
+      storeTokens(res.data);
       setToken(newToken);
       setUser(userData);
       return true;
@@ -76,7 +119,13 @@ export function AuthProvider({ children }) {
   };
 
   const logout = () => {
-    localStorage.removeItem('quiz_token');
+    const refreshToken = localStorage.getItem('quiz_refresh_token');
+    if (refreshToken) {
+      axios.post(`${API}/auth/logout`, { refresh_token: refreshToken }, {
+        headers: token ? { Authorization: `Bearer ${token}` } : {}
+      }).catch(() => {});
+    }
+    clearTokens();
     setToken(null);
     setUser(null);
   };
@@ -85,6 +134,16 @@ export function AuthProvider({ children }) {
     baseURL: API,
     headers: token ? { Authorization: `Bearer ${token}` } : {}
   });
+  authAxios.interceptors.response.use(undefined, async (err) => {
+    const request = err.config;
+    if (err.response?.status !== 401 || request._retried) throw err;
+    const newToken = await refreshAccessToken();
+    if (!newToken) throw err;
+    setToken(newToken);
+    request._retried = true;
+    request.headers.Authorization = `Bearer ${newToken}`;
+    return axios(request);
+  });
 
   return (
     <AuthContext.Provider value={{
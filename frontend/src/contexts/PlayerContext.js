@@ -37,7 +37,12 @@ export function PlayerProvider({ children }) {
     }
 
     audio.src = track.preview_url;
-    audio.volume = 0.7;
+    // precomputed loudness gain and hook offset (catalog tracks only)
+    const gain = track.audio?.gain_db ? Math.pow(10, track.audio.gain_db / 20) : 1;
+    audio.volume = Math.min(1, 0.7 * gain);
+    if (track.audio?.hook_ms) {
+      audio.currentTime = track.audio.hook_ms / 1000;
+    }
     setCurrentTrack(track);
     setProgress(0);
 
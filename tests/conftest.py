@@ -0,0 +1,22 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# backend modules import each other as top-level modules (see server.py)
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+os.environ.setdefault("JWT_SECRET", "test-secret")
+os.environ.setdefault("PROVIDERS", "synthetic")
+
+
+@pytest.fixture
+def server():
+    """server.py on an in-memory MongoDB (no lifespan: background jobs stay off)."""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    import server as server_module
+
+    server_module.deps.use_mongo_client(mongomock_motor.AsyncMongoMockClient())
+    return server_module
@@ -0,0 +1,51 @@
+import random
+
+import pytest
+
+import adaptive
+
+
+def test_update_moves_ratings_towards_the_outcome():
+    question = {"track": {"genre": "rock"}, "options": ["a", "b", "c", "d"]}
+    won = adaptive.update(None, question, True, False)
+    assert set(won) == {"skill.overall", "skill.genre:rock"}
+    rating, seen = won["skill.overall"]
+    assert rating > adaptive.BASE_RATING and seen == 1
+    lost = adaptive.update(None, question, False, False)
+    assert lost["skill.overall"][0] < adaptive.BASE_RATING
+    hinted = adaptive.update(None, question, True, True)
+    assert lost["skill.overall"][0] < hinted["skill.overall"][0] < rating
+
+
+def test_update_steps_shrink_with_experience():
+    question = {"level": "moderate", "options": ["a", "b", "c", "d"]}
+    novice = adaptive.update({"overall": [1500.0, 0]}, question, True, False)["skill.overall"][0] - 1500
+    veteran = adaptive.update({"overall": [1500.0, 200]}, question, True, False)["skill.overall"][0] - 1500
+    assert novice > veteran > 0
+    assert set(adaptive.update(None, question, True, False)) == {"skill.overall", "skill.edu:moderate"}
+
+
+def test_target_difficulty_inverts_expected():
+    difficulty = adaptive.target_difficulty(1600, 4, 0.7)
+    assert adaptive.expected(1600, difficulty, 4) == pytest.approx(0.7, abs=1e-6)
+
+
+def bank(ratings):
+    return [{"id": i, "rating": r, "level": "easy" if r < 1400 else "difficult"} for i, r in enumerate(ratings)]
+
+
+def test_question_index_picks_the_nearest_ratings():
+    index, questions = adaptive.QuestionIndex(), bank([1000, 1300, 1510, 1520, 1800, 2100])
+    picked = index.sample(questions, 1500, 2, rng=random.Random(1))
+    assert sorted(q["rating"] for q in picked) == [1510, 1520]
+    assert [q["rating"] for q in index.sample(questions, 1500, 1, level="easy")] == [1300]
+    assert len(index.sample(questions, 1500, 10)) == 6
+    assert index.sample(questions, 1500, 2, level="moderate") == []
+
+
+def test_question_index_rebuilds_for_a_new_bank_even_at_a_reused_address():
+    index = adaptive.QuestionIndex()
+    index.sample(bank([1500]), 1500, 1)
+    # the first list is freed, so the new one may well get its id()
+    replacement = bank([2000])
+    assert [q["rating"] for q in index.sample(replacement, 1500, 1)] == [2000]
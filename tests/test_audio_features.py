@@ -0,0 +1,63 @@
+import asyncio
+import io
+import math
+import struct
+import wave
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+import audio_features
+from providers import ProviderError, RateLimitedError
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+pytest.importorskip("numpy")
+
+
+def sine_wav(seconds=2.0, rate=22050):
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b"".join(struct.pack("<h", int(8000 * math.sin(i / 20))) for i in range(int(seconds * rate))))
+    return buf.getvalue()
+
+
+AUDIO = {"ok": sine_wav(), "broken": b"RIFF not really a wav", "empty": b""}
+
+
+async def load_audio(track):
+    if track["_id"] == "limited":
+        raise RateLimitedError("429")
+    if track["_id"] == "down":
+        raise ProviderError("connection reset")
+    return AUDIO[track["_id"]]
+
+
+def test_decode_failures_are_permanent_and_transport_failures_retry():
+    async def run():
+        db = mongomock_motor.AsyncMongoMockClient()["audio_test"]
+        await db.track_catalog.insert_many(
+            [{"_id": t, "has_preview": True} for t in ("ok", "broken", "empty", "limited", "down")])
+        first = await audio_features.analyze_pending(db, load_audio)
+        # nothing is due again yet
+        second = await audio_features.analyze_pending(db, load_audio)
+        # once the backoff has passed, the deferred tracks are picked up again
+        await db.track_catalog.update_many({"audio_retry_at": {"$exists": True}}, {"$set": {"audio_retry_at": "2000-01-01"}})
+        third = await audio_features.analyze_pending(db, load_audio, retry_minutes=10)
+        docs = {d["_id"]: d async for d in db.track_catalog.find({})}
+        return first, second, third, docs
+
+    first, second, third, docs = asyncio.run(run())
+    assert first == {"analysed": 1, "failed": 2, "deferred": 2}
+    assert second == {"analysed": 0, "failed": 0, "deferred": 0}
+    assert third == {"analysed": 0, "failed": 0, "deferred": 2}
+    assert len(docs["ok"]["audio"]["waveform"]) == audio_features.WAVEFORM_POINTS
+    assert "error" in docs["broken"]["audio"] and "error" in docs["empty"]["audio"]
+    for track_id in ("limited", "down"):
+        assert "audio" not in docs[track_id]
+        assert docs[track_id]["audio_attempts"] == 2
+        # the second failure waits twice the base delay
+        wait = datetime.fromisoformat(docs[track_id]["audio_retry_at"]) - datetime.now(timezone.utc)
+        assert timedelta(minutes=19) < wait <= timedelta(minutes=20)
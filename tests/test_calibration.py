@@ -0,0 +1,75 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+import calibration
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def new_db():
+    return mongomock_motor.AsyncMongoMockClient()["calibration_test"]
+
+
+def ago(seconds):
+    return (datetime.now(timezone.utc) - timedelta(seconds=seconds)).isoformat()
+
+
+def session(session_id, completed_at, question_id="q1", is_correct=True):
+    return {"id": session_id, "mode": "educational", "completed": True, "completed_at": completed_at,
+            "answers": [{"question_id": question_id, "is_correct": is_correct, "used_hint": False, "elapsed_ms": 1000}]}
+
+
+def test_accumulate():
+    totals = {}
+    calibration.accumulate(totals, [
+        {"question_id": "q1", "is_correct": True, "used_hint": True, "elapsed_ms": 2000},
+        {"question_id": "q1", "is_correct": False, "used_hint": False},
+        {"question_id": None, "is_correct": True},
+    ])
+    assert totals == {"q1": {"attempts": 2, "correct": 1, "hinted_correct": 1, "hints": 1, "time_ms": 2000, "timed": 1}}
+
+
+def test_claim_is_a_compare_and_set():
+    async def run():
+        db = new_db()
+        start = await calibration.get_checkpoint(db)
+        first = {"completed_at": ago(60), "id": "s1"}
+        results = [await calibration.claim(db, start, first),
+                   # a concurrent run that read the same checkpoint loses
+                   await calibration.claim(db, start, {"completed_at": ago(30), "id": "s2"}),
+                   await calibration.claim(db, first, {"completed_at": ago(30), "id": "s2"})]
+        return results, await calibration.get_checkpoint(db)
+
+    results, checkpoint = asyncio.run(run())
+    assert results == [True, False, True]
+    assert checkpoint["id"] == "s2"
+
+
+def test_calibrate_counts_each_session_once():
+    async def run():
+        db = new_db()
+        await db.quiz_sessions.insert_many([session(f"s{i}", ago(1000 - i)) for i in range(5)])
+        first = await calibration.calibrate(db, batch_size=2, settle_seconds=0)
+        second = await calibration.calibrate(db, settle_seconds=0)
+        return first, second, await db.question_stats.find_one({"_id": "q1"})
+
+    first, second, stats = asyncio.run(run())
+    assert (first["sessions"], first["batches"]) == (5, 3)
+    assert second["sessions"] == 0
+    assert stats["attempts"] == 5
+
+
+def test_recent_sessions_wait_for_the_settle_lag():
+    async def run():
+        db = new_db()
+        await db.quiz_sessions.insert_one(session("s1", ago(600)))
+        await db.quiz_sessions.insert_one(session("s3", ago(10)))
+        first = await calibration.calibrate(db, settle_seconds=300)
+        # written late by another worker, with an earlier completed_at than s3
+        await db.quiz_sessions.insert_one(session("s2", ago(20)))
+        second = await calibration.calibrate(db, settle_seconds=0)
+        return first["sessions"], second["sessions"]
+
+    assert asyncio.run(run()) == (1, 2)
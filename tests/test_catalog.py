@@ -0,0 +1,83 @@
+import asyncio
+import random
+
+import pytest
+
+import catalog
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def new_db():
+    return mongomock_motor.AsyncMongoMockClient()["catalog_test"]
+
+
+def track(track_id, popularity=50, preview=True):
+    return {"id": track_id, "name": f"Song {track_id}", "artist": "Band", "artists": ["Band"],
+            "popularity": popularity, "preview_url": "https://p/x.mp3" if preview else None}
+
+
+RESULTS = {
+    "rock anthems": [track("t1"), track("t2", preview=False)],
+    "workout energy": [track("t1", popularity=70), track("t3")],
+}
+PLAN = [("rock anthems", {"genres": ["rock"]}), ("workout energy", {"moods": ["energetic"]}),
+        ("broken query", {"genres": ["jazz"]})]
+
+
+async def fetch(queries, limit):
+    [query] = queries
+    if query not in RESULTS:
+        raise RuntimeError("search failed")
+    return RESULTS[query][:limit]
+
+
+def test_crawl_deduplicates_and_merges_labels():
+    async def run():
+        db = new_db()
+        live = catalog.Catalog()
+        report = await catalog.crawl(db, fetch, PLAN, concurrency=1, catalog=live)
+        again = await catalog.crawl(db, fetch, PLAN, concurrency=1)
+        docs = {d["_id"]: d async for d in db[catalog.COLLECTION].find({})}
+        return report, again, docs, live, await catalog.Catalog.load(db)
+
+    report, again, docs, live, loaded = asyncio.run(run())
+    assert report == {"queries": 2, "failed": 1, "tracks": 4, "new": 3}
+    assert again["new"] == 0
+    assert set(docs) == {"t1", "t2", "t3"}
+    t1 = docs["t1"]
+    assert (t1["genres"], t1["moods"], t1["popularity"]) == (["rock"], ["energetic"], 70)
+    assert t1["first_seen"] <= t1["crawled_at"]
+    assert docs["t2"]["has_preview"] is False and "preview_url" not in docs["t2"]
+
+    # the catalog updated during the crawl matches one loaded from MongoDB
+    for cat in (live, loaded):
+        assert len(cat) == 3
+        assert (cat.count("genres", "rock"), cat.count("moods", "energetic")) == (2, 2)
+        assert cat.tracks["t1"]["genres"] == ["rock"] and cat.tracks["t1"]["moods"] == ["energetic"]
+
+
+def test_sample_returns_distinct_copies_for_a_label():
+    cat = catalog.Catalog([{**track(f"t{i}"), "has_preview": True, "genres": ["rock"]} for i in range(5)])
+    picked = cat.sample("genres", "rock", 3, rng=random.Random(1))
+    assert len({t["id"] for t in picked}) == 3
+    assert all(t["preview_url"] is None and "genres" not in t for t in picked)
+    picked[0]["name"] = "changed"
+    assert "changed" not in {t["name"] for t in cat.tracks.values()}
+    assert cat.sample("genres", "jazz", 3) == []
+
+
+def test_crawl_of_the_quiz_queries_through_the_server_pipeline(server):
+    async def run():
+        db = new_db()
+        live = catalog.Catalog()
+        plan = server.catalog_plan()
+        report = await catalog.crawl(db, server.fetch_spotify_tracks, plan[:4], limit_per_query=5, catalog=live)
+        return plan, report, live, await db[catalog.COLLECTION].count_documents({})
+
+    plan, report, live, stored = asyncio.run(run())
+    assert {field for _, labels in plan for field in labels} <= set(catalog.LABEL_FIELDS)
+    assert report["queries"] == 4 and report["failed"] == 0
+    assert stored == len(live) == report["new"] > 0
+    labelled = {label for field in catalog.LABEL_FIELDS for label in live.by_label[field]}
+    assert labelled == {label for _, labels in plan[:4] for values in labels.values() for label in values}
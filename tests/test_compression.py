@@ -0,0 +1,63 @@
+import asyncio
+import gzip
+
+import pytest
+
+import compression
+
+
+def respond(body: bytes, content_type: bytes = b"application/json", more_body: bool = False):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body, "more_body": more_body})
+        if more_body:
+            await send({"type": "http.response.body", "body": b""})
+    return app
+
+
+def call(app, accept_encoding=None, minimum_size=10):
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    headers = [(b"accept-encoding", accept_encoding.encode())] if accept_encoding is not None else []
+    asyncio.run(compression.CompressionMiddleware(app, minimum_size)({"type": "http", "headers": headers}, None, send))
+    return dict(sent[0]["headers"]), sent[1]["body"]
+
+
+def test_choose_encoding(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", object())
+    assert compression.choose_encoding("gzip, deflate, br;q=0.9") == "br"
+    monkeypatch.setattr(compression, "brotli", None)
+    assert compression.choose_encoding("gzip, deflate, br") == "gzip"
+    assert compression.choose_encoding("identity") is None
+
+
+def test_large_json_is_gzipped_with_fixed_headers():
+    body = b'{"x": "' + b"a" * 100 + b'"}'
+    headers, sent = call(respond(body), "gzip")
+    assert headers[b"content-encoding"] == b"gzip"
+    assert headers[b"vary"] == b"Accept-Encoding"
+    assert headers[b"content-length"] == str(len(sent)).encode()
+    assert gzip.decompress(sent) == body
+
+
+def test_small_streamed_binary_or_unaccepted_bodies_pass_through():
+    body = b"a" * 100
+    for app, accept in [(respond(b"{}"), "gzip"),
+                        (respond(body, more_body=True), "gzip"),
+                        (respond(body, b"audio/mpeg"), "gzip"),
+                        (respond(body), None)]:
+        headers, sent = call(app, accept)
+        assert b"content-encoding" not in headers
+        assert sent in (body, b"{}")
+
+
+def test_brotli_is_preferred_when_installed():
+    brotli = pytest.importorskip("brotli")
+    body = b'{"x": "' + b"a" * 100 + b'"}'
+    headers, sent = call(respond(body), "gzip, br")
+    assert headers[b"content-encoding"] == b"br"
+    assert brotli.decompress(sent) == body
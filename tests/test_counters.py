@@ -0,0 +1,138 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+import counters
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def new_db():
+    return mongomock_motor.AsyncMongoMockClient()["counters_test"]
+
+
+async def user(db, user_id="u1"):
+    return await db.users.find_one({"id": user_id}, {"_id": 0})
+
+
+def test_answer_deltas():
+    question = {"track": {"genre": "rock"}}
+    assert counters.answer_deltas(question, True, 10, True) == {
+        "total_questions": 1, "total_correct": 1, "total_score": 10,
+        "genre_accuracy.rock.total": 1, "genre_accuracy.rock.correct": 1, "total_games": 1,
+    }
+    assert counters.answer_deltas({}, False, 0, False) == {"total_questions": 1}
+
+
+def test_merge_nests_dotted_keys_without_touching_the_original():
+    doc = {"id": "u1", "total_score": 5, "genre_accuracy": {"rock": {"total": 2, "correct": 1}}}
+    merged = counters.merge(doc, {"total_score": 3, "genre_accuracy.rock.total": 1, "genre_accuracy.jazz.total": 1},
+                            {"streak": 4, "skill.overall": [1210.0, 3]})
+    assert merged["total_score"] == 8
+    assert merged["genre_accuracy"] == {"rock": {"total": 3, "correct": 1}, "jazz": {"total": 1}}
+    assert merged["streak"] == 4
+    assert merged["skill"] == {"overall": [1210.0, 3]}
+    assert doc["genre_accuracy"]["rock"]["total"] == 2
+    assert counters.merge(doc, {}) is doc
+
+
+def test_read_segment_sums_deltas_keeps_last_sets_and_skips_torn_lines(tmp_path):
+    path = tmp_path / "w.000001.journal"
+    path.write_text("\n".join([
+        json.dumps({"u": "u1", "d": {"total_questions": 1}, "s": {"streak": 1}}),
+        json.dumps({"u": "u1", "d": {"total_questions": 1, "total_score": 5}, "s": {"streak": 2}}),
+        json.dumps({"u": "u2", "d": {"total_questions": 1}}),
+        '{"u": "u2", "d": {"total_q',
+    ]))
+    batch, sets = counters.read_segment(path)
+    assert batch == {"u1": {"total_questions": 2, "total_score": 5}, "u2": {"total_questions": 1}}
+    assert sets == {"u1": {"streak": 2}}
+
+
+def test_apply_with_a_batch_id_is_idempotent():
+    async def run():
+        db = new_db()
+        await db.users.insert_one({"id": "u1", "total_score": 0})
+        for _ in range(2):
+            await counters.apply(db, {"u1": {"total_score": 5}}, "w-1", {"u1": {"streak": 3}})
+        await counters.apply(db, {"u1": {"total_score": 1}}, "w-2")
+        return await user(db)
+
+    doc = asyncio.run(run())
+    assert doc["total_score"] == 6
+    assert doc["streak"] == 3
+    assert doc["counter_batches"] == ["w-1", "w-2"]
+
+
+def test_flush_writes_one_update_per_user_and_reports_it(tmp_path):
+    async def run():
+        db = new_db()
+        await db.users.insert_one({"id": "u1", "total_score": 0, "streak": 0})
+        flushed = []
+
+        async def on_flush(user_ids):
+            flushed.extend(user_ids)
+
+        stats = counters.StatCounters(lambda: db, tmp_path, flush_ms=60000, on_flush=on_flush)
+        await stats.start()
+        await stats.record("u1", {"total_score": 5}, {"streak": 1})
+        await stats.record("u1", {"total_score": 5}, {"streak": 2})
+        assert stats.pending_for("u1") == {"total_score": 10}
+        assert stats.pending_sets_for("u1") == {"streak": 2}
+        assert (await user(db))["total_score"] == 0
+        await stats.flush()
+        doc = await user(db)
+        await stats.stop()
+        return doc, flushed
+
+    doc, flushed = asyncio.run(run())
+    assert (doc["total_score"], doc["streak"]) == (10, 2)
+    assert flushed == ["u1"]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_load_state_reads_once_and_follows_recorded_sets(tmp_path):
+    async def run():
+        db = new_db()
+        stats = counters.StatCounters(lambda: db, tmp_path, flush_ms=60000)
+        loads = []
+
+        async def load():
+            loads.append(1)
+            return {"streak": 4, "best_streak": 9}
+
+        await stats.start()
+        state = await stats.load_state("u1", load)
+        await stats.record("u1", {"total_questions": 1}, {"streak": state["streak"] + 1})
+        state = await stats.load_state("u1", load)
+        await stats.stop()
+        return state, len(loads)
+
+    state, loads = asyncio.run(run())
+    assert state == {"streak": 5, "best_streak": 9}
+    assert loads == 1
+
+
+def test_orphaned_journal_is_replayed_once(tmp_path):
+    async def run():
+        db = new_db()
+        await db.users.insert_one({"id": "u1", "total_score": 0})
+        crashed = counters.StatCounters(lambda: db, tmp_path, flush_ms=60000)
+        await crashed.start()
+        await crashed.record("u1", {"total_score": 5}, {"streak": 1})
+        # the batch lands, then the worker dies before deleting its segment
+        await counters.apply(db, crashed.pending, f"{crashed.worker}-{crashed.seq}", crashed.pending_sets)
+        crashed._task.cancel()
+        crashed._io.shutdown()
+        os.close(crashed._lock_fd)
+
+        survivor = counters.StatCounters(lambda: db, tmp_path, flush_ms=60000)
+        await survivor.start()
+        await survivor.stop()
+        return await user(db)
+
+    doc = asyncio.run(run())
+    assert (doc["total_score"], doc["streak"]) == (5, 1)
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,68 @@
+import importlib
+
+import pytest
+from pymongo import WriteConcern
+from pymongo.read_preferences import Primary, Secondary, SecondaryPreferred
+
+import database
+
+ENV = ("MONGO_READ_REPLICAS", "MONGO_MAX_STALENESS_SECONDS", "MONGO_MAX_POOL_SIZE", "MONGO_MIN_POOL_SIZE",
+       "MONGO_WAIT_QUEUE_TIMEOUT_MS", "MONGO_TLS_ALLOW_INVALID_CERTS")
+CLASSES = ("default", "critical", "reporting", "telemetry")
+
+
+@pytest.fixture
+def configure(monkeypatch):
+    """Reload database.py with the given environment (its defaults are read at import)."""
+    def reload(**env):
+        for name in ENV + tuple(f"MONGO_{kind}_{c.upper()}" for kind in ("READ_PREFERENCE", "WRITE_CONCERN") for c in CLASSES):
+            monkeypatch.delenv(name, raising=False)
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        return importlib.reload(database)
+
+    yield reload
+    monkeypatch.undo()
+    importlib.reload(database)
+
+
+def test_operation_classes_by_default(configure):
+    db = configure()
+    assert db.class_options("default") == {}
+    assert db.class_options("critical") == {"write_concern": WriteConcern(w="majority", j=True)}
+    # without MONGO_READ_REPLICAS, reporting reads the primary like everything else
+    assert db.class_options("reporting") == {}
+    assert db.class_options("telemetry") == {"write_concern": WriteConcern(w=1)}
+
+
+def test_reporting_reads_bounded_stale_secondaries(configure):
+    db = configure(MONGO_READ_REPLICAS="on", MONGO_MAX_STALENESS_SECONDS="120")
+    read = db.class_options("reporting")["read_preference"]
+    assert isinstance(read, SecondaryPreferred) and read.max_staleness == 120
+    for op_class in ("default", "critical", "telemetry"):
+        assert "read_preference" not in db.class_options(op_class)
+
+
+def test_environment_overrides_per_class(configure):
+    db = configure(MONGO_READ_PREFERENCE_DEFAULT="secondary", MONGO_WRITE_CONCERN_DEFAULT="2:j",
+                   MONGO_READ_PREFERENCE_REPORTING="primary", MONGO_MAX_STALENESS_SECONDS="0")
+    options = db.class_options("default")
+    assert isinstance(options["read_preference"], Secondary)
+    assert options["read_preference"].max_staleness == -1
+    assert options["write_concern"] == WriteConcern(w=2, j=True)
+    assert isinstance(db.class_options("reporting")["read_preference"], Primary)
+    with pytest.raises(KeyError):
+        db.parse_read_preference("fastest")
+
+
+def test_client_options(configure):
+    db = configure(MONGO_MAX_POOL_SIZE="50", MONGO_MIN_POOL_SIZE="5", MONGO_WAIT_QUEUE_TIMEOUT_MS="2000")
+    assert db.client_options("mongodb://localhost:27017") == {
+        "maxPoolSize": 50, "minPoolSize": 5, "waitQueueTimeoutMS": 2000}
+    assert db.max_pool_size() == 50
+    srv = db.client_options("mongodb+srv://cluster.example.net")
+    assert srv["tls"] is True and "tlsAllowInvalidCertificates" not in srv
+
+    db = configure(MONGO_TLS_ALLOW_INVALID_CERTS="true")
+    assert db.client_options("mongodb+srv://cluster.example.net") == {"tls": True, "tlsAllowInvalidCertificates": True}
+    assert db.max_pool_size() == 100
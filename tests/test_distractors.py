@@ -0,0 +1,51 @@
+import random
+
+import distractors
+
+GENRES = ["Pop", "Rock", "Hip Hop", "Jazz", "Classical", "Metal", "Punk", "Blues", "Folk", "Country"]
+
+
+def test_pool_add_is_idempotent_and_draws_are_distinct():
+    pool = distractors.Pool(f"a{i}" for i in range(100))
+    pool.add("a5")
+    assert len(pool) == 100 and "a5" in pool
+    drawn = pool.draw(10, lambda x: x == "a0", random.Random(1))
+    assert len(drawn) == len(set(drawn)) == 10
+    assert "a0" not in drawn
+    assert distractors.Pool(["x", "y"]).draw(5, lambda x: x == "x", random.Random(1)) == ["y"]
+
+
+def test_genre_neighbours_are_symmetric():
+    engine = distractors.DistractorEngine(GENRES)
+    assert "rock" in engine.neighbours["metal"] and "metal" in engine.neighbours["rock"]
+
+
+def test_genre_options_exclude_the_answer_and_follow_similarity():
+    engine = distractors.DistractorEngine(GENRES, rng=random.Random(3))
+    for _ in range(50):
+        near = engine.genre_options("Rock", 3, similarity=1.0)
+        assert len(near) == len(set(near)) == 3
+        assert "rock" not in near
+        assert all(g in engine.neighbours["rock"] for g in near)
+    far = engine.genre_options("Rock", 3, similarity=0.0)
+    assert all(g in engine.genres for g in far) and "rock" not in far
+
+
+def test_artist_options_prefer_the_genre_and_skip_collaborations():
+    engine = distractors.DistractorEngine(GENRES, rng=random.Random(7))
+    engine.observe([{"artist": f"Rocker {i}", "genre": "rock"} for i in range(5)]
+                   + [{"artist": f"Crooner {i}", "genre": "jazz"} for i in range(40)]
+                   + [{"artist": "Rocker 0 & Friends", "artists": ["Rocker 0", "Friends"], "genre": "rock"}])
+    track = {"artist": "Rocker 0", "genre": "rock"}
+    for _ in range(50):
+        options = engine.artist_options(track, 3, similarity=1.0)
+        assert len(options) == len(set(options)) == 3
+        assert all(o.startswith("Rocker") and "Rocker 0" not in o for o in options)
+
+
+def test_unlabelled_tracks_do_not_teach_genres_and_the_pool_is_bounded():
+    engine = distractors.DistractorEngine(GENRES, max_artists=3)
+    engine.observe([{"artist": "Moody", "genre": "pop"}], genre_labels=False)
+    assert "Moody" in engine.artists and "Moody" not in engine.artist_genre
+    engine.observe([{"artist": f"A{i}", "genre": "pop"} for i in range(5)])
+    assert len(engine.artists) == 3
@@ -0,0 +1,79 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+import events
+
+
+def event(seconds, user):
+    ts = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) + timedelta(seconds=seconds)
+    return {"ts": ts.isoformat(), "user_id": user}
+
+
+def test_ndjson_workers_write_separate_files_and_export_in_time_order(tmp_path):
+    first, second = events.NDJSONSink(tmp_path), events.NDJSONSink(tmp_path)
+
+    async def run():
+        await first.write([event(1, "a"), event(4, "a")])
+        await second.write([event(2, "b"), event(3, "b")])
+
+    asyncio.run(run())
+    assert len(list(tmp_path.glob("answers-*.ndjson"))) == 2
+    exported = list(events.iter_ndjson(tmp_path, None, None))
+    assert [e["user_id"] for e in exported] == ["a", "b", "b", "a"]
+
+
+class SlowSink(events.EventSink):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.stored = []
+        self.writing = None
+
+    async def write(self, batch):
+        self.writing.set()
+        await asyncio.sleep(0.05)
+        self.stored.extend(e["user_id"] for e in batch)
+
+
+def test_stop_waits_for_the_in_flight_batch_and_writes_each_event_once():
+    async def run():
+        sink = SlowSink(flush_ms=60000, batch_size=3)
+        sink.writing = asyncio.Event()
+        sink.start()
+        for i in range(3):
+            sink.emit(event(i, f"u{i}"))
+        await sink.writing.wait()
+        # arrives while the background batch is being written
+        sink.emit(event(3, "u3"))
+        await sink.stop()
+        await asyncio.sleep(0.1)
+        return sink
+
+    sink = asyncio.run(run())
+    assert sink.stored == ["u0", "u1", "u2", "u3"]
+    assert sink.buffer == [] and sink.written == 4
+
+
+def test_failed_writes_are_retried_in_order():
+    class Flaky(events.EventSink):
+        def __init__(self):
+            super().__init__(batch_size=2)
+            self.stored, self.fail = [], True
+
+        async def write(self, batch):
+            if self.fail:
+                self.fail = False
+                raise OSError("disk full")
+            self.stored.extend(e["user_id"] for e in batch)
+
+    async def run():
+        sink = Flaky()
+        for i in range(3):
+            sink.emit(event(i, f"u{i}"))
+        try:
+            await sink.flush()
+        except OSError:
+            pass
+        await sink.stop()
+        return sink.stored
+
+    assert asyncio.run(run()) == ["u0", "u1", "u2"]
@@ -0,0 +1,65 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+import guests
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+PROJECTION = {"_id": 0}
+
+
+@pytest.mark.parametrize("name, key", [
+    ("Ann", "ann"),
+    ("  ANN  ", "ann"),
+    ("Ann \t Lee", "ann lee"),
+    ("Ａｎｎ", "ann"),
+    ("Straße", "strasse"),
+])
+def test_normalize_name(name, key):
+    assert guests.normalize_name(name) == key
+
+
+def new_db():
+    return mongomock_motor.AsyncMongoMockClient()["guests_test"]
+
+
+def test_login_reuses_one_account_per_normalized_name():
+    async def run():
+        db = new_db()
+        await guests.ensure_indexes(db)
+        directory = guests.GuestDirectory(lambda: db, PROJECTION)
+        first = await directory.login("Ann")
+        # a second worker with a cold cache
+        other = await guests.GuestDirectory(lambda: db, PROJECTION).login("  ann ")
+        cached = await directory.login("ANN")
+        return first, other, cached, await db.users.count_documents({})
+
+    first, other, cached, count = asyncio.run(run())
+    assert first["id"] == other["id"] == cached["id"]
+    assert first["display_name"] == "Ann" and first["guest"] is True
+    assert count == 1
+
+
+def test_cleanup_removes_idle_guests_without_games():
+    old = (datetime.now(timezone.utc) - timedelta(days=60)).isoformat()
+
+    async def run():
+        db = new_db()
+        directory = guests.GuestDirectory(lambda: db, PROJECTION)
+        idle = await directory.login("Idle")
+        player = await directory.login("Player")
+        await db.users.update_many({}, {"$set": {"last_login": old}})
+        await db.users.update_one({"id": player["id"]}, {"$set": {"total_games": 3}})
+        await directory.login("Fresh")
+        dry = await guests.cleanup(db, dry_run=True)
+        report = await guests.cleanup(db, directory=directory)
+        ids = {d["id"] for d in await db.users.find({}, {"id": 1}).to_list(None)}
+        return idle, player, dry, report, ids, directory
+
+    idle, player, dry, report, ids, directory = asyncio.run(run())
+    assert dry == {"dry_run": True, "stale": 1}
+    assert report == {"dry_run": False, "deleted": 1}
+    assert idle["id"] not in ids and player["id"] in ids and len(ids) == 2
+    assert directory.ids.get_sync("idle") is None
@@ -0,0 +1,71 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+import lifecycle
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def test_reap_and_compact_report_the_users_of_each_batch():
+    old = (datetime.now(timezone.utc) - timedelta(days=2)).isoformat()
+    recent = datetime.now(timezone.utc).isoformat()
+
+    async def run():
+        db = mongomock_motor.AsyncMongoMockClient()["lifecycle_test"]
+        await db.quiz_sessions.insert_many([
+            {"id": "s1", "user_id": "u1", "completed": False, "started_at": old, "questions": [1]},
+            {"id": "s2", "user_id": "u2", "completed": True, "started_at": old, "questions": [1], "answers": []},
+            {"id": "s3", "user_id": "u3", "completed": False, "started_at": recent},
+        ])
+        changed = []
+
+        async def on_change(user_ids):
+            changed.append(user_ids)
+
+        report = await lifecycle.run_lifecycle(db, archive="none", on_change=on_change)
+        again = await lifecycle.run_lifecycle(db, archive="none", on_change=on_change)
+        compacted = await db.quiz_sessions.find_one({"id": "s2"}, {"_id": 0})
+        return report, again, changed, compacted
+
+    report, again, changed, compacted = asyncio.run(run())
+    assert (report["abandoned_reaped"], report["completed_compacted"]) == (1, 1)
+    assert (again["abandoned_reaped"], again["completed_compacted"]) == (0, 0)
+    assert changed == [{"u1"}, {"u2"}]
+    assert "questions" not in compacted and compacted["compacted"] is True
+
+
+def test_a_session_completed_during_the_reap_stays_live_and_unarchived(monkeypatch):
+    old = (datetime.now(timezone.utc) - timedelta(days=2)).isoformat()
+
+    async def run():
+        db = mongomock_motor.AsyncMongoMockClient()["lifecycle_race"]
+        await db.quiz_sessions.insert_many([
+            {"id": "s1", "user_id": "u1", "completed": False, "started_at": old},
+            {"id": "s2", "user_id": "u2", "completed": False, "started_at": old},
+        ])
+        collection = type(db.quiz_sessions)
+        delete = collection.find_one_and_delete
+
+        async def finish_s2_first(self, query, *args, **kwargs):
+            if query.get("id") == "s2":
+                # the player's last answer lands between the find and the delete
+                await db.quiz_sessions.update_one({"id": "s2"}, {"$set": {"completed": True}})
+            return await delete(self, query, *args, **kwargs)
+
+        monkeypatch.setattr(collection, "find_one_and_delete", finish_s2_first)
+        changed = []
+
+        async def on_change(user_ids):
+            changed.append(user_ids)
+
+        reaped = await lifecycle.reap_abandoned_sessions(db, lifecycle.Archiver(db, "collection"), on_change=on_change)
+        live = [d["id"] async for d in db.quiz_sessions.find({})]
+        archived = [d["id"] async for d in db[lifecycle.ARCHIVE_COLLECTION].find({})]
+        return reaped, live, archived, changed
+
+    reaped, live, archived, changed = asyncio.run(run())
+    assert reaped == 1
+    assert live == ["s2"] and archived == ["s1"]
+    assert changed == [{"u1"}]
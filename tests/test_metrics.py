@@ -0,0 +1,20 @@
+import metrics
+
+
+def stage_count(name):
+    child = metrics.QUIZ_START_STAGES.children.get((name,))
+    return sum(child.counts) if child else 0
+
+
+def test_stages_are_recorded_only_inside_track_stages():
+    with metrics.stage("test_untracked"):
+        pass
+    assert stage_count("test_untracked") == 0
+
+    with metrics.track_stages():
+        with metrics.stage("test_tracked"):
+            pass
+        with metrics.stage("test_tracked"):
+            pass
+    # summed per request, observed once
+    assert stage_count("test_tracked") == 1
@@ -0,0 +1,164 @@
+import asyncio
+import json
+
+import pytest
+
+import multiplayer
+
+
+def test_rooms_refuse_several_workers():
+    multiplayer.check_workers(1, enabled=True)
+    multiplayer.check_workers(4, enabled=False)
+    with pytest.raises(RuntimeError):
+        multiplayer.check_workers(2, enabled=True)
+
+
+def test_disabled_rooms_return_503():
+    manager = multiplayer.RoomManager(multiplayer.InMemoryPubSub(), score_fn=lambda *a: 0, enabled=False)
+    with pytest.raises(multiplayer.RoomError) as e:
+        manager.create({"id": "u1"}, "genre", "easy", "hybrid", [], [], 20)
+    assert e.value.status_code == 503
+    with pytest.raises(multiplayer.RoomError) as e:
+        manager.get("ABC123")
+    assert e.value.status_code == 503
+
+
+def test_unknown_pubsub_backend_is_an_error():
+    with pytest.raises(ValueError):
+        multiplayer.create_pubsub("redis")
+
+
+QUESTIONS = [{"question": f"Q{i}?", "correct_answer": "a", "fun_fact": f"fact {i}"} for i in range(2)]
+SAFE = [{"question": q["question"], "options": ["a", "b"]} for q in QUESTIONS]
+HOST, GUEST = {"id": "host", "display_name": "Host"}, {"id": "guest", "display_name": "Guest"}
+
+
+def new_manager(stats=None):
+    async def on_answer(user_id, question, is_correct, points, is_last):
+        stats.append((user_id, question["question"], is_correct, points, is_last))
+
+    def score(room, question, is_correct, used_hint):
+        return (10 if is_correct else 0) // (2 if used_hint else 1)
+
+    return multiplayer.RoomManager(multiplayer.InMemoryPubSub(), score, on_answer if stats is not None else None,
+                                   enabled=True)
+
+
+def drain(subscription):
+    messages = []
+    while not subscription.queue.empty():
+        messages.append(json.loads(subscription.queue.get_nowait()))
+    return messages
+
+
+def test_room_flow_scores_answers_and_broadcasts_each_step():
+    stats = []
+
+    async def run():
+        manager = new_manager(stats)
+        room = manager.create(HOST, "genre", "easy", "hybrid", QUESTIONS, SAFE, 5)
+        sub = manager.subscribe(room.code.lower())
+        await manager.join(room.code, GUEST)
+        await manager.join(room.code, GUEST)
+        with pytest.raises(multiplayer.RoomError) as e:
+            await manager.start(room.code, GUEST["id"])
+        assert e.value.status_code == 403
+        await manager.start(room.code, HOST["id"])
+        with pytest.raises(multiplayer.RoomError):
+            await manager.join(room.code, {"id": "late"})
+
+        assert (await manager.answer(room.code, "host", 0, " A ", False))["points"] == 10
+        with pytest.raises(multiplayer.RoomError, match="already answered"):
+            await manager.answer(room.code, "host", 0, "a", False)
+        with pytest.raises(multiplayer.RoomError, match="not open"):
+            await manager.answer(room.code, "guest", 1, "a", False)
+        with pytest.raises(multiplayer.RoomError) as e:
+            await manager.answer(room.code, "stranger", 0, "a", False)
+        assert e.value.status_code == 403
+        # the last player to answer closes the question and opens the next
+        await manager.answer(room.code, "guest", 0, "b", False)
+        assert room.current_index == 1
+        await manager.answer(room.code, "guest", 1, "a", True)
+        result = await manager.answer(room.code, "host", 1, "a", False)
+        assert result == {"is_correct": True, "points": 10, "total_score": 20, "question_index": 1}
+        return room, drain(sub)
+
+    room, messages = asyncio.run(run())
+    assert room.state == "finished"
+    assert [m["event"] for m in messages] == [
+        "player_joined", "question", "answer", "answer", "question_result", "question",
+        "answer", "answer", "question_result", "finished"]
+    assert messages[1]["question"] == SAFE[0] and "correct_answer" not in messages[1]["question"]
+    assert messages[4]["correct_answer"] == "a" and messages[4]["fun_fact"] == "fact 0"
+    assert [(e["user_id"], e["score"], e["correct"]) for e in messages[-1]["scoreboard"]] == [
+        ("host", 20, 2), ("guest", 5, 1)]
+    assert stats == [
+        ("host", "Q0?", True, 10, False), ("guest", "Q0?", False, 0, False),
+        ("guest", "Q1?", True, 5, True), ("host", "Q1?", True, 10, True)]
+
+
+def test_unanswered_questions_time_out_and_finished_rooms_expire(monkeypatch):
+    monkeypatch.setattr(multiplayer, "ROOM_TTL_SECONDS", 0.05)
+
+    async def run():
+        manager = new_manager()
+        room = manager.create(HOST, "genre", "easy", "hybrid", QUESTIONS, SAFE, 0.05)
+        await manager.join(room.code, GUEST)
+        sub = manager.subscribe(room.code)
+        await manager.start(room.code, HOST["id"])
+        await manager.answer(room.code, "host", 0, "a", False)
+        await asyncio.sleep(0.08)
+        # the guest never answered; the timer moved the room on
+        assert room.current_index == 1 and room.state == "question"
+        with pytest.raises(multiplayer.RoomError, match="not open"):
+            await manager.answer(room.code, "guest", 0, "a", False)
+        await asyncio.sleep(0.08)
+        assert room.state == "finished"
+        events = [m["event"] for m in drain(sub)]
+        await asyncio.sleep(0.08)
+        with pytest.raises(multiplayer.RoomError) as e:
+            manager.get(room.code)
+        return events, e.value.status_code
+
+    events, status = asyncio.run(run())
+    assert events == ["question", "answer", "question_result", "question", "question_result", "finished"]
+    assert status == 404
+
+
+def test_slow_subscribers_drop_the_oldest_messages():
+    async def run():
+        pubsub = multiplayer.InMemoryPubSub()
+        sub = pubsub.subscribe("room:X")
+        for i in range(multiplayer.SUBSCRIBER_QUEUE_SIZE + 3):
+            await pubsub.publish("room:X", str(i))
+        first = await sub.get()
+        sub.close()
+        return first, pubsub.channels
+
+    first, channels = asyncio.run(run())
+    assert first == "3"
+    assert channels == {}
+
+
+@pytest.mark.parametrize("env, workers", [
+    ({}, 1),
+    ({"ROOMS": "off"}, 8),
+    ({"ROOMS": "off", "WEB_CONCURRENCY": "3"}, 3),
+    ({"WEB_CONCURRENCY": "3"}, RuntimeError),
+])
+def test_gunicorn_worker_defaults(monkeypatch, env, workers):
+    import multiprocessing
+    import runpy
+    from pathlib import Path
+
+    monkeypatch.setattr(multiprocessing, "cpu_count", lambda: 8)
+    for name in ("ROOMS", "WEB_CONCURRENCY"):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    config = Path(multiplayer.__file__).with_name("gunicorn.conf.py")
+    if workers is RuntimeError:
+        with pytest.raises(RuntimeError):
+            runpy.run_path(str(config))
+    else:
+        assert runpy.run_path(str(config))["workers"] == workers
@@ -0,0 +1,119 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+import preview_proxy
+from providers import PreviewExpiredError
+
+AUDIO = bytes(range(100))
+
+
+@pytest.fixture
+def preview(tmp_path):
+    path = tmp_path / "blob.mp3"
+    path.write_bytes(AUDIO)
+    return path
+
+
+def respond(path, range_header):
+    return asyncio.run(preview_proxy.file_response(path, range_header))
+
+
+@pytest.mark.parametrize("header, content_range, body", [
+    ("bytes=0-9", "bytes 0-9/100", AUDIO[:10]),
+    ("bytes=90-", "bytes 90-99/100", AUDIO[90:]),
+    ("bytes=95-200", "bytes 95-99/100", AUDIO[95:]),
+    ("bytes=-5", "bytes 95-99/100", AUDIO[95:]),
+    ("bytes=-500", "bytes 0-99/100", AUDIO),
+])
+def test_satisfiable_ranges_get_a_206_slice(preview, header, content_range, body):
+    response = respond(preview, header)
+    assert response.status_code == 206
+    assert response.headers["content-range"] == content_range
+    assert response.body == body
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=10-5", "bytes=-0"])
+def test_unsatisfiable_ranges_get_a_416(preview, header):
+    response = respond(preview, header)
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */100"
+
+
+@pytest.mark.parametrize("header", [None, "bytes=-", "bytes=0-1,5-6", "items=0-1"])
+def test_other_requests_get_the_whole_file(preview, header):
+    response = respond(preview, header)
+    assert response.status_code == 200
+    assert response.headers["accept-ranges"] == "bytes"
+
+
+def test_store_deduplicates_and_evicts_least_recently_used(tmp_path):
+    store = preview_proxy.PreviewStore(tmp_path, max_bytes=250)
+    first = store.store("a", b"1" * 100)
+    assert store.store("b", b"1" * 100) == first
+    os.utime(first, (1, 1))
+    store.store("c", b"2" * 100)
+    assert store.lookup("a") is not None
+    store.store("d", b"3" * 100)
+    # "c" was the oldest blob once "a" was looked up again
+    assert store.lookup("c") is None
+    assert store.lookup("a") is not None and store.lookup("d") is not None
+
+
+def test_expired_upstream_urls_are_resolved_again(tmp_path):
+    resolved, fetched = [], []
+
+    async def resolve(track_id, refresh):
+        resolved.append(refresh)
+        return "fresh" if refresh else "stale"
+
+    async def fetch_audio(url):
+        fetched.append(url)
+        await asyncio.sleep(0.01)
+        if url == "stale":
+            raise PreviewExpiredError(url)
+        return AUDIO
+
+    async def run():
+        proxy = preview_proxy.PreviewProxy(preview_proxy.PreviewStore(tmp_path), resolve, fetch_audio)
+        misses = await asyncio.gather(proxy.get("t1"), proxy.get("t1"))
+        return misses, await proxy.get("t1"), await proxy.get("../etc")
+
+    misses, hit, invalid = asyncio.run(run())
+    assert misses[0] == misses[1] and misses[0][1] is False
+    assert hit == (misses[0][0], True)
+    assert invalid == (None, False)
+    assert (resolved, fetched) == ([False, True], ["stale", "fresh"])
+    assert misses[0][0].read_bytes() == AUDIO
+
+
+@pytest.mark.parametrize("header", [None, "bytes=0-9"])
+def test_a_blob_evicted_before_the_response_is_fetched_again(tmp_path, monkeypatch, header):
+    downloads = []
+
+    async def resolve(track_id, refresh):
+        return "url"
+
+    async def fetch_audio(url):
+        downloads.append(url)
+        return AUDIO
+
+    store = preview_proxy.PreviewStore(tmp_path)
+    proxy = preview_proxy.PreviewProxy(store, resolve, fetch_audio)
+    asyncio.run(proxy.get("t1"))
+    lookup = store.lookup
+
+    def lookup_then_evict(track_id):
+        path = lookup(track_id)
+        if path is not None and len(downloads) == 1:
+            # another worker's evict() runs right after our lookup
+            path.unlink()
+        return path
+
+    monkeypatch.setattr(store, "lookup", lookup_then_evict)
+    response = asyncio.run(proxy.respond("t1", header))
+    assert response.status_code == (206 if header else 200)
+    assert len(downloads) == 2
+    assert store.blob_path(hashlib.sha256(AUDIO).hexdigest()).read_bytes() == AUDIO
@@ -0,0 +1,43 @@
+import asyncio
+import json
+
+import providers
+
+
+class Inner(providers.MusicProvider):
+    def __init__(self):
+        self.calls = 0
+
+    async def search_tracks(self, query, limit):
+        self.calls += 1
+        return [{"name": query, "n": self.calls}]
+
+
+def test_recording_buffers_until_the_flush_interval(tmp_path):
+    path = tmp_path / "spotify.json"
+
+    async def run():
+        cassette = providers.Cassette(path, flush_seconds=0.05)
+        recorder = providers.RecordingMusicProvider(Inner(), cassette)
+        await recorder.search_tracks("a", 1)
+        await recorder.search_tracks("b", 1)
+        written_early = path.exists()
+        await asyncio.sleep(0.2)
+        return written_early
+
+    assert asyncio.run(run()) is False
+    assert len(json.loads(path.read_text())) == 2
+
+
+def test_close_saves_pending_entries_and_replay_reads_them(tmp_path):
+    path = tmp_path / "spotify.json"
+
+    async def run():
+        cassette = providers.Cassette(path, flush_seconds=60)
+        await providers.RecordingMusicProvider(Inner(), cassette).search_tracks("a", 1)
+        await cassette.close()
+        replay = providers.RecordingMusicProvider(None, providers.Cassette(path), replay_only=True)
+        return await replay.search_tracks("a", 1)
+
+    assert asyncio.run(run()) == [{"name": "a", "n": 1}]
+    assert [p.name for p in tmp_path.iterdir()] == ["spotify.json"]
@@ -0,0 +1,65 @@
+import asyncio
+import json
+
+import pytest
+from pymongo.read_preferences import SecondaryPreferred
+
+import container
+import database
+
+
+@pytest.fixture
+def replica(server, monkeypatch):
+    """A reporting handle on a separate in-memory database: a secondary that lags."""
+    import mongomock_motor
+
+    secondary = mongomock_motor.AsyncMongoMockClient()["replica"]
+    monkeypatch.setattr(server.deps, "_class_dbs", {"reporting": secondary})
+    return secondary
+
+
+def test_reporting_reads_come_from_the_secondary(server, replica):
+    async def run():
+        await server.deps.db.users.insert_one({"id": "u1", "total_score": 10})
+        await replica.users.insert_one({"id": "u1", "total_score": 7})
+        return await server.find_one_reporting("users", {"id": "u1"}, {"_id": 0})
+
+    # the (stale) replica answers while it has the document
+    assert asyncio.run(run()) == {"id": "u1", "total_score": 7}
+
+
+def test_a_miss_on_the_secondary_falls_back_to_the_primary(server, replica):
+    claims = {"id": "u2", "sid": None, "display_name": "Ann", "guest": True}
+
+    async def run():
+        # a quiz that just finished: written to the primary, not replicated yet
+        await server.deps.db.quiz_sessions.insert_one({
+            "id": "s-new", "user_id": "u2", "completed": True,
+            "questions": [{"question": "Q?", "correct_answer": "a"}]})
+        response = await server.get_quiz_session("s-new", user=claims)
+        missing = await server.find_one_reporting("quiz_sessions", {"id": "nope"}, {"_id": 0})
+        return response, missing
+
+    response, missing = asyncio.run(run())
+    # a plain dict, or an orjson response with FAST_JSON=on
+    session = response if isinstance(response, dict) else json.loads(response.body)
+    assert session["id"] == "s-new"
+    assert session["questions"] == [{"question": "Q?"}]
+    assert missing is None
+
+
+def test_reporting_handle_uses_secondaries_with_max_staleness(monkeypatch):
+    class FakeDatabase:
+        def __init__(self, options=None):
+            self.options = options
+
+        def with_options(self, **options):
+            return FakeDatabase(options)
+
+    monkeypatch.setattr(database, "MONGO_MAX_STALENESS_SECONDS", 90)
+    monkeypatch.setitem(database.OPERATION_CLASSES, "reporting", ("secondaryPreferred", None))
+    deps = container.Container({"db_name": "test"})
+    deps._db = FakeDatabase()
+    read = deps.db_for("reporting").options["read_preference"]
+    assert isinstance(read, SecondaryPreferred) and read.max_staleness == 90
+    assert deps.db_for("default") is deps._db
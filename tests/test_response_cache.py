@@ -0,0 +1,91 @@
+import asyncio
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+import cache
+import response_cache
+
+ORIGIN = "https://quiz.example.com"
+
+
+def cached_app():
+    calls = []
+    tier = cache.MemoryCache()
+
+    async def stats(request):
+        calls.append(request.headers.get("x-user"))
+        return JSONResponse({"user": request.headers.get("x-user"), "calls": len(calls)})
+
+    app = Starlette(routes=[Route("/stats", stats), Route("/board", stats)])
+    app.add_middleware(
+        response_cache.ResponseCacheMiddleware,
+        rules=[response_cache.Rule("/stats", ["user:{user_id}"]),
+               response_cache.Rule("/board", ["board"], public=True)],
+        get_cache=lambda: tier,
+        identify=lambda headers: headers.get("x-user"),
+    )
+    return TestClient(app), tier, calls
+
+
+def test_etag_is_per_user_and_served_without_the_handler():
+    client, tier, calls = cached_app()
+    ann = client.get("/stats", headers={"x-user": "ann"})
+    bob = client.get("/stats", headers={"x-user": "bob"})
+    assert ann.headers["etag"] != bob.headers["etag"]
+    assert ann.headers["cache-control"] == "private, no-cache"
+
+    again = client.get("/stats", headers={"x-user": "ann"})
+    assert again.headers["x-cache"] == "hit" and again.json() == ann.json()
+    not_modified = client.get("/stats", headers={"x-user": "ann", "If-None-Match": f'W/"x", {ann.headers["etag"]}'})
+    assert not_modified.status_code == 304 and not_modified.content == b""
+    assert calls == ["ann", "bob"]
+
+
+def test_bump_invalidates_only_the_named_counters():
+    client, tier, calls = cached_app()
+    ann = client.get("/stats", headers={"x-user": "ann"})
+    bob = client.get("/stats", headers={"x-user": "bob"})
+    asyncio.run(response_cache.bump(tier, "user:ann"))
+
+    fresh = client.get("/stats", headers={"x-user": "ann", "If-None-Match": ann.headers["etag"]})
+    assert fresh.status_code == 200 and fresh.headers["x-cache"] == "miss"
+    assert fresh.headers["etag"] != ann.headers["etag"]
+    assert client.get("/stats", headers={"x-user": "bob", "If-None-Match": bob.headers["etag"]}).status_code == 304
+
+
+def test_anonymous_requests_skip_private_rules():
+    client, tier, calls = cached_app()
+    for _ in range(2):
+        response = client.get("/stats")
+        assert "etag" not in response.headers
+    public = client.get("/board")
+    assert public.headers["cache-control"] == "public, no-cache"
+    assert client.get("/board").headers["x-cache"] == "hit"
+    assert calls == [None, None, None]
+
+
+def test_etag_matches():
+    assert response_cache.etag_matches("*", 'W/"a"')
+    assert response_cache.etag_matches('W/"b" , W/"a"', 'W/"a"')
+    assert not response_cache.etag_matches('W/"b"', 'W/"a"')
+
+
+def test_cors_headers_on_cached_responses(server):
+    client = TestClient(server.app)
+    headers = {"Origin": ORIGIN}
+
+    miss = client.get("/api/leaderboard", headers=headers)
+    assert miss.status_code == 200
+    assert miss.headers["x-cache"] == "miss"
+    assert "access-control-allow-origin" in miss.headers
+
+    hit = client.get("/api/leaderboard", headers=headers)
+    assert hit.headers["x-cache"] == "hit"
+    assert hit.headers["access-control-allow-origin"] == miss.headers["access-control-allow-origin"]
+
+    not_modified = client.get("/api/leaderboard", headers={**headers, "If-None-Match": miss.headers["etag"]})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["access-control-allow-origin"] == miss.headers["access-control-allow-origin"]
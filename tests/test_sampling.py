@@ -0,0 +1,92 @@
+import random
+from collections import Counter
+
+import pytest
+
+import catalog
+import sampling
+
+WEIGHTS = [1, 2, 3, 4]
+DRAWS = 40000
+
+
+def frequencies(draw, n=DRAWS):
+    counts = Counter(draw() for _ in range(n))
+    return {item: count / n for item, count in counts.items()}
+
+
+def test_draws_follow_the_weights():
+    table, rng = sampling.WeightTree(zip("abcd", "abcd", WEIGHTS)), random.Random(1)
+    observed = frequencies(lambda: table.draw(rng))
+    for item, weight in zip("abcd", WEIGHTS):
+        assert observed[item] == pytest.approx(weight / sum(WEIGHTS), abs=0.01)
+
+
+def build(items, weights):
+    return sampling.WeightTree(zip(items, items, weights))
+
+
+def test_draw_distinct():
+    rng = random.Random(2)
+    table = build(list(range(10)), [1000] + [1] * 9)
+    for k in (1, 3, 9):
+        picked = table.draw_distinct(k, rng)
+        assert len(picked) == k == len(set(picked))
+    # a very heavy item is nearly always among the picks
+    assert sum(0 in table.draw_distinct(2, rng) for _ in range(200)) > 190
+    assert sorted(table.draw_distinct(50, rng)) == list(range(10))
+    assert build([], []).draw_distinct(3, rng) == []
+
+
+def test_draw_distinct_falls_back_to_uniform_for_zero_weights():
+    rng = random.Random(3)
+    for table in (build("abc", [0, 0, 0]), build("abc", [1, 0, 0])):
+        picked = table.draw_distinct(2, rng)
+        assert len(set(picked)) == 2 and set(picked) <= set("abc")
+
+
+def test_find_never_returns_an_item_drawn_earlier():
+    tree = build("abc", [1, 1, 1])
+    # as in draw_distinct: "c" is drawn, so its weight is zeroed in the tree
+    tree._add(2, -1)
+    # a target at (or rounded past) the end must land on a live item
+    assert tree._find(tree.total) == 1
+    assert tree._find(tree.total + 1e-9) == 1
+    tree._add(1, -1)
+    assert tree._find(5) == 0
+
+
+def test_weight_tree_updates_in_place():
+    tree, rng = sampling.WeightTree(zip("ab", "ab", [1, 1])), random.Random(4)
+    tree.set("a", "A", 3)
+    tree.set("c", "c", 4)
+    assert tree.total == pytest.approx(8)
+    observed = frequencies(lambda: tree.draw(rng))
+    assert observed == pytest.approx({"A": 3 / 8, "b": 1 / 8, "c": 4 / 8}, abs=0.01)
+    tree.draw_distinct(2, rng)
+    assert tree.total == pytest.approx(8)
+
+
+def test_weight_tree_prefix_sums_match_for_any_size():
+    rng = random.Random(5)
+    for n in range(1, 40):
+        weights = [rng.random() for _ in range(n)]
+        built = sampling.WeightTree(zip(range(n), range(n), weights))
+        grown = sampling.WeightTree()
+        for i, w in enumerate(weights):
+            grown.set(i, i, w)
+        for count in range(n + 1):
+            assert built._prefix(count) == pytest.approx(sum(weights[:count]))
+            assert grown._prefix(count) == pytest.approx(sum(weights[:count]))
+
+
+def test_catalog_upsert_reweights_existing_tables():
+    tracks = [{"id": f"t{i}", "popularity": 50, "has_preview": True, "genres": ["rock"]} for i in range(5)]
+    cat = catalog.Catalog(tracks)
+    table = cat._table("genres", "rock", 0.0)
+    cat.upsert({"id": "t0", "has_preview": False}, {"genres": ["rock", "indie"]})
+    cat.upsert({"id": "t9", "popularity": 50, "has_preview": True, "genres": ["rock"]})
+    assert cat._table("genres", "rock", 0.0) is table
+    assert len(table) == 6
+    assert table.total == pytest.approx(5 + catalog.CATALOG_NO_PREVIEW_WEIGHT)
+    assert cat.sample("genres", "indie", 3) == [cat._copy(cat.tracks["t0"])]
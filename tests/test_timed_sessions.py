@@ -0,0 +1,110 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import timers
+
+
+async def nothing(expired):
+    pass
+
+
+def engine(grace=2.0):
+    return timers.SessionTimerEngine(nothing, grace=grace, resolution=0.01)
+
+
+def test_pop_expired_waits_for_the_grace_period():
+    timer = engine()
+    deadline = timer.add("s1", 10)
+    assert timer.pop_expired(deadline + 1) == []
+    assert not timer.is_expired("s1")
+    assert timer.pop_expired(deadline + 2) == ["s1"]
+    assert not timer.tracks("s1")
+    assert timer.pop_expired(deadline + 100) == []
+
+
+def test_pop_expired_skips_discarded_and_readded_sessions():
+    timer = engine(grace=0)
+    timer.add("gone", 1)
+    timer.discard("gone")
+    first = timer.add("again", 1)
+    second = timer.add("again", 5)
+    timer.add("due", 2)
+    assert timer.pop_expired(first + 3) == ["due"]
+    assert timer.pop_expired(second) == ["again"]
+    assert timer.heap == []
+
+
+def test_scheduler_hands_expiries_to_one_callback():
+    batches = []
+
+    async def run():
+        async def on_expired(expired):
+            batches.append(sorted(expired))
+
+        timer = timers.SessionTimerEngine(on_expired, grace=0, resolution=0.05)
+        timer.start()
+        timer.add("a", 0.01)
+        timer.add("b", 0.02)
+        await asyncio.sleep(0.2)
+        await timer.stop()
+
+    asyncio.run(run())
+    assert batches == [["a", "b"]]
+
+
+async def add_session(server, session_id="s1", user_id="u1"):
+    await server.deps.db.users.insert_one({"id": user_id, "display_name": "Ann", "total_games": 0})
+    await server.deps.db.quiz_sessions.insert_one({
+        "id": session_id,
+        "user_id": user_id,
+        "mode": "educational",
+        "difficulty": "easy",
+        "edu_level": "easy",
+        "questions": [{"question": "Q?", "options": ["a", "b"], "correct_answer": "a", "question_id": "q1"}],
+        "answers": [],
+        "score": 0,
+        "current_index": 0,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "completed": False,
+        "time_limit": 60,
+        "scoring": "standard",
+    })
+
+
+async def total_games(server, user_id="u1"):
+    return (await server.deps.db.users.find_one({"id": user_id}))["total_games"]
+
+
+def test_expiry_counts_each_session_once(server):
+    async def run():
+        await add_session(server)
+        await server.complete_expired_sessions(["s1"])
+        await server.complete_expired_sessions(["s1"])
+        return await total_games(server)
+
+    assert asyncio.run(run()) == 1
+
+
+def test_answer_after_expiry_is_rejected_and_not_counted(server, monkeypatch):
+    async def run():
+        await add_session(server)
+        await server.complete_expired_sessions(["s1"])
+        # the answer read the session just before the timer completed it
+        collection = type(server.deps.db.quiz_sessions)
+        find_one = collection.find_one
+
+        async def stale_find_one(self, *args, **kwargs):
+            doc = await find_one(self, *args, **kwargs)
+            return dict(doc, completed=False) if doc and "questions" in doc else doc
+
+        monkeypatch.setattr(collection, "find_one", stale_find_one)
+        request = server.QuizAnswerRequest(session_id="s1", question_index=0, answer="a")
+        claims = {"id": "u1", "sid": None, "display_name": "Ann", "guest": True}
+        with pytest.raises(HTTPException) as e:
+            await server.answer_question(request, claims)
+        return e.value.status_code, await total_games(server)
+
+    assert asyncio.run(run()) == (400, 1)
@@ -0,0 +1,104 @@
+import asyncio
+import time
+from datetime import datetime, timezone, timedelta
+
+import jwt as pyjwt
+import pytest
+
+import tokens
+
+SECRET = "legacy-secret-for-tests-0123456789abcdef"
+KEYS = "k2:new-secret-for-tests-0123456789abcdef,k1:old-secret-for-tests-0123456789abcdef"
+
+
+def legacy_token(secret=SECRET, exp_in=3600):
+    return pyjwt.encode({"user_id": "u1", "exp": int(time.time()) + exp_in}, secret, algorithm="HS256")
+
+
+def iso(hours):
+    return (datetime.now(timezone.utc) + timedelta(hours=hours)).isoformat()
+
+
+@pytest.mark.parametrize("secret, keys", [
+    (None, ""),
+    ("", ""),
+    ("fallback_secret", ""),
+    (SECRET, "k1:fallback_secret"),
+])
+def test_refuses_missing_or_default_secrets(secret, keys):
+    with pytest.raises(ValueError):
+        tokens.TokenService(secret, keys)
+
+
+def test_issued_tokens_verify_with_any_listed_key():
+    old = tokens.TokenService(None, "k1:old-secret-for-tests-0123456789abcdef")
+    token = old.issue({"id": "u1", "display_name": "Ann"}, "sid1")
+    claims = tokens.TokenService(None, KEYS).verify(token)
+    assert claims == {"id": "u1", "sid": "sid1", "display_name": "Ann", "guest": False}
+
+
+def test_kidless_tokens_verify_with_jwt_secret_without_jwt_keys():
+    assert tokens.TokenService(SECRET).verify(legacy_token())["id"] == "u1"
+
+
+def test_kidless_tokens_rejected_once_jwt_keys_is_set():
+    with pytest.raises(tokens.TokenError):
+        tokens.TokenService(SECRET, KEYS).verify(legacy_token())
+
+
+def test_kidless_tokens_accepted_only_until_the_cutoff():
+    assert tokens.TokenService(SECRET, KEYS, iso(1)).verify(legacy_token())["id"] == "u1"
+    with pytest.raises(tokens.TokenError):
+        tokens.TokenService(SECRET, KEYS, iso(-1)).verify(legacy_token())
+    with pytest.raises(tokens.TokenError):
+        tokens.TokenService(SECRET, KEYS, iso(1)).verify(legacy_token("forged-with-another-secret-0123456789"))
+
+
+def test_cached_kidless_claims_expire_at_the_cutoff():
+    service = tokens.TokenService(SECRET, KEYS, iso(1))
+    token = legacy_token(exp_in=24 * 3600)
+    service.verify(token)
+    expires_at, _ = service.verified.entries[token]
+    assert expires_at <= time.monotonic() + 3600
+
+
+def refresh_db():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    return mongomock_motor.AsyncMongoMockClient()["tokens_test"]
+
+
+def test_rotate_issues_a_new_secret_and_revokes_on_reuse():
+    async def run():
+        db = refresh_db()
+        sid, first = await tokens.create_session(db, "u1", {"access_token": "sp"})
+        assert (await db[tokens.SESSIONS].find_one({"_id": sid}))["spotify"] == {"access_token": "sp"}
+        session, second = await tokens.rotate(db, first)
+        assert session["user_id"] == "u1" and second.startswith(f"{sid}.") and second != first
+        # the tab that lost the race inside the grace window: no new token
+        raced, none = await tokens.rotate(db, first)
+        assert raced["_id"] == sid and none is None
+        with pytest.raises(tokens.TokenError, match="reused"):
+            await tokens.rotate(db, first, grace_seconds=0)
+        # the whole session is gone, including the current secret
+        with pytest.raises(tokens.TokenError):
+            await tokens.rotate(db, second)
+        return (await db[tokens.SESSIONS].find_one({"_id": sid}))["revoked"]
+
+    assert asyncio.run(run()) is True
+
+
+def test_revoke_and_expiry_end_the_session():
+    async def run():
+        db = refresh_db()
+        _, token = await tokens.create_session(db, "u1")
+        await tokens.revoke(db, token)
+        with pytest.raises(tokens.TokenError):
+            await tokens.rotate(db, token)
+        _, expired = await tokens.create_session(db, "u1", refresh_days=-1)
+        with pytest.raises(tokens.TokenError, match="Invalid"):
+            await tokens.rotate(db, expired)
+        for malformed in ("", "nodot", ".secret"):
+            with pytest.raises(tokens.TokenError):
+                await tokens.rotate(db, malformed)
+
+    asyncio.run(run())
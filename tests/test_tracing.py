@@ -0,0 +1,28 @@
+import asyncio
+
+import tracing
+
+
+def test_profiler_saves_and_prunes_off_the_loop(tmp_path, monkeypatch):
+    threaded = []
+    to_thread = asyncio.to_thread
+
+    async def spy(func, *args):
+        threaded.append(func.__name__)
+        return await to_thread(func, *args)
+
+    monkeypatch.setattr(asyncio, "to_thread", spy)
+    profiler = tracing.Profiler(every=1, directory=tmp_path, keep=1)
+
+    async def run():
+        for trace_id in ("a" * 32, "b" * 32):
+            assert profiler.should_profile()
+            await profiler.stop(profiler.start(), trace_id, "route", 1.0)
+
+    asyncio.run(run())
+    assert threaded == ["_save", "_prune", "_save", "_prune"]
+    assert not profiler.active
+    [latest] = profiler.recent
+    assert latest["trace_id"] == "b" * 32
+    assert [p.stem for p in tmp_path.iterdir()] == [latest["id"]]
+    assert "function calls" in profiler.summary(latest["id"])
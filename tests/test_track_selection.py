@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+import cache
+import providers
+
+
+class ForcedPreviews(providers.SyntheticPreviewProvider):
+    """Synthetic previews, except for the track names in `missing`."""
+
+    def __init__(self, missing):
+        super().__init__(missing_rate=0)
+        self.missing = set(missing)
+        self.looked_up = []
+
+    async def find_preview(self, track_name, artist_name):
+        self.looked_up.append(track_name)
+        if track_name in self.missing:
+            return None
+        return await super().find_preview(track_name, artist_name)
+
+
+@pytest.fixture
+def previews(server, monkeypatch):
+    def use(missing=()):
+        provider = ForcedPreviews(missing)
+        monkeypatch.setattr(server.deps, "_preview_provider", provider)
+        monkeypatch.setattr(server.deps, "_cache", cache.MemoryCache())
+        monkeypatch.setattr(server, "PREVIEW_REPLACE_ROUNDS", 2)
+        return provider
+    return use
+
+
+def tracks(*names, has_preview=None):
+    return [{"id": n, "name": n, "artists": ["Band"], "has_preview": has_preview} for n in names]
+
+
+def select(server, selected, overflow):
+    return asyncio.run(server.select_tracks_with_previews(selected, overflow))
+
+
+def names(result):
+    return [t["name"] for t in result]
+
+
+def test_only_selected_tracks_are_looked_up_when_all_have_previews(server, previews):
+    provider = previews()
+    result = select(server, tracks("a", "b", "c"), tracks("x", "y"))
+    assert names(result) == ["a", "b", "c"]
+    assert all(t["preview_url"] for t in result)
+    assert sorted(provider.looked_up) == ["a", "b", "c"]
+
+
+def test_silent_tracks_are_replaced_from_the_overflow(server, previews):
+    provider = previews(missing={"b", "x"})
+    result = select(server, tracks("a", "b", "c"), tracks("x", "y", "z"))
+    # round 1 swaps b for x (also silent), round 2 takes y
+    assert names(result) == ["a", "c", "y"]
+    assert provider.looked_up.count("z") == 0
+
+
+def test_known_previews_are_tried_first(server, previews):
+    provider = previews(missing={"b"})
+    overflow = tracks("miss", has_preview=False) + tracks("live") + tracks("known", has_preview=True)
+    result = select(server, tracks("a", "b"), overflow)
+    assert names(result) == ["a", "known"]
+    assert "live" not in provider.looked_up and "miss" not in provider.looked_up
+
+
+def test_silent_tracks_fill_the_quiz_when_candidates_run_out(server, previews):
+    previews(missing={"b", "c", "x"})
+    result = select(server, tracks("a", "b", "c"), tracks("x"))
+    assert names(result) == ["a", "b", "c"]
+    assert [bool(t["preview_url"]) for t in result] == [True, False, False]
+
+
+def test_replacement_stops_after_the_configured_rounds(server, previews, monkeypatch):
+    provider = previews(missing={"b", "x", "y"})
+    monkeypatch.setattr(server, "PREVIEW_REPLACE_ROUNDS", 1)
+    result = select(server, tracks("a", "b"), tracks("x", "y", "z"))
+    assert names(result) == ["a", "b"]
+    assert "y" not in provider.looked_up